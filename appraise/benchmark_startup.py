@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Project: Appraise evaluation system
+ Author: Christian Federmann <cfedermann@gmail.com>
+
+usage: python benchmark_startup.py [-h] [--commands COMMANDS] [--repeat N]
+                                   [--imports N] [--budget FACTOR]
+
+Measures cold-start times of manage.py commands and worker processes.
+
+Each measurement starts a fresh Python interpreter, so module imports are
+cold while the operating system's file cache is warm.  Worker boot covers
+everything a FastCGI worker does before serving its first request:  loading
+settings and middleware and importing all URL patterns and views.  Medians
+are compared to STARTUP_BUDGETS;  exceeding a budget makes the script exit
+with status 1.
+
+optional arguments:
+  -h, --help           Show this help message and exit.
+  --commands COMMANDS  Comma-separated manage.py commands to measure.
+  --repeat N           Number of measurements per command.
+  --imports N          Number of slowest imports of worker boot to list.
+  --budget FACTOR      Factor applied to all budgets, e.g. for slow hosts.
+
+"""
+from time import time
+import __builtin__
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+PARSER = argparse.ArgumentParser(description="Measures cold-start times " \
+  "of manage.py commands and worker processes.")
+PARSER.add_argument("--commands", action="store", default="help,validate",
+  dest="commands", help="Comma-separated manage.py commands to measure.")
+PARSER.add_argument("--repeat", action="store", default=5, dest="repeat",
+  metavar="N", help="Number of measurements per command.", type=int)
+PARSER.add_argument("--imports", action="store", default=15, dest="imports",
+  metavar="N", help="Number of slowest imports of worker boot to list.",
+  type=int)
+PARSER.add_argument("--budget", action="store", default=1.0, dest="budget",
+  metavar="FACTOR", help="Factor applied to all budgets, e.g. for slow " \
+  "hosts.", type=float)
+PARSER.add_argument("--boot-worker", action="store_true", default=False,
+  dest="boot_worker", help=argparse.SUPPRESS)
+
+# Cold-start budgets in seconds, including interpreter startup.  Commands
+# without budget are measured but never fail.
+STARTUP_BUDGETS = {
+  'manage.py help': 0.5,
+  'manage.py validate': 0.8,
+  'worker boot': 0.8,
+}
+
+
+def _iter_callbacks(resolver):
+    """
+    Yields the view functions of all URL patterns, importing their modules.
+    """
+    for pattern in resolver.url_patterns:
+        if hasattr(pattern, 'url_patterns'):
+            for callback in _iter_callbacks(pattern):
+                yield callback
+        
+        else:
+            yield pattern.callback
+
+
+def boot_worker():
+    """
+    Loads everything a worker needs before serving its first request.
+    
+    Prints a JSON list of [module, seconds] pairs for all imports, where
+    seconds includes the imports of the module itself.
+    
+    """
+    _import = __builtin__.__import__
+    _seconds = {}
+    
+    def _timed_import(name, *args, **kwargs):
+        """Imports the given module, timing first imports only."""
+        if name in sys.modules:
+            return _import(name, *args, **kwargs)
+        
+        _start = time()
+        try:
+            return _import(name, *args, **kwargs)
+        
+        finally:
+            _seconds[name] = _seconds.get(name, 0) + time() - _start
+    
+    __builtin__.__import__ = _timed_import
+    
+    # Properly set DJANGO_SETTINGS_MODULE environment variable.
+    os.environ['DJANGO_SETTINGS_MODULE'] = 'settings'
+    PROJECT_HOME = os.path.normpath(os.getcwd() + "/..")
+    sys.path.append(PROJECT_HOME)
+    
+    from django.core.handlers.wsgi import WSGIHandler
+    from django.core.urlresolvers import get_resolver
+    
+    WSGIHandler().load_middleware()
+    list(_iter_callbacks(get_resolver(None)))
+    
+    __builtin__.__import__ = _import
+    print json.dumps(sorted(_seconds.items(), key=lambda x: -x[1]))
+
+
+def measure(command):
+    """
+    Runs command in a fresh interpreter, returns wall time and output.
+    """
+    _start = time()
+    _output = subprocess.check_output(command, stderr=subprocess.STDOUT)
+    return time() - _start, _output
+
+
+if __name__ == "__main__":
+    args = PARSER.parse_args()
+    
+    if args.boot_worker:
+        boot_worker()
+        sys.exit(0)
+    
+    COMMANDS = [('manage.py {0}'.format(x), [sys.executable, 'manage.py',
+      x]) for x in args.commands.split(',')]
+    COMMANDS.append(('worker boot', [sys.executable, __file__,
+      '--boot-worker']))
+    
+    EXCEEDED = []
+    print '{0:24} {1:>8} {2:>8} {3:>8}'.format('command', 'median', 'max',
+      'budget')
+    for name, command in COMMANDS:
+        _times = []
+        for _ in range(args.repeat):
+            _seconds, _output = measure(command)
+            _times.append(_seconds)
+        _times.sort()
+        _median = _times[len(_times) // 2]
+        
+        _budget = STARTUP_BUDGETS.get(name)
+        if _budget is not None:
+            _budget *= args.budget
+            if _median > _budget:
+                EXCEEDED.append(name)
+        
+        print '{0:24} {1:7.3f}s {2:7.3f}s {3:>8}'.format(name, _median,
+          _times[-1], '-' if _budget is None else '{0:.3f}s'.format(
+          _budget))
+    
+    # The output of the last worker boot lists its imports.
+    IMPORTS = json.loads(_output.strip().split('\n')[-1])
+    print
+    print 'Slowest imports of worker boot, including their own imports:'
+    for module, seconds in IMPORTS[:args.imports]:
+        print '  {0:7.3f}s {1}'.format(seconds, module)
+    
+    print
+    for name in EXCEEDED:
+        print '{0} exceeds its cold-start budget.'.format(name)
+    print '{0} budgets exceeded.'.format(len(EXCEEDED))
+    
+    if EXCEEDED:
+        sys.exit(1)
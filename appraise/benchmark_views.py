@@ -0,0 +1,581 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Project: Appraise evaluation system
+ Author: Christian Federmann <cfedermann@gmail.com>
+
+usage: python benchmark_views.py [-h] [--sizes SIZES]
+                                 [--language-pairs LANGUAGE_PAIRS]
+                                 [--repeat N] [--views VIEWS]
+                                 [--output FILE] [--compare BASELINE]
+                                 [--results FILE] [--tolerance FRACTION]
+                                 [--seed SEED]
+
+Benchmarks SQL query counts, wall time and peak memory of Appraise views.
+
+For each dataset size, a synthetic campaign is created in a fresh SQLite
+database:  SIZE HITs per language pair with one set of ranking results each,
+see appraise.wmt13.synthetic, and one evaluation task per task type with at
+least SIZE / 10 items.  Each view is then requested through the Django test
+client N times, every time in a forked child process so that module-level
+caches are cold and the peak memory growth of the request can be measured.
+Medians are reported.
+
+With --output, results are written to a JSON file which can later be used
+as baseline for --compare;  regressions are listed and make the script exit
+with status 1.  Using --results, an existing results file is compared
+instead of running the benchmarks.
+
+optional arguments:
+  -h, --help            Show this help message and exit.
+  --sizes SIZES         Comma-separated dataset sizes, in HITs per language
+                        pair.
+  --language-pairs LANGUAGE_PAIRS
+                        Comma-separated language pair codes, all by default.
+  --repeat N            Number of measurements per view and size.
+  --views VIEWS         Comma-separated view name prefixes to benchmark,
+                        e.g. wmt13.status;  all views by default.
+  --output FILE         Write results to the given JSON file.
+  --compare BASELINE    Compare results to the given baseline JSON file.
+  --results FILE        Compare this results file instead of running the
+                        benchmarks.
+  --tolerance FRACTION  Relative increase of wall time or peak memory which
+                        is reported as regression.
+  --seed SEED           Seed for the random number generators.
+
+"""
+from datetime import datetime
+from time import time
+import argparse
+import json
+import logging
+import os
+import resource
+import shutil
+import sys
+import tempfile
+
+import numpy as np
+
+PARSER = argparse.ArgumentParser(description="Benchmarks SQL query " \
+  "counts, wall time and peak memory of Appraise views.")
+PARSER.add_argument("--sizes", action="store", default="100,500",
+  dest="sizes", help="Comma-separated dataset sizes, in HITs per language " \
+  "pair.")
+PARSER.add_argument("--language-pairs", action="store", default=None,
+  dest="language_pairs", help="Comma-separated language pair codes, all " \
+  "by default.")
+PARSER.add_argument("--repeat", action="store", default=5, dest="repeat",
+  metavar="N", help="Number of measurements per view and size.", type=int)
+PARSER.add_argument("--views", action="store", default=None, dest="views",
+  help="Comma-separated view name prefixes to benchmark, e.g. " \
+  "wmt13.status;  all views by default.")
+PARSER.add_argument("--output", action="store", default=None,
+  dest="output", metavar="FILE", help="Write results to the given JSON " \
+  "file.")
+PARSER.add_argument("--compare", action="store", default=None,
+  dest="compare", metavar="BASELINE", help="Compare results to the given " \
+  "baseline JSON file.")
+PARSER.add_argument("--results", action="store", default=None,
+  dest="results", metavar="FILE", help="Compare this results file instead " \
+  "of running the benchmarks.")
+PARSER.add_argument("--tolerance", action="store", default=0.25,
+  dest="tolerance", metavar="FRACTION", help="Relative increase of wall " \
+  "time or peak memory which is reported as regression.", type=float)
+PARSER.add_argument("--seed", action="store", default=None, dest="seed",
+  help="Seed for the random number generators.", type=int)
+
+# Relative increase of the query count which is reported as regression.
+QUERY_TOLERANCE = 0.1
+
+# Absolute differences below these values are considered to be noise.
+MIN_SECONDS = 0.005
+MIN_MEMORY_KB = 1024
+
+# Number of annotators with results for each evaluation task.
+EVALUATION_USERS = 5
+
+# Fraction of evaluation items each of these annotators has completed.
+EVALUATION_COMPLETED = 0.8
+
+# Number of items left open for the staff user sending the requests.
+STAFF_OPEN_ITEMS = 10
+
+# Password of the users which send the benchmark requests.
+BENCHMARK_PASSWORD = 'benchmark'
+
+# View name suffixes for evaluation task types.
+TASK_TYPE_NAMES = {
+  '1': 'quality_checking',
+  '2': 'ranking',
+  '3': 'postediting',
+  '4': 'error_classification',
+  '5': 'three_way_ranking',
+}
+
+
+def create_evaluation_task(task_type, items, users, staff, random):
+    """
+    Creates an EvaluationTask of the given type with items items.
+    
+    Each of the given users has completed a random selection of the items,
+    using results in the format created by the respective task handler.
+    The staff user has completed all but the last STAFF_OPEN_ITEMS items.
+    
+    """
+    from xml.etree.ElementTree import Element, SubElement, tostring
+    from django.core.files.base import ContentFile
+    from appraise.evaluation.models import EvaluationItem, \
+      EvaluationResult, EvaluationTask
+    
+    _name = TASK_TYPE_NAMES[task_type]
+    _translations = 2 if _name == 'three_way_ranking' else 5
+    _set = Element('set', {'id': _name, 'source-language': 'German',
+      'target-language': 'English'})
+    for index in range(items):
+        segment = SubElement(_set, 'seg', {'id': str(index),
+          'doc-id': 'benchmark{0}'.format(index // 10)})
+        SubElement(segment, 'source').text = \
+          'Source sentence [[[{0}]]] for benchmarks.'.format(index)
+        SubElement(segment, 'reference').text = \
+          'Reference translation {0}.'.format(index)
+        for system in range(_translations):
+            SubElement(segment, 'translation', {'system': 'system{0}'.format(
+              system)}).text = 'Translation {0} by system {1}.'.format(
+              index, system)
+    
+    task = EvaluationTask(task_name='Benchmark {0}'.format(_name),
+      task_type=task_type)
+    task.task_xml.save('benchmark-{0}.xml'.format(_name),
+      ContentFile(tostring(_set)), save=False)
+    task.save()
+    task.users.add(staff, *users)
+    
+    _results = {
+      'quality_checking': lambda: str(random.choice(['ACCEPTABLE',
+        'CAN_EASILY_BE_FIXED', 'NONE_OF_BOTH'])),
+      'ranking': lambda: ','.join([str(x) for x in random.randint(1, 6,
+        _translations)]),
+      'postediting': lambda: '{0}\nPost-edited translation.'.format(
+        random.randint(_translations)),
+      'error_classification': lambda: '0=terminology:MINOR',
+      'three_way_ranking': lambda: str(random.choice(['A>B', 'A=B',
+        'A<B'])),
+    }[_name]
+    
+    results = []
+    _items = list(EvaluationItem.objects.filter(task=task))
+    for index, item in enumerate(_items):
+        for user in users + [staff]:
+            if user == staff and index < len(_items) - STAFF_OPEN_ITEMS \
+              or user != staff and random.uniform() < EVALUATION_COMPLETED:
+                results.append(EvaluationResult(item=item, user=user,
+                  duration='00:00:{0:02d}'.format(random.randint(5, 60)),
+                  raw_result=_results()))
+    
+    # Using bulk_create() avoids filling APPRAISE_TASK_CACHE via signals.
+    EvaluationResult.objects.bulk_create(results)
+    return task
+
+
+def create_benchmark_user(username, groups=(), is_staff=False):
+    """
+    Creates a user with BENCHMARK_PASSWORD in the given groups.
+    """
+    from django.contrib.auth.models import Group, User
+    
+    user = User(username=username, is_staff=is_staff)
+    user.set_password(BENCHMARK_PASSWORD)
+    user.save()
+    for name in groups:
+        user.groups.add(Group.objects.get_or_create(name=name)[0])
+    return user
+
+
+def create_dataset(size, language_pairs, seed):
+    """
+    Creates the benchmark dataset for the given size.
+    
+    Returns a dict with the users, HIT and EvaluationTask instances used to
+    build the benchmark requests.
+    
+    """
+    from django.contrib.auth.models import User
+    from appraise.evaluation.models import APPRAISE_TASK_TYPE_CHOICES
+    from appraise.wmt13.synthetic import create_large_campaign
+    from appraise.wmt13.views import _compute_next_task_for_user
+    
+    random = np.random.RandomState(seed)
+    create_large_campaign(language_pairs, size, 10 * len(language_pairs),
+      3 * size * len(language_pairs), seed=seed)
+    
+    annotator = create_benchmark_user('benchmark-annotator', ('WMT13',
+      language_pairs[0]))
+    staff = create_benchmark_user('benchmark-staff', is_staff=True)
+    
+    _users = [User.objects.create(username='benchmark-user{0}'.format(x))
+      for x in range(EVALUATION_USERS)]
+    tasks = {}
+    for task_type, _unused in APPRAISE_TASK_TYPE_CHOICES:
+        tasks[task_type] = create_evaluation_task(task_type,
+          max(2 * STAFF_OPEN_ITEMS, size // 10), _users, staff, random)
+    
+    return {
+      'annotator': annotator,
+      'hit': _compute_next_task_for_user(annotator, language_pairs[0]),
+      'staff': staff,
+      'tasks': tasks,
+    }
+
+
+def _wmt13_ranking_data(hit, user):
+    """
+    Returns POST data ranking the next item of the given HIT.
+    """
+    from appraise.wmt13.models import RankingTask
+    from appraise.wmt13.views import _find_next_item_to_process
+    
+    items = RankingTask.objects.filter(hit=hit)
+    item = _find_next_item_to_process(items, user) or items[0]
+    _now = time()
+    data = {'item_id': item.id, 'start_timestamp': _now - 60,
+      'end_timestamp': _now, 'order': '0,1,2,3,4', 'submit_button': 'SUBMIT'}
+    for index in range(5):
+        data['rank_{0}'.format(index)] = 1 + index
+    return data
+
+
+def _evaluation_data(task, user):
+    """
+    Returns POST data completing the next item of the given task.
+    """
+    from appraise.evaluation.models import EvaluationItem
+    from appraise.evaluation.views import _find_next_item_to_process
+    
+    items = EvaluationItem.objects.filter(task=task)
+    item = _find_next_item_to_process(items, user) or items[0]
+    _now = time()
+    _order = ','.join([str(x) for x in range(len(item.translations))])
+    data = {'item_id': item.id, 'now': _now, 'start_timestamp': _now - 60,
+      'end_timestamp': _now, 'order': _order}
+    
+    _name = TASK_TYPE_NAMES[task.task_type]
+    if _name == 'quality_checking':
+        data['submit_button'] = 'ACCEPTABLE'
+    
+    elif _name == 'ranking':
+        data['submit_button'] = 'SUBMIT'
+        for index in range(len(item.translations)):
+            data['rank_{0}'.format(index)] = 1 + index
+    
+    elif _name == 'postediting':
+        data.update({'submit_button': 'SUBMIT', 'edit_id': 0,
+          'postedited': 'Post-edited translation.'})
+    
+    elif _name == 'error_classification':
+        data.update({'submit_button': 'SUBMIT', 'words': 1,
+          'terminology_0': 'MINOR'})
+    
+    elif _name == 'three_way_ranking':
+        data.update({'submit_button': 'A>B', 'order_reversed': 'no'})
+    
+    return data
+
+
+def build_cases(dataset):
+    """
+    Returns a list of (name, user, method, url, data) benchmark cases.
+    
+    data is None or a function returning the request data;  it is called
+    right before the request, hence POST requests use the next open item.
+    Cases changing the database come last.
+    
+    """
+    _hit = dataset['hit']
+    _annotator = dataset['annotator']
+    _staff = dataset['staff']
+    _ranking = dataset['tasks']['2']
+    
+    cases = [
+      ('wmt13.overview', _annotator, 'get', '/appraise/wmt13/', None),
+      ('wmt13.hit_handler.get', _annotator, 'get',
+        '/appraise/wmt13/{0}/'.format(_hit.hit_id), None),
+      ('wmt13.mturk_handler', None, 'get', '/appraise/wmt13/mturk/',
+        lambda: {'appraise_id': _hit.hit_id, 'hitId': 'BENCHMARK',
+        'assignmentId': 'BENCHMARK', 'workerId': 'BENCHMARK'}),
+      ('wmt13.status', _annotator, 'get', '/appraise/wmt13/status/', None),
+      ('evaluation.overview', _staff, 'get', '/appraise/evaluation/', None),
+    ]
+    
+    for task_type, task in sorted(dataset['tasks'].items()):
+        cases.append(('evaluation.task_handler.{0}.get'.format(
+          TASK_TYPE_NAMES[task_type]), _staff, 'get',
+          task.get_absolute_url(), None))
+    
+    cases.extend([
+      ('evaluation.status_view', _staff, 'get', '/appraise/status/', None),
+      ('evaluation.status_view.task', _staff, 'get',
+        _ranking.get_status_url(), None),
+      ('evaluation.export_task_results', _staff, 'get',
+        '/appraise/export/{0}/'.format(_ranking.task_id), None),
+      ('evaluation.export_agreement_data', _staff, 'get',
+        '/appraise/agreement/{0}/'.format(_ranking.task_id), None),
+      ('wmt13.hit_handler.post', _annotator, 'post',
+        '/appraise/wmt13/{0}/'.format(_hit.hit_id),
+        lambda: _wmt13_ranking_data(_hit, _annotator)),
+    ])
+    
+    for task_type, task in sorted(dataset['tasks'].items()):
+        cases.append(('evaluation.task_handler.{0}.post'.format(
+          TASK_TYPE_NAMES[task_type]), _staff, 'post',
+          task.get_absolute_url(), lambda task=task: _evaluation_data(task,
+          _staff)))
+    
+    return cases
+
+
+def _measure_request(client, method, url, data):
+    """
+    Sends one request, returns its measurements as a dict.
+    """
+    from django.db import connection
+    
+    # Some task handlers print debug output.
+    sys.stdout = open(os.devnull, 'w')
+    
+    # Connect before measuring, server processes keep their connection.
+    connection.cursor()
+    _data = data() if data else {}
+    connection.use_debug_cursor = True
+    connection.queries = []
+    _memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    _start = time()
+    response = getattr(client, method)(url, _data)
+    
+    return {
+      'status': response.status_code,
+      'queries': len(connection.queries),
+      'seconds': time() - _start,
+      'memory_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        - _memory,
+    }
+
+
+def measure_in_child(function, *args):
+    """
+    Calls function in a forked child process, returns its result dict.
+    
+    Exceptions are returned as dict with an 'error' message.
+    
+    """
+    from django.db import connection
+    
+    # The child must not share the parent's SQLite connection.
+    connection.close()
+    
+    _read, _write = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(_read)
+        try:
+            result = function(*args)
+        
+        # pylint: disable-msg=W0703
+        except Exception, msg:
+            result = {'error': u'{0}: {1}'.format(type(msg).__name__, msg)}
+        
+        with os.fdopen(_write, 'w') as pipe:
+            json.dump(result, pipe)
+        os._exit(0)
+    
+    os.close(_write)
+    with os.fdopen(_read) as pipe:
+        _output = pipe.read()
+    os.waitpid(pid, 0)
+    
+    if not _output:
+        return {'error': 'benchmark process died'}
+    return json.loads(_output)
+
+
+def run_benchmarks(sizes, language_pairs, repeat, views, seed):
+    """
+    Runs all benchmark cases for the given dataset sizes.
+    
+    Returns a dict mapping sizes to dicts mapping view names to median
+    measurements.
+    
+    """
+    from django.conf import settings
+    from django.core.management import call_command
+    from django.core.urlresolvers import resolve
+    from django.db import connection
+    from django.test.client import Client
+    
+    results = {}
+    for size in sizes:
+        _directory = tempfile.mkdtemp(prefix='appraise-benchmark-')
+        try:
+            connection.close()
+            settings.DATABASES['default']['NAME'] = os.path.join(
+              _directory, 'benchmark.db')
+            settings.MEDIA_ROOT = _directory
+            call_command('syncdb', interactive=False, verbosity=0)
+            
+            _start = time()
+            dataset = create_dataset(size, language_pairs, seed)
+            print 'Created dataset of size {0} in {1:.2f}s.'.format(size,
+              time() - _start)
+            
+            results[str(size)] = {}
+            for name, user, method, url, data in build_cases(dataset):
+                if views and not any([name.startswith(x) for x in views]):
+                    continue
+                
+                client = Client()
+                if user is not None:
+                    client.login(username=user.username,
+                      password=BENCHMARK_PASSWORD)
+                
+                # Load middleware, URLconf and view modules once, as a long
+                # running server process would, instead of in each child.
+                client.get('/appraise/wmt13/mturk/')
+                resolve(url)
+                
+                _runs = [measure_in_child(_measure_request, client, method,
+                  url, data) for _ in range(repeat)]
+                _errors = [x['error'] for x in _runs if 'error' in x]
+                if _errors:
+                    _result = {'error': _errors[0]}
+                
+                else:
+                    _result = {'status': _runs[-1]['status']}
+                    for key in ('queries', 'seconds', 'memory_kb'):
+                        _result[key] = float(np.median([x[key]
+                          for x in _runs]))
+                
+                results[str(size)][name] = _result
+                print describe_result(size, name, _result)
+        
+        finally:
+            connection.close()
+            shutil.rmtree(_directory, ignore_errors=True)
+    
+    return results
+
+
+def describe_result(size, name, result):
+    """
+    Returns a String describing the given measurements.
+    """
+    if 'error' in result:
+        return u'{0:>6}  {1:<50} {2}'.format(size, name, result['error'])
+    
+    return u'{0:>6}  {1:<50} {2:>3}  {3:>6.0f} queries  {4:>9.1f}ms  ' \
+      '{5:>8.0f}KB'.format(size, name, result['status'], result['queries'],
+      1000 * result['seconds'], result['memory_kb'])
+
+
+def compare_results(baseline, current, tolerance, views=None):
+    """
+    Returns a list of Strings describing regressions against the baseline.
+    
+    Only sizes contained in the current results and, if given, views with
+    names starting with one of the given prefixes are compared.
+    
+    """
+    regressions = []
+    for size, _views in sorted(baseline.items()):
+        if not size in current:
+            continue
+        
+        for name, _base in sorted(_views.items()):
+            if views and not any([name.startswith(x) for x in views]):
+                continue
+            
+            _current = current[size].get(name)
+            if _current is None:
+                regressions.append(u'{0} at size {1}: not measured'.format(
+                  name, size))
+                continue
+            
+            if 'error' in _current:
+                if not 'error' in _base:
+                    regressions.append(u'{0} at size {1}: {2}'.format(name,
+                      size, _current['error']))
+                continue
+            
+            if 'error' in _base:
+                continue
+            
+            for key, _tolerance, _minimum in (
+              ('queries', QUERY_TOLERANCE, 0),
+              ('seconds', tolerance, MIN_SECONDS),
+              ('memory_kb', tolerance, MIN_MEMORY_KB)):
+                _delta = _current[key] - _base[key]
+                if _delta > _minimum and _current[key] > _base[key] \
+                  * (1 + _tolerance):
+                    regressions.append(u'{0} at size {1}: {2} increased ' \
+                      'from {3:.4g} to {4:.4g}'.format(name, size, key,
+                      _base[key], _current[key]))
+    
+    return regressions
+
+
+if __name__ == "__main__":
+    args = PARSER.parse_args()
+    
+    if args.results and not args.compare:
+        PARSER.error('--results requires --compare')
+    
+    VIEWS = args.views.split(',') if args.views else None
+    if args.results:
+        with open(args.results) as results_file:
+            RESULTS = json.load(results_file)['results']
+    
+    else:
+        # Properly set DJANGO_SETTINGS_MODULE environment variable.
+        os.environ['DJANGO_SETTINGS_MODULE'] = 'settings'
+        PROJECT_HOME = os.path.normpath(os.getcwd() + "/..")
+        sys.path.append(PROJECT_HOME)
+        
+        # Measure production settings, on SQLite databases created per size.
+        from django.conf import settings
+        settings.DEBUG = False
+        settings.TEMPLATE_DEBUG = False
+        settings.DATABASES['default'] = {'ENGINE':
+          'django.db.backends.sqlite3', 'NAME': ''}
+        
+        # Logging of individual requests would dominate timings.
+        logging.disable(logging.INFO)
+        
+        from appraise.settings import COMMIT_TAG
+        from appraise.wmt13.models import LANGUAGE_PAIR_CHOICES
+        
+        if args.language_pairs:
+            LANGUAGE_PAIRS = args.language_pairs.split(',')
+        else:
+            LANGUAGE_PAIRS = [x[0] for x in LANGUAGE_PAIR_CHOICES]
+        
+        RESULTS = run_benchmarks([int(x) for x in args.sizes.split(',')],
+          LANGUAGE_PAIRS, args.repeat, VIEWS, args.seed)
+        
+        if args.output:
+            with open(args.output, 'w') as output_file:
+                json.dump({'created': datetime.now().isoformat(),
+                  'commit_tag': COMMIT_TAG, 'repeat': args.repeat,
+                  'results': RESULTS}, output_file, indent=2,
+                  sort_keys=True)
+    
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            REGRESSIONS = compare_results(json.load(baseline_file)['results'],
+              RESULTS, args.tolerance, VIEWS)
+        
+        print
+        for regression in REGRESSIONS:
+            print regression
+        print '{0} regressions found.'.format(len(REGRESSIONS))
+        
+        if REGRESSIONS:
+            sys.exit(1)
@@ -5,8 +5,13 @@ Project: Appraise evaluation system
  Author: Christian Federmann <cfedermann@gmail.com>
 
 usage: python compute_agreement_scores.py [-h] [--processes PROCESSES]
-                                          [--inter] [--intra] [--verbose]
-                                          results-file
+                                          [--database] [--cache CACHE_DIR]
+                                          [--refresh] [--materialized]
+                                          [--inter] [--intra]
+                                          [--verbose] [--bootstrap N]
+                                          [--confidence CONFIDENCE]
+                                          [--seed SEED]
+                                          [results-file]
 
 Computes agreement scores for the given results file in WMT format.
 
@@ -17,23 +22,43 @@ optional arguments:
   -h, --help            Show this help message and exit.
   --processes PROCESSES
                         Sets the number of parallel processes.
+  --database            Load results from the Django database instead.
+  --cache CACHE_DIR     Cache loaded results in the given directory.
+  --refresh             Refresh cached database results.
+  --materialized        Read database results from the materialized
+                        PairwiseJudgment table.
   --inter               Compute inter-annotator agreement.
   --intra               Compute intra-annotator agreement.
   --verbose             Display additional information on kappa values.
+  --bootstrap N         Compute kappa confidence intervals from N bootstrap
+                        resamples of the segments.
+  --confidence CONFIDENCE
+                        Confidence level for bootstrap intervals.
+  --seed SEED           Seed for the bootstrap random number generator.
 
 """
 from __future__ import print_function, unicode_literals
 
-import argparse
-from collections import defaultdict
-from csv import DictReader
-from itertools import combinations
 from multiprocessing import Pool, cpu_count
+import argparse
+import os
+import sys
+
+import numpy as np
 
 PARSER = argparse.ArgumentParser(description="Computes agreement scores " \
   "for the given results file in WMT format.")
 PARSER.add_argument("results_file", type=file, metavar="results-file",
-  help="Comma-separated results file in WMT format.")
+  help="Comma-separated results file in WMT format.", nargs='?')
+PARSER.add_argument("--database", action="store_true", default=False,
+  dest="database", help="Load results from the Django database instead.")
+PARSER.add_argument("--cache", action="store", default=None,
+  dest="cache_dir", help="Cache loaded results in the given directory.")
+PARSER.add_argument("--refresh", action="store_true", default=False,
+  dest="refresh", help="Refresh cached database results.")
+PARSER.add_argument("--materialized", action="store_true", default=False,
+  dest="materialized", help="Read database results from the materialized " \
+  "PairwiseJudgment table.")
 PARSER.add_argument("--processes", action="store", default=cpu_count(),
   dest="processes", help="Sets the number of parallel processes.", type=int)
 PARSER.add_argument("--inter", action="store_true", default=False,
@@ -42,88 +67,211 @@ PARSER.add_argument("--intra", action="store_true", default=False,
   dest="intra_annotator_agreement", help="Compute intra-annotator agreement.")
 PARSER.add_argument("--verbose", action="store_true", default=False,
   dest="verbose", help="Display additional information on kappa values.")
+PARSER.add_argument("--bootstrap", action="store", default=0,
+  dest="bootstrap", metavar="N", help="Compute kappa confidence intervals " \
+  "from N bootstrap resamples of the segments.", type=int)
+PARSER.add_argument("--confidence", action="store", default=0.95,
+  dest="confidence", help="Confidence level for bootstrap intervals.",
+  type=float)
+PARSER.add_argument("--seed", action="store", default=None, dest="seed",
+  help="Seed for the bootstrap random number generator.", type=int)
+
+# Ranking decisions are encoded as integer labels: a>b, a<b and a=b.
+LABEL_BETTER = 0
+LABEL_WORSE = 1
+LABEL_TIE = 2
+
+# Upper bound for the size of the (resamples x segments) weight matrices.
+BOOTSTRAP_CHUNK_SIZE = 1 << 22
 
 
-def compute_agreement_scores(data):
+def compute_segment_scores(segments, items, coders, labels, intra=False):
     """
-    Computes agreement scores for the given data set.
+    Computes agreement counts for each segment of a language pair.
+    
+    All arguments are integer-encoded NumPy arrays containing one entry per
+    pairwise ranking decision.  Returns an array of shape (segments, 4) which
+    contains (identical, comparable, ties, total) counts for each segment.
+    
+    For intra-annotator agreement, only annotations of the same coder are
+    compared and only coders with two or more annotations for one item of a
+    segment contribute to the counts of that segment.
+    
     """
-    # Make triples accessible by item id.
-    _by_items = defaultdict(list)
-    for _unused_coder_name, item, labels in data:
-        _by_items[item].append(labels) # We only need the labels here.
-    
-    try:
-        identical_cnt = 0
-        comparable_cnt = 0
-        ties_cnt = 0
-        ties_total = 0
-        
-        for item_labels in _by_items.values():
-            ties_total += len(item_labels)
-            
-            for individual_label in item_labels:
-                if '=' in individual_label:
-                    ties_cnt += 1
-            
-            # cfedermann: combinations() throws a ValueError if x does not
-            # contain two or more elements when using Python 2.6;  hence we
-            # check length of x before using it ;)
-            if len(item_labels) > 1:
-                for first_label, second_label in combinations(item_labels, 2):
-                    if first_label == second_label:
-                        identical_cnt += 1
-                    comparable_cnt += 1
-        
-        return (identical_cnt, comparable_cnt, ties_cnt, ties_total)
+    no_of_segments = segments.max() + 1 if len(segments) else 0
+    scores = np.zeros((no_of_segments, 4), dtype=np.int64)
+    if not len(segments):
+        return scores
+    
+    # Label counts are computed per item, for intra-annotator agreement we
+    # group the labels by (coder, item) instead.
+    if intra:
+        _keys = coders.astype(np.int64) * (items.max() + 1) + items
+        _unused, groups = np.unique(_keys, return_inverse=True)
+    else:
+        groups = items
+    
+    no_of_groups = groups.max() + 1
+    counts = np.bincount(groups * 3 + labels, minlength=3 * no_of_groups)
+    counts = counts.reshape(no_of_groups, 3)
+    sizes = counts.sum(axis=1)
+    
+    group_segments = np.zeros(no_of_groups, dtype=np.int64)
+    group_segments[groups] = segments
+    
+    identical = (counts * (counts - 1) // 2).sum(axis=1)
+    comparable = sizes * (sizes - 1) // 2
+    scores[:, 0] = np.bincount(group_segments, weights=identical,
+      minlength=no_of_segments)
+    scores[:, 1] = np.bincount(group_segments, weights=comparable,
+      minlength=no_of_segments)
+    
+    if intra:
+        _keys = segments.astype(np.int64) * (coders.max() + 1) + coders
+        _unused, coder_segments = np.unique(_keys, return_inverse=True)
+        repeated = np.bincount(coder_segments,
+          weights=(sizes >= 2)[groups]) > 0
+        weights = repeated[coder_segments]
+    else:
+        weights = np.ones(len(segments), dtype=bool)
+    
+    scores[:, 2] = np.bincount(segments,
+      weights=weights & (labels == LABEL_TIE), minlength=no_of_segments)
+    scores[:, 3] = np.bincount(segments, weights=weights,
+      minlength=no_of_segments)
+    
+    return scores
+
+
+def compute_kappa(scores):
+    """
+    Computes pA, pE and kappa for the given (..., 4) array of summed counts.
+    """
+    scores = np.asarray(scores, dtype=np.float64)
+    _identical = scores[..., 0]
+    _comparable = scores[..., 1]
+    _ties = scores[..., 2]
+    _total = scores[..., 3]
+    
+    # Compute p(A) probability.
+    pA = _identical / np.maximum(_comparable, 1)
+    
+    # Compute p(E) empirically, based on the number of observed ties.
+    pTies = _ties / np.maximum(_total, 1)
+    pNoTies = 1.0 - pTies
+    pE = pTies**2 + (pNoTies/2.0)**2 + (pNoTies/2.0)**2
+    
+    # Compute kappa score.
+    kappa = (pA - pE) / (1.0 - pE)
+    
+    return (pA, pE, kappa)
+
+
+def bootstrap_kappa(scores, resamples, confidence, seed=None):
+    """
+    Computes a bootstrap confidence interval for kappa.
+    
+    Segments are resampled with replacement;  each resample is represented
+    as a vector of segment multiplicities s.t. summed counts for a batch of
+    resamples can be computed with a single matrix product.
+    
+    """
+    scores = scores[scores[:, 3] > 0]
+    no_of_segments = len(scores)
+    if not no_of_segments or resamples < 1:
+        return (float('nan'), float('nan'))
+    
+    random = np.random.RandomState(seed)
+    uniform = np.ones(no_of_segments) / no_of_segments
+    batch_size = max(1, BOOTSTRAP_CHUNK_SIZE // no_of_segments)
+    
+    kappas = []
+    for batch_start in range(0, resamples, batch_size):
+        _size = min(batch_size, resamples - batch_start)
+        weights = random.multinomial(no_of_segments, uniform, size=_size)
+        kappas.append(compute_kappa(weights.dot(scores))[2])
+    
+    kappas = np.concatenate(kappas)
+    alpha = 100 * (1.0 - confidence) / 2.0
+    lower, upper = np.percentile(kappas, [alpha, 100 - alpha])
+    return (lower, upper)
+
+
+def compute_language_pair_scores(task):
+    """
+    Computes agreement scores and bootstrap interval for one language pair.
+    
+    The given task tuple contains integer-encoded judgement arrays and the
+    bootstrap settings;  this is used as a multiprocessing.Pool worker.
+    
+    """
+    segments, items, coders, labels, intra, resamples, confidence, seed \
+      = task
+    scores = compute_segment_scores(segments, items, coders, labels, intra)
+    totals = scores.sum(axis=0)
+    
+    interval = None
+    if resamples:
+        interval = bootstrap_kappa(scores, resamples, confidence, seed)
+    
+    return (totals, interval)
+
+
+def extract_judgements(dataset):
+    """
+    Returns integer-encoded (segments, items, coders, labels) arrays.
+    
+    Items are identified by segment and the ordered pair of system ids, as in
+    the Artstein and Poesio (2007) format used before.
+    
+    """
+    _unused, segments = np.unique(dataset.segment, return_inverse=True)
+    
+    _systems = len(dataset.codebook.systems)
+    _keys = (segments.astype(np.int64) * _systems + dataset.system_a) \
+      * _systems + dataset.system_b
+    _unused, items = np.unique(_keys, return_inverse=True)
     
-    except:
-        from traceback import print_exc
-        print_exc()
+    labels = np.where(dataset.outcome > 0, LABEL_BETTER,
+      np.where(dataset.outcome < 0, LABEL_WORSE, LABEL_TIE))
+    
+    return (segments, items, dataset.judge.astype(np.int64), labels)
 
 
 if __name__ == "__main__":
     args = PARSER.parse_args()
     
+    PROJECT_HOME = os.path.normpath(os.getcwd() + "/..")
+    sys.path.append(PROJECT_HOME)
+    
     if not args.inter_annotator_agreement and \
       not args.intra_annotator_agreement:
         print("Defaulting to --inter mode.")
         args.inter_annotator_agreement = True
     
-    results_data = defaultdict(lambda: defaultdict(list))
-    for i, row in enumerate(DictReader(args.results_file)):
-        language_pair = '{0}-{1}'.format(row.get('srclang'), row.get('trglang'))
-        segment_id = int(row.get('srcIndex'))
-        judge_id = row.get('judgeId')
-        
-        # Filter out results where a user decided to "skip" ranking.
-        systems = [row.get('system%dId' % (y+1)) for y in range(5)]
-        rankings = [int(x) for x in \
-          [row.get('system%drank' % (y+1)) for y in range(5)]]
-        if all([x == -1 for x in rankings]):
-            continue
-        
-        # Compute individual ranking decisions for this users.
-        for a, b in combinations(range(5), 2):
-            _c = judge_id
-            _i = '{0}.{1}.{2}'.format(segment_id, systems[a], systems[b])
-            
-            if rankings[a] < rankings[b]:
-                _v = '{0}>{1}'.format(systems[a], systems[b])
-            elif rankings[a] > rankings[b]:
-                _v = '{0}<{1}'.format(systems[a], systems[b])
-            else:
-                _v = '{0}={1}'.format(systems[a], systems[b])
-            
-            # print('Appending', language_pair, segment_id, _c, _i, _v)
-            
-            # Append ranking decision in Artstein and Poesio format.
-            results_data[language_pair][segment_id].append((_c, _i, _v))
-    
-    # We allow to use multi-processing.
-    pool = Pool(processes=args.processes)
+    if args.database:
+        # Properly set DJANGO_SETTINGS_MODULE environment variable.
+        os.environ['DJANGO_SETTINGS_MODULE'] = 'settings'
+    
+    # We have just added appraise to the system path list, hence this works.
+    from appraise.wmt13.analytics import language_pair_code, load_csv, \
+      load_database
+    
+    if args.database:
+        results_data = load_database(cache_dir=args.cache_dir,
+          refresh=args.refresh, materialized=args.materialized)
+    
+    elif args.results_file:
+        results_data = load_csv(args.results_file, cache_dir=args.cache_dir)
+    
+    else:
+        PARSER.error('either results-file or --database is required')
+    
     print('Language pair        pA     pE     kappa  ',
-      end='' if args.verbose else '\n')
+      end='' if args.verbose or args.bootstrap else '\n')
+    if args.bootstrap:
+        print('{0:.0f}% CI           '.format(100 * args.confidence),
+          end='' if args.verbose else '\n')
     if args.verbose:
         print('(agree, comparable, ties, total)')
     
@@ -133,81 +281,30 @@ if __name__ == "__main__":
       'French-English', 'English-French', 'Russian-English',
       'English-Russian')
     
-    for language_pair in language_pairs:
-        segments_data = results_data[language_pair]
-        scores = []
-        handles = []
-        
-        for segment_id, _judgements in segments_data.items():
-            # Collect judgements on a per-coder-level.
-            _coders = defaultdict(list)
-            for _c, _i, _l in _judgements:
-                _coders[_c].append((_c, _i, _l))
-            
-            # Inter-annotator agreement is computed for all items.
-            if args.inter_annotator_agreement:
-                # Pool compute_agreement_scores() call and save handle.
-                handle = pool.apply_async(compute_agreement_scores,
-                  args=(_judgements,), callback=scores.append)
-                handles.append(handle)
-                continue
-                
-            # Intra-annotator agreement is solely computed on items for which
-            # an annotator has generated two or more annotations.
-            elif args.intra_annotator_agreement:
-                # Check that we have at least one annotation item with two or
-                # more annotations from the current coder.
-                for _coder, _coder_judgements in _coders.items():
-                    _items = defaultdict(list)
-                    for _, _i, _l in _coder_judgements:
-                        _items[_i].append(_l)
-                    
-                    # If no item has two or more annotations, skip coder.
-                    if all([len(x)<2 for x in _items.values()]):
-                        continue
-                    
-                    # We rename the judgements for the current coder s.t. we
-                    # can compute intra-annotator agreement scores from
-                    # inter-annotator agreement data ;)
-                    renamed_judgements = []
-                    for _i, _ls in _items.items():
-                        for d in range(len(_ls)):
-                            _c = '{0}-{1}'.format(_coder, d)
-                            renamed_judgements.append((_c, _i, _ls[d]))
-                    
-                    # Pool compute_agreement_scores() call and save handle.
-                    handle = pool.apply_async(compute_agreement_scores,
-                      args=(renamed_judgements,), callback=scores.append)
-                    handles.append(handle)
-        
-        # Block until all async computation processes are completed.
-        while any([not x.ready() for x in handles]):
-            continue
-        
-        # Compute average scores, normalising on per-item level.
-        average_scores = []
-        for i in range(4):
-            average_scores.append(sum([x[i] for x in scores]))
-        
-        _identical = average_scores[0]
-        _comparable = average_scores[1]
-        _ties = average_scores[2]
-        _total = average_scores[3]
-        
-        # Compute p(A) probability.
-        pA = _identical / float(_comparable or 1)
-        
-        # Compute p(E) empirically, based on the number of observed ties.
-        pTies = _ties / float(_total or 1)
-        pNoTies = 1.0 - pTies
-        pE = pTies**2 + (pNoTies/2.0)**2 + (pNoTies/2.0)**2
-        
-        # Compute kappa score.
-        kappa = (pA - pE) / float(1.0 - pE)
+    # We allow to use multi-processing, one task per language pair.
+    tasks = []
+    for index, language_pair in enumerate(language_pairs):
+        _seed = None if args.seed is None else args.seed + index
+        _code = language_pair_code(*language_pair.split('-'))
+        _arrays = extract_judgements(results_data.for_language_pair(_code))
+        tasks.append(_arrays + (not args.inter_annotator_agreement,
+          args.bootstrap, args.confidence, _seed))
+    
+    pool = Pool(processes=args.processes)
+    scores = pool.map(compute_language_pair_scores, tasks)
+    pool.close()
+    
+    for language_pair, (average_scores, interval) in zip(language_pairs,
+      scores):
+        pA, pE, kappa = compute_kappa(average_scores)
         
         # Display results for current language pair.
         print('{0:>20} {1: 0.3f} {2: 0.3f} {3: 0.3f}'.format(language_pair,
-          pA, pE, kappa), end='' if args.verbose else '\n')
+          pA, pE, kappa), end='' if args.verbose or interval else '\n')
+        
+        if interval:
+            print('  [{0: 0.3f}, {1: 0.3f}]'.format(*interval),
+              end='' if args.verbose else '\n')
         
         if args.verbose:
             print(' {0:>8} {1:>8} {2:>8} {3:>8}'.format(*average_scores[:4]))
@@ -4,7 +4,9 @@
 Project: Appraise evaluation system
  Author: Christian Federmann <cfedermann@gmail.com>
 
-usage: python evaluate_mturk_results [-h] mturk-file appraise-file
+usage: python evaluate_mturk_results [-h] [--database] [--cache CACHE_DIR]
+                                     [--refresh] [--materialized]
+                                     mturk-file [appraise-file]
 
 Evaluates MTurk results by comparing to researchers' rankings.
 
@@ -14,151 +16,138 @@ positional arguments:
 
 optional arguments:
   -h, --help     Show this help message and exit.
+  --database     Load Appraise results from the Django database instead.
+  --cache CACHE_DIR
+                 Cache loaded results in the given directory.
+  --refresh      Refresh cached database results.
+  --materialized Read database results from the materialized
+                 PairwiseJudgment table.
 
 """
-from itertools import combinations
 import argparse
+import os
+import sys
+
+import numpy as np
 
 PARSER = argparse.ArgumentParser(description="Evaluates MTurk results by " \
   "comparing to researchers' rankings.")
 PARSER.add_argument("mturk_file", type=file, metavar="mturk-file",
   help="MTurk results in WMT13 export CSV format")
 PARSER.add_argument("appraise_file", type=file, metavar="appraise-file",
-  help="Appraise results in WMT13 export CSV format")
+  help="Appraise results in WMT13 export CSV format", nargs='?')
+PARSER.add_argument("--database", action="store_true", default=False,
+  dest="database", help="Load Appraise results from the Django database " \
+  "instead.")
+PARSER.add_argument("--cache", action="store", default=None,
+  dest="cache_dir", help="Cache loaded results in the given directory.")
+PARSER.add_argument("--refresh", action="store_true", default=False,
+  dest="refresh", help="Refresh cached database results.")
+PARSER.add_argument("--materialized", action="store_true", default=False,
+  dest="materialized", help="Read database results from the materialized " \
+  "PairwiseJudgment table.")
 
 
-def compare_data_point_to_dict(_data_point, target_dict):
-    """
-    Compares the given _data_point tuple to the "truth" in target_dict.
+def compute_decision_keys(dataset, segments, systems):
     """
-    _language_pair, _sentence_no, _ranking_decision = _data_point
-    
-    if not target_dict.has_key(_language_pair) or \
-      not target_dict[language_pair].has_key(_sentence_no):
-        return False
+    Computes integer keys for all non-tie ranking decisions in dataset.
     
-    # pylint: disable-msg=W0612
-    inverted_decision = '{1}>{0}'.format(*_ranking_decision.split('>'))
-    _store = target_dict[_language_pair][_sentence_no]
-    _score = _store.get('ranking_decision', 0)
-    _inverted = _store.get('inverted_decision', 0)
+    Returns a tuple (sentences, decisions, inverted, judges) of arrays where
+    each sentence key encodes (language pair, segment) and each decision key
+    additionally encodes the ordered (better, worse) system pair.
     
-    return _score >= _inverted
+    """
+    _decided = dataset[dataset.outcome != 0]
+    _better = np.where(_decided.outcome > 0, _decided.system_a,
+      _decided.system_b).astype(np.int64)
+    _worse = np.where(_decided.outcome > 0, _decided.system_b,
+      _decided.system_a).astype(np.int64)
+    
+    sentences = _decided.language_pair.astype(np.int64) * segments \
+      + _decided.segment
+    decisions = (sentences * systems + _better) * systems + _worse
+    inverted = (sentences * systems + _worse) * systems + _better
+    
+    return (sentences, decisions, inverted, _decided.judge)
 
 
-def add_data_point_to_dict(_data_point, target_dict):
+def count_keys(keys, values):
     """
-    Adds the given _data_point tuple to dictionary target_dict.
-    
-    A suitable _data_point tuple contains the following information:
-    - language pair;
-    - sentence number;
-    - ranking decision (sysX > sysY).
-    
-    If the given target_dict does not contain any of the required keys, these
-    will be created on demand.  If the given ranking decision (sysX > sysY) is
-    already contained within target_dict, its count will be incremented.
-    
+    Returns the number of occurrences of each of the given values in keys.
     """
-    _language_pair, _sentence_no, _ranking_decision = _data_point
-    
-    if not target_dict.has_key(_language_pair):
-        target_dict[_language_pair] = {}
+    _unique, _counts = np.unique(keys, return_counts=True)
+    _index = np.minimum(np.searchsorted(_unique, values),
+      max(len(_unique) - 1, 0))
     
-    if not target_dict[_language_pair].has_key(_sentence_no):
-        target_dict[_language_pair][_sentence_no] = {}
+    if not len(_unique):
+        return np.zeros(len(values), dtype=np.int64)
     
-    _store = target_dict[_language_pair][_sentence_no]
-    if not _ranking_decision in _store.keys():
-        _store[_ranking_decision] = 1
-    else:
-        _store[_ranking_decision] = _store[_ranking_decision] + 1
+    return np.where(_unique[_index] == values, _counts[_index], 0)
 
 
 if __name__ == "__main__":
     args = PARSER.parse_args()
     
-    LANGUAGE_MAP = {'czech': 'ces', 'ces': 'ces', 'cze': 'ces', 'deu': 'deu',
-      'german': 'deu', 'ger': 'deu', 'spa': 'spa', 'spanish': 'spa',
-      'eng': 'eng', 'english': 'eng', 'french': 'fra', 'fra': 'fra',
-      'fre': 'fra', 'russian': 'rus', 'rus': 'rus'}
-    
-    MTURK_DATA = {}
-    APPRAISE_DATA = {}
-    line_no = 0
-    results = []
-    
-    for line in args.mturk_file:
-        line_no = line_no + 1
-        
-        # Skip first line containing header.
-        if line_no == 1:
-            continue
-        
-        line_data = line.strip().split(',')
-        src_lang = LANGUAGE_MAP[line_data[0].lower()]
-        trg_lang = LANGUAGE_MAP[line_data[1].lower()]
-        language_pair = '{0}2{1}'.format(src_lang, trg_lang)
-        sentence_no = int(line_data[2])
-        judge_id = line_data[5]
-        sysIds = line_data[7:17:2]
-        sysRanks = line_data[-5:]
-        
-        if not judge_id in MTURK_DATA.keys():
-            MTURK_DATA[judge_id] = {}
-        
-        decisions = []
-        for a, b in combinations(range(5), 2):
-            if sysRanks[a] > sysRanks[b]:
-                decisions.append('{0}>{1}'.format(sysIds[a], sysIds[b]))
-            elif sysRanks[a] < sysRanks[b]:
-                decisions.append('{0}>{1}'.format(sysIds[b], sysIds[a]))
-        
-        for ranking_decision in decisions:
-            data_point = (language_pair, sentence_no, ranking_decision)
-            add_data_point_to_dict(data_point, MTURK_DATA[judge_id])
-    
-    line_no = 0
-    for line in args.appraise_file:
-        line_no = line_no + 1
-        
-        # Skip first line containing header.
-        if line_no == 1:
-            continue
-        
-        line_data = line.strip().split(',')
-        src_lang = LANGUAGE_MAP[line_data[0].lower()]
-        trg_lang = LANGUAGE_MAP[line_data[1].lower()]
-        language_pair = '{0}2{1}'.format(src_lang, trg_lang)
-        sentence_no = int(line_data[2])
-        sysIds = line_data[7:17:2]
-        sysRanks = line_data[-5:]
-        
-        decisions = []
-        for a, b in combinations(range(5), 2):
-            if sysRanks[a] > sysRanks[b]:
-                decisions.append('{0}>{1}'.format(sysIds[a], sysIds[b]))
-            elif sysRanks[a] < sysRanks[b]:
-                decisions.append('{0}>{1}'.format(sysIds[b], sysIds[a]))
-        
-        for ranking_decision in decisions:
-            data_point = (language_pair, sentence_no, ranking_decision)
-            add_data_point_to_dict(data_point, APPRAISE_DATA)
+    PROJECT_HOME = os.path.normpath(os.getcwd() + "/..")
+    sys.path.append(PROJECT_HOME)
     
-    user_agreement = []
+    if args.database:
+        # Properly set DJANGO_SETTINGS_MODULE environment variable.
+        os.environ['DJANGO_SETTINGS_MODULE'] = 'settings'
+    
+    # We have just added appraise to the system path list, hence this works.
+    from appraise.wmt13.analytics import Codebook, load_csv, load_database
+    
+    # Both datasets share a Codebook s.t. their integer codes are compatible.
+    CODEBOOK = Codebook()
+    MTURK_DATA = load_csv(args.mturk_file, codebook=CODEBOOK,
+      cache_dir=args.cache_dir)
     
-    for user_id in MTURK_DATA.keys():
-        rankings = 0
-        overlap = 0
-        for language_pair, sentence_nos in MTURK_DATA[user_id].items():
-            for sentence_no, ranking_decisions in sentence_nos.items():
-                for decision, _ in ranking_decisions.items():
-                    rankings = rankings + 1
-                    data_point = (language_pair, sentence_no, decision)
-                    if compare_data_point_to_dict(data_point, APPRAISE_DATA):
-                        overlap = overlap + 1
-        
-        _data = (overlap / float(rankings or 1), overlap, rankings, user_id)
+    if args.database:
+        APPRAISE_DATA = load_database(codebook=CODEBOOK,
+          cache_dir=args.cache_dir, refresh=args.refresh,
+          materialized=args.materialized)
+    
+    elif args.appraise_file:
+        APPRAISE_DATA = load_csv(args.appraise_file, codebook=CODEBOOK,
+          cache_dir=args.cache_dir)
+    
+    else:
+        PARSER.error('either appraise-file or --database is required')
+    
+    SEGMENTS = 1 + max([x.segment.max() if len(x) else 0
+      for x in (MTURK_DATA, APPRAISE_DATA)])
+    SYSTEMS = max(len(CODEBOOK.systems), 1)
+    
+    _sentences, _decisions, _unused, _unused = compute_decision_keys(
+      APPRAISE_DATA, SEGMENTS, SYSTEMS)
+    
+    # Each distinct MTurk decision per user is compared to the majority
+    # decision of the researchers for the same sentence and system pair.
+    sentences, decisions, inverted, judges = compute_decision_keys(
+      MTURK_DATA, SEGMENTS, SYSTEMS)
+    _span = decisions.max() + 1 if len(decisions) else 1
+    _unused, _first = np.unique(judges.astype(np.int64) * _span + decisions,
+      return_index=True)
+    
+    sentences = sentences[_first]
+    decisions = decisions[_first]
+    inverted = inverted[_first]
+    judges = judges[_first]
+    
+    _known = count_keys(_sentences, sentences) > 0
+    _score = count_keys(_decisions, decisions)
+    _inverted = count_keys(_decisions, inverted)
+    _overlap = _known & (_score >= _inverted)
+    
+    rankings = np.bincount(judges, minlength=len(CODEBOOK.judges))
+    overlap = np.bincount(judges, weights=_overlap,
+      minlength=len(CODEBOOK.judges)).astype(np.int64)
+    
+    user_agreement = []
+    for judge in np.unique(MTURK_DATA.judge):
+        _data = (overlap[judge] / float(rankings[judge] or 1),
+          overlap[judge], rankings[judge], CODEBOOK.judges[judge])
         user_agreement.append(_data)
     
     print
@@ -169,4 +158,4 @@ if __name__ == "__main__":
         print '{0:>15}:    {1:05d}    {2:05d}    {3:.5f}'.format(user_data[3],
           user_data[1], user_data[2], user_data[0])
     
-    print u'\n'.join(results)
+    print
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+"""
+Project: Appraise evaluation system
+ Author: Christian Federmann <cfedermann@gmail.com>
+"""
+from optparse import make_option
+from time import time
+
+from django.core.management.base import NoArgsCommand
+
+from appraise.snapshots import warm_up
+
+
+class Command(NoArgsCommand):
+    """
+    Computes status, ranking and task cache snapshots for all processes.
+    """
+    help = 'Computes the snapshots used to fill the status, ranking and ' \
+      'task caches of new processes.'
+    
+    option_list = NoArgsCommand.option_list + (
+      make_option('--skip-status', action='store_false', default=True,
+        dest='status', help='Do not compute WMT13 status data.'),
+      make_option('--skip-rankings', action='store_false', default=True,
+        dest='rankings', help='Do not load WMT13 ranking clusters.'),
+      make_option('--skip-tasks', action='store_false', default=True,
+        dest='tasks', help='Do not compute evaluation task data.'),
+    )
+    
+    def handle_noargs(self, **options):
+        """
+        Warms up all caches and reports the number of entries.
+        """
+        _start = time()
+        counts = warm_up(status=options['status'],
+          rankings=options['rankings'], tasks=options['tasks'])
+        
+        self.stdout.write('Warmed up {0} status, {1} ranking and {2} task ' \
+          'cache entries in {3:.2f}s.\n'.format(counts['status'],
+          counts['rankings'], counts['tasks'], time() - _start))
@@ -4,7 +4,6 @@ Project: Appraise evaluation system
  Author: Christian Federmann <cfedermann@gmail.com>
 """
 import logging
-import uuid
 
 from xml.etree.ElementTree import Element, fromstring, ParseError, tostring
 
@@ -18,7 +17,7 @@ from django.template import Context
 from django.template.loader import get_template
 
 from appraise.settings import LOG_LEVEL, LOG_HANDLER
-from appraise.utils import datetime_to_seconds
+from appraise.utils import datetime_to_seconds, UniqueIdAllocator
 
 # Setup logging support.
 logging.basicConfig(level=LOG_LEVEL)
@@ -163,11 +162,14 @@ class EvaluationTask(models.Model):
     @classmethod
     def _create_task_id(cls):
         """Creates a random UUID-4 32-digit hex number for use as task id."""
-        new_id = uuid.uuid4().hex
-        while cls.objects.filter(task_id=new_id):
-            new_id = uuid.uuid4().hex
-        
-        return new_id
+        return TASK_ID_ALLOCATOR.next_id()
+    
+    @classmethod
+    def _create_task_ids(cls, count):
+        """
+        Creates count unique task ids using one query per round of candidates.
+        """
+        return TASK_ID_ALLOCATOR.allocate(count)
     
     def save(self, *args, **kwargs):
         """
@@ -438,6 +440,10 @@ def validate_item_xml(value):
         raise ValidationError('Invalid XML: "{0}".'.format(msg))
 
 
+# Allocates task ids in batches, see EvaluationTask._create_task_id().
+TASK_ID_ALLOCATOR = UniqueIdAllocator(EvaluationTask, 'task_id', 32)
+
+
 class EvaluationItem(models.Model):
     """
     Evaluation Item object model.
@@ -20,6 +20,9 @@ from django.template.loader import get_template
 
 from appraise.evaluation.models import APPRAISE_TASK_TYPE_CHOICES, \
   EvaluationTask, EvaluationItem, EvaluationResult
+from appraise.logqueue import LazyMessage
+from appraise.metrics import increment, timed
+from appraise.snapshots import get_snapshot, set_snapshot
 from appraise.settings import LOG_LEVEL, LOG_HANDLER, COMMIT_TAG
 
 # Setup logging support.
@@ -31,9 +34,46 @@ LOGGER.addHandler(LOG_HANDLER)
 ERROR_CLASSES = ("terminology", "lexical_choice", "syntax", "insertion",
   "morphology", "misspelling", "punctuation", "other")
 
+# Task data per task id and username, shared with other processes using
+# appraise.snapshots.
 APPRAISE_TASK_CACHE = {}
 
 
+def _get_task_snapshot_key(task, user):
+    """
+    Returns the snapshot key for the given task and user.
+    """
+    return u'evaluation.task.{0}.{1}'.format(task.task_id, user.username)
+
+
+def _get_task_data(task, user):
+    """
+    Returns the APPRAISE_TASK_CACHE entry for the given task and user.
+    
+    Missing entries are loaded from the snapshot of another process or are
+    computed if there is no snapshot.
+    
+    """
+    _cache = APPRAISE_TASK_CACHE.setdefault(task.task_id, {})
+    if _cache.has_key(user.username):
+        increment('appraise_cache_requests_total', cache='task',
+          result='hit')
+        return _cache[user.username]
+    
+    _snapshot = get_snapshot(_get_task_snapshot_key(task, user))
+    if _snapshot is not None:
+        increment('appraise_cache_requests_total', cache='task',
+          result='snapshot')
+        _cache[user.username] = _snapshot[1]
+    
+    else:
+        increment('appraise_cache_requests_total', cache='task',
+          result='miss')
+        _update_task_cache(task, user)
+    
+    return _cache[user.username]
+
+
 def _update_task_cache(task, user):
     """
     Updates the APPRAISE_TASK_CACHE for the given user.
@@ -45,7 +85,7 @@ def _update_task_cache(task, user):
     
     _task_data = {
       'finished': task.is_finished_for_user(user),
-      'header': task.get_status_header,
+      'header': task.get_status_header(),
       'status': task.get_status_for_user(user),
       'status_users': task.get_status_for_users(),
       'task_name': task.task_name,
@@ -54,14 +94,16 @@ def _update_task_cache(task, user):
     }
     
     _cache.update({user.username: _task_data})
+    set_snapshot(_get_task_snapshot_key(task, user), _task_data)
 
 
+@timed('appraise_result_submission_seconds', app='evaluation')
 def _save_results(item, user, duration, raw_result):
     """
     Creates or updates the EvaluationResult for the given item and user.
     """
-    LOGGER.debug('item: {}, user: {}, duration: {}, raw_result: {}'.format(
-      item, user, duration, raw_result.encode('utf-8')))
+    LOGGER.debug(LazyMessage(u'item: {0}, user: {1}, duration: {2}, ' \
+      'raw_result: {3}', item.id, user.username, duration, raw_result))
     
     _existing_result = EvaluationResult.objects.filter(item=item, user=user)
     
@@ -74,6 +116,7 @@ def _save_results(item, user, duration, raw_result):
     _result.duration = duration
     _result.raw_result = raw_result
     _result.save()
+    increment('appraise_results_saved_total', app='evaluation')
 
 
 def _find_next_item_to_process(items, user, random_order=False):
@@ -641,14 +684,7 @@ def overview(request):
         
         # Loop over the QuerySet and compute task description data.
         for _task in _tasks:
-            if not APPRAISE_TASK_CACHE.has_key(_task.task_id):
-                APPRAISE_TASK_CACHE[_task.task_id] = {}
-            
-            _cache = APPRAISE_TASK_CACHE[_task.task_id]
-            if not _cache.has_key(request.user.username):
-                _update_task_cache(_task, request.user)
-            
-            _task_data = _cache[request.user.username]
+            _task_data = _get_task_data(_task, request.user)
             
             # Append new task description to current task_type list.
             evaluation_tasks[task_type].append(_task_data)
@@ -727,7 +763,7 @@ def status_view(request, task_id=None):
                 
                 except AssertionError:
                     LOGGER.debug('Fixing outdated version of AnnotationTask.')
-                    from appraise.utils import AnnotationTask
+                    from appraise.agreement import AnnotationTask
 
                 # We have to sort annotation data to prevent StopIterator errors.
                 result_data.sort()
@@ -776,14 +812,7 @@ def status_view(request, task_id=None):
         
             # Loop over the QuerySet and compute task description data.
             for _task in _tasks:
-                if not APPRAISE_TASK_CACHE.has_key(_task.task_id):
-                    APPRAISE_TASK_CACHE[_task.task_id] = {}
-                
-                _cache = APPRAISE_TASK_CACHE[_task.task_id]
-                if not _cache.has_key(request.user.username):
-                    _update_task_cache(_task, request.user)
-                
-                _task_data = _cache[request.user.username]
+                _task_data = _get_task_data(_task, request.user)
                 
                 # Append new task description to current task_type list.
                 evaluation_tasks[task_type].append(_task_data)
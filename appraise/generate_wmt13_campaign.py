@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Project: Appraise evaluation system
+ Author: Christian Federmann <cfedermann@gmail.com>
+
+usage: python generate_wmt13_campaign.py [-h]
+                                         [--language-pairs LANGUAGE_PAIRS]
+                                         [--hits HITS] [--users USERS]
+                                         [--results RESULTS]
+                                         [--systems SYSTEMS] [--seed SEED]
+
+Fills the database with a synthetic WMT13 campaign for benchmarks.
+
+Creates the groups of the wmt13-groups.json fixture, HITS HITs per language
+pair, USERS users and RESULTS ranking results including their pairwise
+judgments, see appraise.wmt13.synthetic.  Existing data is kept.
+
+optional arguments:
+  -h, --help            Show this help message and exit.
+  --language-pairs LANGUAGE_PAIRS
+                        Comma-separated language pair codes, all by default.
+  --hits HITS           Number of HITs per language pair.
+  --users USERS         Total number of users.
+  --results RESULTS     Total number of ranking results.
+  --systems SYSTEMS     Number of systems per language pair.
+  --seed SEED           Seed for the random number generators.
+
+"""
+from time import time
+import argparse
+import os
+import sys
+
+PARSER = argparse.ArgumentParser(description="Fills the database with a " \
+  "synthetic WMT13 campaign for benchmarks.")
+PARSER.add_argument("--language-pairs", action="store", default=None,
+  dest="language_pairs", help="Comma-separated language pair codes, all " \
+  "by default.")
+PARSER.add_argument("--hits", action="store", default=1000, dest="hits",
+  help="Number of HITs per language pair.", type=int)
+PARSER.add_argument("--users", action="store", default=100, dest="users",
+  help="Total number of users.", type=int)
+PARSER.add_argument("--results", action="store", default=10000,
+  dest="results", help="Total number of ranking results.", type=int)
+PARSER.add_argument("--systems", action="store", default=12,
+  dest="systems", help="Number of systems per language pair.", type=int)
+PARSER.add_argument("--seed", action="store", default=None, dest="seed",
+  help="Seed for the random number generators.", type=int)
+
+
+if __name__ == "__main__":
+    args = PARSER.parse_args()
+    
+    # Properly set DJANGO_SETTINGS_MODULE environment variable.
+    os.environ['DJANGO_SETTINGS_MODULE'] = 'settings'
+    PROJECT_HOME = os.path.normpath(os.getcwd() + "/..")
+    sys.path.append(PROJECT_HOME)
+    
+    # We have just added appraise to the system path list, hence this works.
+    from appraise.wmt13.models import LANGUAGE_PAIR_CHOICES, \
+      PairwiseJudgment, RankingResult
+    from appraise.wmt13.synthetic import create_large_campaign
+    
+    if args.language_pairs:
+        LANGUAGE_PAIRS = args.language_pairs.split(',')
+    else:
+        LANGUAGE_PAIRS = [x[0] for x in LANGUAGE_PAIR_CHOICES]
+    
+    _start = time()
+    _results = RankingResult.objects.count()
+    _judgments = PairwiseJudgment.objects.count()
+    create_large_campaign(LANGUAGE_PAIRS, args.hits, args.users,
+      args.results, args.systems, args.seed)
+    
+    print 'Created {0} results and {1} pairwise judgments in {2:.2f}s.' \
+      .format(RankingResult.objects.count() - _results,
+      PairwiseJudgment.objects.count() - _judgments, time() - _start)
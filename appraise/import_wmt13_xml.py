@@ -6,10 +6,13 @@ Project: Appraise evaluation system
 
 usage: python import_wmt13_xml.py
                [-h] [--wait SLEEP_SECONDS] [--dry-run] [--mturk-only]
+               [--bulk] [--chunk-size CHUNK_SIZE] [--stream] [--resume]
+               [--processes PROCESSES] [--skip-duplicates]
+               [--report-duplicates]
                hits-file [hits-file ...]
 
 Imports HITs from a given XML file into the Django database. Uses
-appraise.wmt13.validators.validate_hits_xml_file() for validation.
+appraise.wmt13.validators.parse_hits_xml_file() for validation.
 
 positional arguments:
   hits-file             XML file(s) containing HITs. Can be multiple files
@@ -18,8 +21,24 @@ positional arguments:
 optional arguments:
   -h, --help            Show this help message and exit.
   --wait SLEEP_SECONDS  Amount of seconds to wait between individual files.
+                        Defaults to 5 seconds, or 0 seconds in bulk mode.
   --dry-run             Enable dry run to simulate import.
   --mturk-only          Enable MTurk-only flag for all HITs.
+  --bulk                Insert HITs using bulk queries in chunked
+                        transactions and report throughput.
+  --chunk-size CHUNK_SIZE
+                        Number of HITs per transaction in bulk mode.
+  --stream              Parse, validate and bulk insert HITs incrementally.
+                        HITs before an invalid HIT remain imported.
+  --resume              Resume an interrupted streaming import after the
+                        last committed HIT.  Existing HITs in the chunk
+                        after the checkpoint are skipped.
+  --processes PROCESSES
+                        Validate HITs using a pool of worker processes while
+                        this process inserts them.  Implies --stream.
+  --skip-duplicates     Skip HITs with the same contents as an existing or
+                        previously imported HIT.
+  --report-duplicates   Report, but import, duplicate HITs and segments.
 
 """
 from time import sleep
@@ -27,20 +46,63 @@ import argparse
 import os
 import sys
 
-from xml.etree.ElementTree import fromstring, tostring
-
 PARSER = argparse.ArgumentParser(description="Imports HITs from a given " \
   "XML file into the Django database.\nUses appraise.wmt13.validators." \
-  "validate_hits_xml_file() for validation.")
+  "parse_hits_xml_file() for validation.")
 PARSER.add_argument("hits_file", metavar="hits-file", help="XML file(s) " \
   "containing HITs.  Can be multiple files using patterns such as '*.xml' " \
   "or similar.", nargs='+')
-PARSER.add_argument("--wait", action="store", default=5, dest="sleep_seconds",
-  help="Amount of seconds to wait between individual files.", type=int)
+PARSER.add_argument("--wait", action="store", default=None,
+  dest="sleep_seconds", help="Amount of seconds to wait between individual " \
+  "files.  Defaults to 5 seconds, or 0 seconds in bulk mode.", type=int)
 PARSER.add_argument("--dry-run", action="store_true", default=False,
   dest="dry_run_enabled", help="Enable dry run to simulate import.")
 PARSER.add_argument("--mturk-only", action="store_true", default=False,
   dest="mturk_only", help="Enable MTurk-only flag for all HITs.")
+PARSER.add_argument("--bulk", action="store_true", default=False,
+  dest="bulk_enabled", help="Insert HITs using bulk queries in chunked " \
+  "transactions and report throughput.")
+PARSER.add_argument("--chunk-size", action="store", default=1000,
+  dest="chunk_size", help="Number of HITs per transaction in bulk mode.",
+  type=int)
+PARSER.add_argument("--stream", action="store_true", default=False,
+  dest="stream_enabled", help="Parse, validate and bulk insert HITs " \
+  "incrementally.  HITs before an invalid HIT remain imported.")
+PARSER.add_argument("--resume", action="store_true", default=False,
+  dest="resume_enabled", help="Resume an interrupted streaming import " \
+  "after the last committed HIT.  Existing HITs in the chunk after the " \
+  "checkpoint are skipped.")
+PARSER.add_argument("--processes", action="store", default=1,
+  dest="processes", help="Validate HITs using a pool of worker processes " \
+  "while this process inserts them.  Implies --stream.", type=int)
+PARSER.add_argument("--skip-duplicates", action="store_true", default=False,
+  dest="skip_duplicates", help="Skip HITs with the same contents as an " \
+  "existing or previously imported HIT.")
+PARSER.add_argument("--report-duplicates", action="store_true",
+  default=False, dest="report_duplicates", help="Report, but import, " \
+  "duplicate HITs and segments.")
+
+
+def print_summary(hits_file, hits, statistics, duplicates=False):
+    """
+    Prints the summary for hits HITs imported from hits_file in bulk.
+    
+    Duplicates found so far are only reported if duplicates is True.
+    
+    """
+    from appraise.wmt13.models import HIT_ID_ALLOCATOR
+    
+    print
+    print '[{0}]'.format(hits_file)
+    print 'Successfully imported {0} HITs.'.format(hits)
+    print unicode(statistics)
+    if HIT_ID_ALLOCATOR.collisions:
+        print 'HIT id collisions: {0} of {1} candidates ({2:.4%}).'.format(
+          HIT_ID_ALLOCATOR.collisions, HIT_ID_ALLOCATOR.candidates,
+          HIT_ID_ALLOCATOR.collision_rate())
+    if duplicates:
+        print statistics.describe_duplicates()
+    print
 
 
 if __name__ == "__main__":
@@ -52,67 +114,162 @@ if __name__ == "__main__":
     sys.path.append(PROJECT_HOME)
     
     # We have just added appraise to the system path list, hence this works.
+    from django.core.exceptions import ValidationError
+    from appraise.wmt13.importer import bulk_import_hits, check_duplicates, \
+      get_language_pair, ImportStatistics, load_checkpoint, \
+      number_records, ParallelValidator, remove_checkpoint, \
+      resume_after_records, save_checkpoint
     from appraise.wmt13.models import HIT
-    from appraise.wmt13.validators import validate_hits_xml_file
+    from appraise.wmt13.validators import iter_hits_xml_file, \
+      parse_hits_xml_file
     
-    # We might potentially be dealing with more than a single input file.
-    first_run = True
-    for _hits_file in args.hits_file:
-        if not first_run and args.sleep_seconds > 0:
-            print 'Waiting {0} second(s)'.format(args.sleep_seconds),
-            for i in range(args.sleep_seconds):
-                print ' .',
-                sys.stdout.flush()
-                sleep(1)
-            print
-            print
-        
-        else:
-            first_run = False
-        
-        hits_xml_string = None
-        with open(_hits_file) as infile:
-            hits_xml_string = unicode(infile.read(), "utf-8")
-        
-        # Validate XML before trying to import anything from the given file.
-        validate_hits_xml_file(hits_xml_string)
+    # Worker processes are forked before any database access.
+    validator = None
+    if args.processes > 1:
+        args.stream_enabled = True
+        validator = ParallelValidator(args.hits_file, args.processes)
     
-        _errors = 0
-        _total = 0
-        _tree = fromstring(hits_xml_string.encode("utf-8"))
+    if args.sleep_seconds is None:
+        args.sleep_seconds = 0 if args.bulk_enabled or args.stream_enabled \
+          else 5
     
-        for _child in _tree:        
-            block_id = _child.attrib["block-id"]
-            language_pair = '{0}2{1}'.format(_child.attrib["source-language"],
-              _child.attrib["target-language"])
-        
-            # Hotfix potentially wrong ISO codes;  we are using ISO-639-3.
-            iso_639_2_to_3_mapping = {'cze': 'ces', 'fre': 'fra', 'ger': 'deu'}
-            for part2_code, part3_code in iso_639_2_to_3_mapping.items():
-                language_pair = language_pair.replace(part2_code, part3_code)
-        
-            try:
-                _total = _total + 1
-                _hit_xml = tostring(_child, encoding="utf-8").decode('utf-8')
+    statistics = ImportStatistics()
+    
+    try:
+        # We might potentially be dealing with more than a single input file.
+        first_run = True
+        for _index, _hits_file in enumerate(args.hits_file):
+            if not first_run and args.sleep_seconds > 0:
+                print 'Waiting {0} second(s)'.format(args.sleep_seconds),
+                for i in range(args.sleep_seconds):
+                    print ' .',
+                    sys.stdout.flush()
+                    sleep(1)
+                print
+                print
             
-                if args.dry_run_enabled:
-                    _ = HIT(block_id=block_id, hit_xml=_hit_xml,
-                      language_pair=language_pair, mturk_only=args.mturk_only)
+            else:
+                first_run = False
             
+            # In streaming mode, one <hit> element is in memory at a time.
+            if args.stream_enabled:
+                _checkpoint = '{0}.checkpoint'.format(_hits_file)
+                if validator:
+                    _records = validator.iter_records(_index)
                 else:
-                    # Use get_or_create() to avoid exact duplicates.  We do allow
-                    # them for WMT13 to measure intra-annotator agreement...
-                    h = HIT(block_id=block_id, hit_xml=_hit_xml,
-                      language_pair=language_pair, mturk_only=args.mturk_only)
-                    h.save()
+                    _records = iter_hits_xml_file(_hits_file)
+                
+                _records = number_records(_records)
+                
+                # Checkpoints are kept if resuming fails, e.g. for a wrong
+                # file.
+                _hits = statistics.hits
+                try:
+                    _count = None
+                    if args.resume_enabled:
+                        _count = load_checkpoint(_checkpoint)
+                    
+                    if _count is not None:
+                        print 'Resuming after {0} HITs'.format(_count)
+                        _records = resume_after_records(_records, _count,
+                          statistics, chunk_size=args.chunk_size)
+                    
+                    if args.skip_duplicates or args.report_duplicates:
+                        _records = check_duplicates(_records, statistics,
+                          skip=args.skip_duplicates,
+                          chunk_size=args.chunk_size)
+                    
+                    if args.dry_run_enabled:
+                        statistics.add(sum([1 for _ in _records]), 0)
+                    
+                    else:
+                        _on_commit = lambda record: save_checkpoint(
+                          _checkpoint, record)
+                        bulk_import_hits(_records, mturk_only=args.mturk_only,
+                          chunk_size=args.chunk_size, statistics=statistics,
+                          on_commit=_on_commit)
+                        remove_checkpoint(_checkpoint)
+                
+                except ValueError, msg:
+                    print
+                    print '[{0}]'.format(_hits_file)
+                    print msg
+                    print
+                    continue
+                
+                # HITs committed before an invalid HIT remain imported;  once
+                # the file has been fixed, --resume imports the remaining HITs.
+                except ValidationError, msg:
+                    print
+                    print '[{0}]'.format(_hits_file)
+                    print u'; '.join(msg.messages)
+                    print 'Imported {0} HITs before the invalid HIT.'.format(
+                      statistics.hits - _hits)
+                    print
+                    continue
+                
+                print_summary(_hits_file, statistics.hits - _hits, statistics,
+                  args.skip_duplicates or args.report_duplicates or _count)
+                continue
+            
+            hits_xml_string = None
+            with open(_hits_file) as infile:
+                hits_xml_string = unicode(infile.read(), "utf-8")
+            
+            # Validate XML before trying to import anything from the given
+            # file.  This parses the file once and extracts all HIT and
+            # segment data.
+            _records = parse_hits_xml_file(hits_xml_string)
+            
+            if args.skip_duplicates or args.report_duplicates:
+                _records = check_duplicates(_records, statistics,
+                  skip=args.skip_duplicates, chunk_size=args.chunk_size)
         
-            # pylint: disable-msg=W0703
-            except Exception, msg:
-                print msg
-                _errors = _errors + 1
+            _errors = 0
+            _total = 0
+            
+            # In bulk mode, the already validated HITs are inserted in chunks.
+            if args.bulk_enabled and not args.dry_run_enabled:
+                _hits = statistics.hits
+                bulk_import_hits(_records, mturk_only=args.mturk_only,
+                  chunk_size=args.chunk_size, statistics=statistics)
+                
+                print_summary(_hits_file, statistics.hits - _hits, statistics,
+                  args.skip_duplicates or args.report_duplicates)
+                continue
+        
+            for _record in _records:
+                language_pair = get_language_pair(_record.attributes)
+                
+                try:
+                    _total = _total + 1
+                    
+                    if args.dry_run_enabled:
+                        _ = HIT.from_record(_record, language_pair,
+                          mturk_only=args.mturk_only)
+                    
+                    else:
+                        # Use get_or_create() to avoid exact duplicates.  We do
+                        # allow them for WMT13 to measure intra-annotator
+                        # agreement...
+                        h = HIT.from_record(_record, language_pair,
+                          mturk_only=args.mturk_only)
+                        h.save()
+                
+                # pylint: disable-msg=W0703
+                except Exception, msg:
+                    print msg
+                    _errors = _errors + 1
+        
+            print
+            print '[{0}]'.format(_hits_file)
+            print 'Successfully imported {0} HITs, encountered errors for ' \
+              '{1} HITs.'.format(_total, _errors)
+            if args.skip_duplicates or args.report_duplicates:
+                print statistics.describe_duplicates()
+            print
     
-        print
-        print '[{0}]'.format(_hits_file)
-        print 'Successfully imported {0} HITs, encountered errors for ' \
-          '{1} HITs.'.format(_total, _errors)
-        print
+    # The validator's worker processes have to be stopped on errors, too.
+    finally:
+        if validator:
+            validator.close()
@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Project: Appraise evaluation system
+ Author: Christian Federmann <cfedermann@gmail.com>
+
+usage: python ingest_wmt13_corpus.py [-h] --source-language SOURCE_LANGUAGE
+                                     --target-language TARGET_LANGUAGE
+                                     [--system-names SYSTEM_NAMES]
+                                     [--block-id BLOCK_ID] [--seed SEED]
+                                     [--dry-run] [--mturk-only]
+                                     [--chunk-size CHUNK_SIZE]
+                                     [--skip-duplicates] [--pair-balanced]
+                                     [--oversample FACTOR]
+                                     source-file reference-file
+                                     system-file [system-file ...]
+
+Builds HITs from parallel source, reference and system output files and
+imports them into the Django database.  Replaces building XML files with
+scripts/build_xml.py and importing them with import_wmt13_xml.py.
+
+positional arguments:
+  source-file           Source language file, one segment per line.
+  reference-file        Reference translation file, parallel to source.
+  system-file           System output files, parallel to source.  File
+                        names without directories are used as system
+                        names, unless --system-names is given.
+
+optional arguments:
+  -h, --help            Show this help message and exit.
+  --source-language SOURCE_LANGUAGE
+                        ISO-639-3 code of the source language.
+  --target-language TARGET_LANGUAGE
+                        ISO-639-3 code of the target language.
+  --system-names SYSTEM_NAMES
+                        Comma-separated system names, one per system file.
+  --block-id BLOCK_ID   Block-id of the first HIT.
+  --seed SEED           Seed for the random number generator used to break
+                        ties when sampling systems.
+  --dry-run             Enable dry run to validate HITs without importing.
+  --mturk-only          Enable MTurk-only flag for all HITs.
+  --chunk-size CHUNK_SIZE
+                        Number of HITs per transaction.
+  --skip-duplicates     Skip HITs with the same contents as an existing or
+                        previously imported HIT.
+  --pair-balanced       Balance how often each system pair is compared
+                        instead of how often each system is shown.
+  --oversample FACTOR   Compare system pairs whose current win rate
+                        confidence intervals overlap FACTOR times as often
+                        as separated pairs.  Implies --pair-balanced.
+
+"""
+import argparse
+import os
+import sys
+
+PARSER = argparse.ArgumentParser(description="Builds HITs from parallel " \
+  "source, reference and system output files and imports them into the " \
+  "Django database.")
+PARSER.add_argument("source_file", metavar="source-file", help="Source " \
+  "language file, one segment per line.")
+PARSER.add_argument("reference_file", metavar="reference-file",
+  help="Reference translation file, parallel to source.")
+PARSER.add_argument("system_files", metavar="system-file", help="System " \
+  "output files, parallel to source.  File names without directories are " \
+  "used as system names, unless --system-names is given.", nargs='+')
+PARSER.add_argument("--source-language", action="store", required=True,
+  dest="source_language", help="ISO-639-3 code of the source language.")
+PARSER.add_argument("--target-language", action="store", required=True,
+  dest="target_language", help="ISO-639-3 code of the target language.")
+PARSER.add_argument("--system-names", action="store", default=None,
+  dest="system_names", help="Comma-separated system names, one per system " \
+  "file.")
+PARSER.add_argument("--block-id", action="store", default=1,
+  dest="block_id", help="Block-id of the first HIT.", type=int)
+PARSER.add_argument("--seed", action="store", default=None, dest="seed",
+  help="Seed for the random number generator used to break ties when " \
+  "sampling systems.", type=int)
+PARSER.add_argument("--dry-run", action="store_true", default=False,
+  dest="dry_run_enabled", help="Enable dry run to validate HITs without " \
+  "importing.")
+PARSER.add_argument("--mturk-only", action="store_true", default=False,
+  dest="mturk_only", help="Enable MTurk-only flag for all HITs.")
+PARSER.add_argument("--chunk-size", action="store", default=1000,
+  dest="chunk_size", help="Number of HITs per transaction.", type=int)
+PARSER.add_argument("--skip-duplicates", action="store_true", default=False,
+  dest="skip_duplicates", help="Skip HITs with the same contents as an " \
+  "existing or previously imported HIT.")
+PARSER.add_argument("--pair-balanced", action="store_true", default=False,
+  dest="pair_balanced", help="Balance how often each system pair is " \
+  "compared instead of how often each system is shown.")
+PARSER.add_argument("--oversample", action="store", default=None,
+  dest="oversample", metavar="FACTOR", help="Compare system pairs whose " \
+  "current win rate confidence intervals overlap FACTOR times as often as " \
+  "separated pairs.  Implies --pair-balanced.", type=float)
+
+
+if __name__ == "__main__":
+    args = PARSER.parse_args()
+    
+    # Properly set DJANGO_SETTINGS_MODULE environment variable.
+    os.environ['DJANGO_SETTINGS_MODULE'] = 'settings'
+    PROJECT_HOME = os.path.normpath(os.getcwd() + "/..")
+    sys.path.append(PROJECT_HOME)
+    
+    # We have just added appraise to the system path list, hence this works.
+    from django.core.exceptions import ValidationError
+    from appraise.wmt13.analytics import compute_overlapping_pairs, \
+      compute_win_rate_intervals
+    from appraise.wmt13.importer import BalancedSystemSampler, \
+      bulk_import_hits, check_duplicates, get_language_pair, \
+      ImportStatistics, iter_corpus_records, PairBalancedSampler
+    from appraise.wmt13.models import PairwiseJudgment
+    
+    # System names end up in HITs and exports, hence they must not depend on
+    # the directory the files are stored in.
+    if args.system_names is not None:
+        SYSTEM_NAMES = args.system_names.split(',')
+    else:
+        SYSTEM_NAMES = [os.path.basename(x) for x in args.system_files]
+    
+    if len(SYSTEM_NAMES) != len(args.system_files):
+        PARSER.error('expected {0} system names, got {1}'.format(
+          len(args.system_files), len(SYSTEM_NAMES)))
+    
+    if len(set(SYSTEM_NAMES)) != len(SYSTEM_NAMES):
+        PARSER.error('system names must be unique, use --system-names')
+    
+    try:
+        if args.oversample is not None:
+            _language_pair = get_language_pair({
+              'source-language': args.source_language,
+              'target-language': args.target_language})
+            _unused, _lower, _upper = compute_win_rate_intervals(
+              PairwiseJudgment.compute_win_counts(_language_pair),
+              SYSTEM_NAMES)
+            _overlap = compute_overlapping_pairs(_lower, _upper)
+            sampler = PairBalancedSampler(SYSTEM_NAMES,
+              weights=1 + (args.oversample - 1) * _overlap, seed=args.seed)
+            print '{0} of {1} system pairs overlap.'.format(
+              _overlap.sum() // 2, len(_overlap) * (len(_overlap) - 1) // 2)
+        
+        elif args.pair_balanced:
+            sampler = PairBalancedSampler(SYSTEM_NAMES, seed=args.seed)
+        
+        else:
+            sampler = BalancedSystemSampler(SYSTEM_NAMES, seed=args.seed)
+    
+    except ValueError, msg:
+        PARSER.error(msg)
+    
+    statistics = ImportStatistics()
+    _records = iter_corpus_records(args.source_file, args.reference_file,
+      args.system_files, args.source_language, args.target_language,
+      system_names=SYSTEM_NAMES, block_id=args.block_id, sampler=sampler)
+    
+    if args.skip_duplicates:
+        _records = check_duplicates(_records, statistics, skip=True,
+          chunk_size=args.chunk_size)
+    
+    # HITs are committed chunk by chunk;  on errors, previous chunks remain.
+    try:
+        if args.dry_run_enabled:
+            statistics.add(sum([1 for _ in _records]), 0)
+        
+        else:
+            bulk_import_hits(_records, mturk_only=args.mturk_only,
+              chunk_size=args.chunk_size, statistics=statistics)
+    
+    except ValidationError, msg:
+        print u'; '.join(msg.messages)
+    
+    print
+    print 'Successfully imported {0} HITs.'.format(statistics.hits)
+    print unicode(statistics)
+    if args.skip_duplicates:
+        print statistics.describe_duplicates()
+    
+    print 'Sampled segments per system:'
+    for name, count in zip(sampler.systems, sampler.counts):
+        print '{0:>40}: {1}'.format(name, count)
+    print
@@ -0,0 +1,250 @@
+# -*- coding: utf-8 -*-
+"""
+Project: Appraise evaluation system
+ Author: Christian Federmann <cfedermann@gmail.com>
+
+Asynchronous logging for Appraise.
+
+QueueHandler instances put log records on a queue which is processed by a
+background writer thread, hence requests never wait for log files.  Records
+are only formatted by the writer thread;  LazyMessage also defers formatting
+of str.format() style messages until then.  SamplingFilter keeps a fraction
+of the records below WARNING for noisy loggers.
+
+This module is imported by settings.py and must not depend on Django.  It
+may be loaded both as logqueue and as appraise.logqueue, hence messages are
+checked by type, not by class.
+
+"""
+import atexit
+import logging
+import os
+
+from Queue import Full, Queue
+from random import random
+from threading import Lock, Thread
+
+
+# Maximum number of records waiting for the writer thread.  If the queue is
+# full, records are dropped instead of blocking the request.
+LOG_QUEUE_SIZE = 10000
+
+# Seconds to wait for queued records to be written at exit.
+LOG_EXIT_TIMEOUT = 5.0
+
+# Queue and writer thread of the current process.  The writer thread does
+# not survive a fork, so both are created again for each new process.
+_LOCK = Lock()
+_STATE = {'pid': None, 'queue': None, 'thread': None, 'dropped': 0}
+
+
+class LazyMessage(object):
+    """
+    Log message which is formatted using unicode.format() when written.
+    
+    Arguments are kept by reference until then.  Hence, they should be
+    values which do not change and which can be formatted without database
+    access, e.g. ids and usernames instead of model instances.
+    
+    """
+    __slots__ = ('fmt', 'args', 'kwargs')
+    
+    def __init__(self, fmt, *args, **kwargs):
+        """
+        Creates a new message from format String and arguments.
+        """
+        self.fmt = fmt
+        self.args = args
+        self.kwargs = kwargs
+    
+    def __unicode__(self):
+        """
+        Returns the formatted message.
+        """
+        return unicode(self.fmt).format(*self.args, **self.kwargs)
+    
+    def __str__(self):
+        """
+        Returns the formatted message, encoded as UTF-8.
+        """
+        return unicode(self).encode('utf-8')
+
+
+class LazyLines(object):
+    """
+    LazyMessage argument which formats a sequence of tuples as lines.
+    
+    Each tuple is formatted using fmt when the message is written.  The
+    sequence itself is copied, so it can be changed afterwards.
+    
+    """
+    __slots__ = ('rows', 'fmt')
+    
+    def __init__(self, rows, fmt=u'{0}: {1}'):
+        """
+        Creates a new instance for the given tuples and line format.
+        """
+        self.rows = list(rows)
+        self.fmt = fmt
+    
+    def __unicode__(self):
+        """
+        Returns the formatted lines, separated by newlines.
+        """
+        return u'\n'.join([self.fmt.format(*x) for x in self.rows])
+    
+    def __str__(self):
+        """
+        Returns the formatted lines, encoded as UTF-8.
+        """
+        return unicode(self).encode('utf-8')
+
+
+def _write_records(queue):
+    """
+    Passes queued records to their target handlers until stopped.
+    """
+    while True:
+        _item = queue.get()
+        if _item is None:
+            break
+        
+        handler, record = _item
+        if _STATE['dropped']:
+            with _LOCK:
+                _dropped, _STATE['dropped'] = _STATE['dropped'], 0
+            
+            handler.handle(logging.LogRecord(__name__, logging.WARNING,
+              __file__, 0, 'Dropped {0} log records, the queue was ' \
+              'full.'.format(_dropped), None, None))
+        
+        try:
+            if not isinstance(record.msg, basestring):
+                record.msg = unicode(record.msg)
+            
+            handler.handle(record)
+        
+        # A broken message or handler must not stop the writer thread.
+        # pylint: disable-msg=W0703
+        except Exception:
+            handler.handleError(record)
+
+
+def _get_queue():
+    """
+    Returns the queue of the current process, starting its writer thread.
+    """
+    if _STATE['pid'] != os.getpid():
+        with _LOCK:
+            if _STATE['pid'] != os.getpid():
+                _STATE['queue'] = Queue(LOG_QUEUE_SIZE)
+                _STATE['thread'] = Thread(target=_write_records,
+                  args=(_STATE['queue'],), name='appraise-log-writer')
+                _STATE['thread'].daemon = True
+                _STATE['thread'].start()
+                _STATE['dropped'] = 0
+                _STATE['pid'] = os.getpid()
+    
+    return _STATE['queue']
+
+
+def stop(timeout=LOG_EXIT_TIMEOUT):
+    """
+    Writes all queued records and stops the writer thread.
+    
+    A new writer thread is started if records are logged afterwards.
+    
+    """
+    with _LOCK:
+        if _STATE['pid'] != os.getpid():
+            return
+        
+        _STATE['pid'] = None
+        _queue, _thread = _STATE['queue'], _STATE['thread']
+    
+    try:
+        _queue.put(None, timeout=timeout)
+        _thread.join(timeout)
+    
+    except Full:
+        pass
+
+
+class QueueHandler(logging.Handler):
+    """
+    Hands log records to the writer thread which passes them to target.
+    
+    The level of the target handler is used as initial level.  Formatters
+    are set on the target handler, filters on the QueueHandler so that
+    filtered records are never queued.
+    
+    """
+    def __init__(self, target):
+        """
+        Creates a new QueueHandler instance for the given target handler.
+        """
+        logging.Handler.__init__(self, level=target.level)
+        self.target = target
+    
+    def setFormatter(self, fmt):
+        """
+        Sets the formatter of the target handler.
+        """
+        self.target.setFormatter(fmt)
+    
+    def emit(self, record):
+        """
+        Queues the given record, drops it if the queue is full.
+        """
+        try:
+            _get_queue().put_nowait((self.target, record))
+        
+        except Full:
+            with _LOCK:
+                _STATE['dropped'] += 1
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keeps a random fraction of the records below WARNING per logger.
+    
+    The rates dictionary maps logger names to fractions between 0 and 1;  a
+    rate also applies to all child loggers without a rate of their own.
+    
+    """
+    def __init__(self, rates):
+        """
+        Creates a new SamplingFilter instance for the given rates.
+        """
+        logging.Filter.__init__(self)
+        self.rates = rates
+    
+    def filter(self, record):
+        """
+        Checks if the given record should be logged.
+        
+        The decision is stored in the record so that all handlers sharing
+        this filter keep the same records.
+        
+        """
+        if record.levelno >= logging.WARNING or not self.rates:
+            return True
+        
+        _sampled = getattr(record, 'sampled', None)
+        if _sampled is None:
+            _rate = 1.0
+            _name = record.name
+            while _name:
+                if _name in self.rates:
+                    _rate = self.rates[_name]
+                    break
+                
+                _name = _name.rpartition('.')[0]
+            
+            _sampled = _rate >= 1.0 or random() < _rate
+            record.sampled = _sampled
+        
+        return _sampled
+
+
+atexit.register(stop)
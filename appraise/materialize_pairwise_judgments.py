@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Project: Appraise evaluation system
+ Author: Christian Federmann <cfedermann@gmail.com>
+
+usage: materialize_pairwise_judgments.py [-h] [--rebuild] [--chunk-size N]
+
+Fills the PairwiseJudgment table for existing WMT13 ranking results.
+
+optional arguments:
+  -h, --help      Show this help message and exit.
+  --rebuild       Delete and re-create all pairwise judgments.
+  --chunk-size N  Number of pairwise judgments inserted per query.
+
+"""
+from itertools import combinations
+import argparse
+import os
+import sys
+
+PARSER = argparse.ArgumentParser(description="Fills the PairwiseJudgment " \
+  "table for existing WMT13 ranking results.")
+PARSER.add_argument("--rebuild", action="store_true", default=False,
+  dest="rebuild", help="Delete and re-create all pairwise judgments.")
+PARSER.add_argument("--chunk-size", action="store", default=5000,
+  dest="chunk_size", metavar="N", help="Number of pairwise judgments " \
+  "inserted per query.", type=int)
+
+
+if __name__ == "__main__":
+    args = PARSER.parse_args()
+    
+    # Properly set DJANGO_SETTINGS_MODULE environment variable.
+    os.environ['DJANGO_SETTINGS_MODULE'] = 'settings'
+    PROJECT_HOME = os.path.normpath(os.getcwd() + "/..")
+    sys.path.append(PROJECT_HOME)
+    
+    # We have just added appraise to the system path list, hence this works.
+    from django.db import connection, transaction
+    from appraise.wmt13.analytics import iter_database_rankings
+    from appraise.wmt13.models import HIT, PairwiseJudgment, System
+    
+    if args.rebuild:
+        # A single DELETE statement, avoiding Django's per-object collector.
+        cursor = connection.cursor()
+        cursor.execute('DELETE FROM {0}'.format(
+          PairwiseJudgment._meta.db_table))
+        transaction.commit_unless_managed()
+    
+    # Results which have already been materialized, e.g. by the post_save
+    # signal handler, are skipped.
+    _done = set(PairwiseJudgment.objects.order_by().values_list('result',
+      flat=True).distinct())
+    
+    # Maps (language pair, system names) to integer System keys.
+    _system_ids = {}
+    
+    judgments = []
+    created = 0
+    for result_id, language_pair, segment_id, user_id, systems, ranks in \
+      iter_database_rankings(HIT.objects.all(), judge_field='user'):
+        if result_id in _done:
+            continue
+        
+        _key = (language_pair, tuple(systems))
+        if not _key in _system_ids:
+            _system_ids[_key] = System.get_system_ids(language_pair, systems)
+        system_ids = _system_ids[_key]
+        
+        # A lower rank is better, hence a positive outcome iff a < b.
+        for a, b in combinations(range(5), 2):
+            judgments.append(PairwiseJudgment(result_id=result_id,
+              language_pair=language_pair, segment=segment_id,
+              judge_id=user_id, system_a_id=system_ids[a],
+              system_b_id=system_ids[b],
+              outcome=cmp(ranks[b], ranks[a])))
+        
+        if len(judgments) >= args.chunk_size:
+            PairwiseJudgment.objects.bulk_create(judgments)
+            created += len(judgments)
+            judgments = []
+    
+    if judgments:
+        PairwiseJudgment.objects.bulk_create(judgments)
+        created += len(judgments)
+    
+    print 'Created {0} pairwise judgments.'.format(created)
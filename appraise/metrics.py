@@ -0,0 +1,317 @@
+# -*- coding: utf-8 -*-
+"""
+Project: Appraise evaluation system
+ Author: Christian Federmann <cfedermann@gmail.com>
+
+Operational metrics for Appraise.
+
+Counters and latency histograms are kept in memory by each process and are
+regularly written to a file of their own in METRICS_ROOT.  The metrics view
+sums the files of all processes, including terminated ones, and renders the
+result in the Prometheus text exposition format.  Hence, METRICS_ROOT should
+be emptied whenever the server is restarted.
+
+"""
+import atexit
+import json
+import logging
+import os
+
+from threading import Lock, Timer
+from time import time
+from uuid import uuid4
+
+from appraise.settings import LOG_LEVEL, LOG_HANDLER, METRICS_ROOT
+from appraise.utils import create_directory
+
+# Setup logging support.
+logging.basicConfig(level=LOG_LEVEL)
+LOGGER = logging.getLogger('appraise.metrics')
+LOGGER.addHandler(LOG_HANDLER)
+
+
+# Known metrics, mapping names to type and help text.
+METRICS = {
+  'appraise_hit_assignment_seconds': ('histogram',
+    'Time needed to compute the next WMT13 HIT for a user.'),
+  'appraise_result_submission_seconds': ('histogram',
+    'Time needed to store a single result.'),
+  'appraise_status_refresh_seconds': ('histogram',
+    'Time needed to refresh one key of the WMT13 status cache.'),
+  'appraise_ranking_recomputation_seconds': ('histogram',
+    'Time needed to recompute the ranking clusters.'),
+  'appraise_hits_assigned_total': ('counter',
+    'Number of new WMT13 User/HIT mappings.'),
+  'appraise_results_saved_total': ('counter',
+    'Number of stored results.'),
+  'appraise_cache_requests_total': ('counter',
+    'Number of cache lookups by cache and result.'),
+}
+
+# Upper bounds of the latency histogram buckets, in seconds.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+  10.0, 30.0, 60.0, 120.0)
+
+# Minimum number of seconds between two writes of a process' metrics file.
+METRICS_FLUSH_SECONDS = 1.0
+
+create_directory(METRICS_ROOT)
+
+# Metrics of the current process.  Values are reset after a fork, as the
+# parent process keeps writing its own metrics file.
+_LOCK = Lock()
+_STATE = {'pid': None, 'path': None, 'values': {}, 'flushed': 0.0,
+  'timer': None}
+
+
+def _get_values():
+    """
+    Returns the metric values of the current process.
+    
+    Must be called with _LOCK held.
+    
+    """
+    if _STATE['pid'] != os.getpid():
+        # Process ids are re-used, so file names need a unique suffix.
+        _STATE['pid'] = os.getpid()
+        _STATE['path'] = os.path.join(METRICS_ROOT,
+          'metrics-{0}-{1}.json'.format(os.getpid(), uuid4().hex[:8]))
+        _STATE['values'] = {}
+        _STATE['flushed'] = 0.0
+        _STATE['timer'] = None
+    
+    return _STATE['values']
+
+
+def _write_values():
+    """
+    Writes the metric values of the current process to its metrics file.
+    
+    Must be called with _LOCK held.
+    
+    """
+    _values = [[name, list(labels), value]
+      for (name, labels), value in _get_values().items()]
+    _STATE['flushed'] = time()
+    
+    # Other processes must never read partially written files.
+    _tmp = _STATE['path'] + '.tmp'
+    try:
+        with open(_tmp, 'w') as metrics_file:
+            json.dump(_values, metrics_file)
+        os.rename(_tmp, _STATE['path'])
+    
+    except (IOError, OSError), msg:
+        LOGGER.error('Could not write metrics: {0}'.format(msg))
+
+
+def flush():
+    """
+    Writes the metric values of the current process to disk.
+    """
+    with _LOCK:
+        _STATE['timer'] = None
+        if _STATE['pid'] == os.getpid():
+            _write_values()
+
+
+def _record(name, labels, update):
+    """
+    Applies update to the value of the given metric and label set.
+    
+    Metrics are written to disk at most every METRICS_FLUSH_SECONDS;  a
+    timer writes any updates recorded in between.
+    
+    """
+    _key = (name, tuple(sorted([(x, unicode(y)) for x, y in
+      labels.items()])))
+    with _LOCK:
+        _values = _get_values()
+        _values[_key] = update(_values.get(_key))
+        
+        if time() - _STATE['flushed'] >= METRICS_FLUSH_SECONDS:
+            _write_values()
+        
+        elif _STATE['timer'] is None:
+            _STATE['timer'] = Timer(METRICS_FLUSH_SECONDS, flush)
+            _STATE['timer'].daemon = True
+            _STATE['timer'].start()
+
+
+def increment(name, amount=1, **labels):
+    """
+    Increments the given counter.
+    """
+    _record(name, labels, lambda value: (value or 0) + amount)
+
+
+def observe(name, seconds, **labels):
+    """
+    Adds an observation of the given duration to the given histogram.
+    
+    Histogram values are lists of per-bucket counts, including +Inf,
+    followed by the sum of all observations.
+    
+    """
+    def _update(value):
+        """Adds seconds to the given histogram value."""
+        if value is None:
+            value = [0] * (len(LATENCY_BUCKETS) + 1) + [0.0]
+        
+        _bucket = len(LATENCY_BUCKETS)
+        for index, bound in enumerate(LATENCY_BUCKETS):
+            if seconds <= bound:
+                _bucket = index
+                break
+        
+        value[_bucket] += 1
+        value[-1] += seconds
+        return value
+    
+    _record(name, labels, _update)
+
+
+class timed(object):
+    """
+    Observes the wall time of a block or function in the given histogram.
+    
+    Can be used both as context manager and as function decorator.
+    
+    """
+    # pylint: disable-msg=C0103
+    def __init__(self, name, **labels):
+        """
+        Creates a timer for the given histogram and labels.
+        """
+        self.name = name
+        self.labels = labels
+        self.start = None
+    
+    def __enter__(self):
+        """
+        Starts timing.
+        """
+        self.start = time()
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        """
+        Stops timing and records the observation.
+        """
+        observe(self.name, time() - self.start, **self.labels)
+        return False
+    
+    def __call__(self, function):
+        """
+        Returns a wrapper timing each call of the given function.
+        """
+        def _wrapper(*args, **kwargs):
+            """Calls function, observing its wall time."""
+            with timed(self.name, **self.labels):
+                return function(*args, **kwargs)
+        
+        _wrapper.__name__ = function.__name__
+        _wrapper.__doc__ = function.__doc__
+        _wrapper.__module__ = function.__module__
+        return _wrapper
+
+
+def collect():
+    """
+    Returns the summed metric values of all processes.
+    
+    Returns a dict mapping (name, labels) tuples to values.
+    
+    """
+    flush()
+    
+    totals = {}
+    for name in os.listdir(METRICS_ROOT):
+        if not name.startswith('metrics-') or not name.endswith('.json'):
+            continue
+        
+        try:
+            with open(os.path.join(METRICS_ROOT, name)) as metrics_file:
+                _values = json.load(metrics_file)
+        
+        # Files may have been removed when the server was restarted.
+        except (IOError, ValueError):
+            continue
+        
+        for _name, _labels, value in _values:
+            _key = (_name, tuple([tuple(x) for x in _labels]))
+            if isinstance(value, list):
+                _total = totals.setdefault(_key, [0] * len(value))
+                totals[_key] = [x + y for x, y in zip(_total, value)]
+            
+            else:
+                totals[_key] = totals.get(_key, 0) + value
+    
+    return totals
+
+
+def _format_labels(labels):
+    """
+    Returns the given (name, value) pairs in Prometheus label syntax.
+    """
+    if not labels:
+        return ''
+    
+    _escaped = [(name, value.replace('\\', '\\\\').replace('"',
+      '\\"').replace('\n', '\\n')) for name, value in labels]
+    return u'{{{0}}}'.format(u','.join([u'{0}="{1}"'.format(*x)
+      for x in _escaped]))
+
+
+def render_metrics():
+    """
+    Returns the metrics of all processes in Prometheus text format.
+    """
+    _totals = collect()
+    _bounds = [repr(x) for x in LATENCY_BUCKETS] + ['+Inf']
+    
+    lines = []
+    for name in sorted(METRICS.keys()):
+        _type, _help = METRICS[name]
+        lines.append(u'# HELP {0} {1}'.format(name, _help))
+        lines.append(u'# TYPE {0} {1}'.format(name, _type))
+        
+        for (_name, labels), value in sorted(_totals.items()):
+            if _name != name:
+                continue
+            
+            if _type == 'counter':
+                lines.append(u'{0}{1} {2}'.format(name,
+                  _format_labels(labels), value))
+                continue
+            
+            _cumulative = 0
+            for bound, count in zip(_bounds, value[:-1]):
+                _cumulative += count
+                lines.append(u'{0}_bucket{1} {2}'.format(name,
+                  _format_labels(labels + (('le', bound),)), _cumulative))
+            
+            lines.append(u'{0}_sum{1} {2!r}'.format(name,
+              _format_labels(labels), value[-1]))
+            lines.append(u'{0}_count{1} {2}'.format(name,
+              _format_labels(labels), _cumulative))
+    
+    return u'\n'.join(lines) + u'\n'
+
+
+def _shutdown():
+    """
+    Stops a pending timer and writes the metric values at exit.
+    """
+    with _LOCK:
+        _timer = _STATE['timer'] if _STATE['pid'] == os.getpid() else None
+    
+    # Timer threads must not run while the interpreter shuts down.
+    if _timer is not None:
+        _timer.cancel()
+        _timer.join()
+    
+    flush()
+
+
+atexit.register(_shutdown)
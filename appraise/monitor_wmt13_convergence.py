@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Project: Appraise evaluation system
+ Author: Christian Federmann <cfedermann@gmail.com>
+
+usage: python monitor_wmt13_convergence.py [-h] [--force]
+                                           [--interval SECONDS]
+
+Checks ranking convergence for all language pairs and marks converged
+language pairs as saturated.  Run this periodically, e.g. from cron, or
+keep it running using --interval;  the status page only shows the results
+of the last check.
+
+optional arguments:
+  -h, --help          Show this help message and exit.
+  --force             Check even if too few new judgments have been
+                      collected since the last check.
+  --interval SECONDS  Repeat the check every SECONDS seconds.
+
+"""
+from time import sleep
+import argparse
+import os
+import sys
+
+PARSER = argparse.ArgumentParser(description="Checks ranking convergence " \
+  "for all language pairs and marks converged language pairs as saturated.")
+PARSER.add_argument("--force", action="store_true", default=False,
+  dest="force", help="Check even if too few new judgments have been " \
+  "collected since the last check.")
+PARSER.add_argument("--interval", action="store", default=None,
+  dest="interval", metavar="SECONDS", help="Repeat the check every " \
+  "SECONDS seconds.", type=int)
+
+
+if __name__ == "__main__":
+    args = PARSER.parse_args()
+    
+    # Properly set DJANGO_SETTINGS_MODULE environment variable.
+    os.environ['DJANGO_SETTINGS_MODULE'] = 'settings'
+    PROJECT_HOME = os.path.normpath(os.getcwd() + "/..")
+    sys.path.append(PROJECT_HOME)
+    
+    # We have just added appraise to the system path list, hence this works.
+    from appraise.wmt13.convergence import update_convergence
+    
+    while True:
+        for status in update_convergence(force=args.force):
+            print u'{0}  {1:<10} {2:>2} stable  {3:>8} judgments  {4}'.format(
+              status.language_pair, 'saturated' if status.is_saturated()
+              else 'open', status.stable_checks, status.judgments,
+              status.clusters).encode('utf-8')
+        print
+        
+        if not args.interval:
+            break
+        
+        sleep(args.interval)
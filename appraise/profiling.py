@@ -0,0 +1,341 @@
+# -*- coding: utf-8 -*-
+"""
+Project: Appraise evaluation system
+ Author: Christian Federmann <cfedermann@gmail.com>
+
+Request profiling for Appraise.
+
+RequestProfilingMiddleware records wall time, SQL query count and SQL time
+for every request and appends them as JSON lines to a rotating request log
+in PROFILING_ROOT.  A PROFILING_SAMPLE_RATE fraction of requests, and all
+requests by staff users which carry the PROFILING_HEADER, additionally run
+under cProfile;  the profile and the full query list are stored next to the
+request log, keeping the newest PROFILING_MAX_PROFILES profiles only.
+
+Queries of other requests are only counted and timed by QueryCountingCursor;
+their SQL is neither formatted nor kept in memory, unless DEBUG or the debug
+cursor, e.g. for benchmarks, have been enabled.
+
+"""
+import json
+import logging
+import os
+import re
+
+from cProfile import Profile
+from datetime import datetime
+from logging.handlers import RotatingFileHandler
+from random import random
+from time import time
+from uuid import uuid4
+
+from django.conf import settings
+from django.db import connection
+from django.db.backends.util import CursorDebugWrapper, CursorWrapper
+
+from appraise.settings import LOG_LEVEL, LOG_HANDLER, PROFILING_HEADER, \
+  PROFILING_ROOT, PROFILING_SAMPLE_RATE
+from appraise.utils import create_directory
+
+# Setup logging support.
+logging.basicConfig(level=LOG_LEVEL)
+LOGGER = logging.getLogger('appraise.profiling')
+LOGGER.addHandler(LOG_HANDLER)
+
+
+# Number of profiles kept in PROFILING_ROOT, older ones are removed.
+PROFILING_MAX_PROFILES = 100
+
+# Size and number of backups of the rotating request log.
+PROFILING_LOG_BYTES = 4 * 1024 * 1024
+PROFILING_LOG_BACKUPS = 5
+
+PROFILING_LOG_FILENAME = os.path.join(PROFILING_ROOT, 'requests.log')
+
+# Profile ids consist of a timestamp, the process id and a random suffix.
+PROFILE_ID_PATTERN = re.compile(r'^\d{8}-\d{6}-\d+-[0-9a-f]{8}$')
+
+# Endpoint name used for requests which have not been resolved to a view.
+UNRESOLVED_ENDPOINT = '<unresolved>'
+
+create_directory(PROFILING_ROOT)
+
+# Request records are JSON lines in their own log, without any prefix.
+REQUEST_LOGGER = logging.getLogger('appraise.profiling.requests')
+REQUEST_LOGGER.propagate = False
+REQUEST_LOGGER.setLevel(logging.INFO)
+_REQUEST_HANDLER = RotatingFileHandler(filename=PROFILING_LOG_FILENAME,
+  mode="a", maxBytes=PROFILING_LOG_BYTES, backupCount=PROFILING_LOG_BACKUPS,
+  encoding="utf-8")
+_REQUEST_HANDLER.setFormatter(logging.Formatter('%(message)s'))
+REQUEST_LOGGER.addHandler(_REQUEST_HANDLER)
+
+
+class QueryCountingCursor(CursorWrapper):
+    """
+    Counts queries and their time on the connection, without their SQL.
+    """
+    def execute(self, sql, params=()):
+        """
+        Executes the given query and counts it.
+        """
+        self.set_dirty()
+        _start = time()
+        try:
+            return self.cursor.execute(sql, params)
+        
+        finally:
+            self.db.profiling_queries += 1
+            self.db.profiling_seconds += time() - _start
+    
+    def executemany(self, sql, param_list):
+        """
+        Executes the given query for all parameters and counts it once.
+        """
+        self.set_dirty()
+        _start = time()
+        try:
+            return self.cursor.executemany(sql, param_list)
+        
+        finally:
+            self.db.profiling_queries += 1
+            self.db.profiling_seconds += time() - _start
+
+
+def _make_debug_cursor(cursor):
+    """
+    Replaces DatabaseWrapper.make_debug_cursor() during requests.
+    
+    Only requests which are profiled, or all if DEBUG or the debug cursor
+    have been enabled, record their queries in connection.queries;  others
+    only count them.
+    
+    """
+    if getattr(connection, 'profiling_count_only', False):
+        return QueryCountingCursor(cursor, connection)
+    
+    return CursorDebugWrapper(cursor, connection)
+
+
+def _should_profile(request):
+    """
+    Checks if the given request should run under cProfile.
+    """
+    if PROFILING_HEADER in request.META:
+        _user = getattr(request, 'user', None)
+        if _user is not None and _user.is_staff:
+            return True
+        
+        LOGGER.warning('Ignoring profiling header from non-staff user ' \
+          '"{0}".'.format(getattr(_user, 'username', None) or "Anonymous"))
+    
+    return PROFILING_SAMPLE_RATE > 0 and random() < PROFILING_SAMPLE_RATE
+
+
+def save_profile(profile, queries, record):
+    """
+    Stores the given profile, queries and request record.
+    
+    Returns the new profile id.  Profiles beyond PROFILING_MAX_PROFILES
+    are removed, oldest first.
+    
+    """
+    profile_id = '{0:%Y%m%d-%H%M%S}-{1}-{2}'.format(datetime.now(),
+      os.getpid(), uuid4().hex[:8])
+    _path = os.path.join(PROFILING_ROOT, profile_id)
+    
+    profile.dump_stats(_path + '.prof')
+    with open(_path + '.json', 'w') as json_file:
+        json.dump(dict(record, profile=profile_id,
+          query_count=record['queries'], queries=queries), json_file,
+          indent=2)
+    
+    # Profile ids sort chronologically, up to processes within one second.
+    _profiles = sorted([x[:-5] for x in os.listdir(PROFILING_ROOT)
+      if x.endswith('.prof')])
+    for _old in _profiles[:-PROFILING_MAX_PROFILES]:
+        for extension in ('.prof', '.json'):
+            try:
+                os.remove(os.path.join(PROFILING_ROOT, _old + extension))
+            
+            # Another process may have removed the file already.
+            except OSError:
+                pass
+    
+    return profile_id
+
+
+def get_profile_path(profile_id, extension):
+    """
+    Returns the file path for the given profile id or None if unknown.
+    """
+    if not PROFILE_ID_PATTERN.match(profile_id) or not extension in (
+      'prof', 'json'):
+        return None
+    
+    _path = os.path.join(PROFILING_ROOT, '{0}.{1}'.format(profile_id,
+      extension))
+    return _path if os.path.exists(_path) else None
+
+
+def list_profiles():
+    """
+    Returns the request records of all stored profiles, newest first.
+    """
+    profiles = []
+    for name in sorted(os.listdir(PROFILING_ROOT), reverse=True):
+        if not name.endswith('.json'):
+            continue
+        
+        try:
+            with open(os.path.join(PROFILING_ROOT, name)) as json_file:
+                _record = json.load(json_file)
+        
+        # Profiles can be removed or still be written by other processes.
+        except (IOError, ValueError):
+            continue
+        
+        # Queries before the view has been resolved are only counted.
+        _queries = _record.pop('queries')
+        _record.setdefault('query_count', len(_queries))
+        profiles.append(_record)
+    
+    return profiles
+
+
+def iter_request_records():
+    """
+    Yields the request records from the request log and its backups.
+    """
+    _paths = [PROFILING_LOG_FILENAME] + ['{0}.{1}'.format(
+      PROFILING_LOG_FILENAME, x) for x in range(1, PROFILING_LOG_BACKUPS + 1)]
+    for path in _paths:
+        if not os.path.exists(path):
+            continue
+        
+        with open(path) as log_file:
+            for line in log_file:
+                try:
+                    yield json.loads(line)
+                
+                # Lines may be truncated if a process has been killed.
+                except ValueError:
+                    continue
+
+
+def compute_endpoint_stats(records):
+    """
+    Aggregates the given request records per endpoint.
+    
+    Returns a list of dicts, sorted by total wall time, slowest first.
+    Times are given in milliseconds.
+    
+    """
+    _endpoints = {}
+    for record in records:
+        _endpoints.setdefault(record['endpoint'], []).append(record)
+    
+    stats = []
+    for endpoint, _records in _endpoints.items():
+        _seconds = sorted([x['seconds'] for x in _records])
+        _count = len(_records)
+        stats.append({
+          'endpoint': endpoint,
+          'requests': _count,
+          'total': 1000 * sum(_seconds),
+          'mean': 1000 * sum(_seconds) / _count,
+          'p90': 1000 * _seconds[int(0.9 * (_count - 1))],
+          'max': 1000 * _seconds[-1],
+          'queries': sum([x['queries'] for x in _records]) / float(_count),
+          'sql': 1000 * sum([x['sql_seconds'] for x in _records]) / _count,
+        })
+    
+    stats.sort(key=lambda x: x['total'], reverse=True)
+    return stats
+
+
+class RequestProfilingMiddleware(object):
+    """
+    Records timing and SQL statistics for each request.
+    
+    This should be the first entry of MIDDLEWARE_CLASSES so that the wall
+    time includes all other middleware;  cProfile is only enabled once the
+    view has been resolved, when request.user is available.
+    
+    """
+    def process_request(self, request):
+        """
+        Starts timing and SQL query logging for the given request.
+        """
+        # Queries are counted by the debug cursor, see _make_debug_cursor();
+        # connection.queries is reset by Django for each request.
+        request.profiling = {'start': time(), 'profile': None,
+          'debug_cursor': connection.use_debug_cursor,
+          'queries': len(connection.queries),
+          'endpoint': UNRESOLVED_ENDPOINT}
+        connection.profiling_queries = 0
+        connection.profiling_seconds = 0.0
+        connection.profiling_count_only = not (settings.DEBUG
+          or connection.use_debug_cursor)
+        connection.make_debug_cursor = _make_debug_cursor
+        connection.use_debug_cursor = True
+    
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        """
+        Determines the endpoint and starts cProfile if requested.
+        """
+        _state = getattr(request, 'profiling', None)
+        if _state is None:
+            return None
+        
+        _state['endpoint'] = '{0}.{1}'.format(view_func.__module__,
+          view_func.__name__)
+        
+        if _should_profile(request):
+            # Profiled requests keep the SQL of their queries.
+            connection.profiling_count_only = False
+            _state['profile'] = Profile()
+            _state['profile'].enable()
+        
+        return None
+    
+    def process_response(self, request, response):
+        """
+        Stores the statistics and profile, if any, for the given request.
+        """
+        _state = getattr(request, 'profiling', None)
+        if _state is None:
+            return response
+        
+        _profile = _state['profile']
+        if _profile is not None:
+            _profile.disable()
+        
+        _seconds = time() - _state['start']
+        _queries = connection.queries[_state['queries']:]
+        connection.use_debug_cursor = _state['debug_cursor']
+        connection.profiling_count_only = False
+        
+        record = {
+          'time': datetime.now().isoformat(),
+          'endpoint': _state['endpoint'],
+          'method': request.method,
+          'path': request.path,
+          'status': response.status_code,
+          'seconds': _seconds,
+          'queries': connection.profiling_queries + len(_queries),
+          'sql_seconds': connection.profiling_seconds + sum(
+            [float(x['time']) for x in _queries]),
+        }
+        
+        if _profile is not None:
+            try:
+                record['profile'] = save_profile(_profile, _queries, record)
+            
+            # Profiling must never break the actual request.
+            # pylint: disable-msg=W0703
+            except Exception, msg:
+                LOGGER.error('Could not save profile: {0}'.format(msg))
+        
+        REQUEST_LOGGER.info(json.dumps(record))
+        return response
@@ -0,0 +1,36 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Project: Appraise evaluation system
+ Author: Christian Federmann <cfedermann@gmail.com>
+
+usage: register_wmt13_systems.py
+
+Registers System instances for RankingTasks which have been imported before
+integer system keys were introduced.
+
+"""
+import os
+import sys
+
+
+if __name__ == "__main__":
+    # Properly set DJANGO_SETTINGS_MODULE environment variable.
+    os.environ['DJANGO_SETTINGS_MODULE'] = 'settings'
+    PROJECT_HOME = os.path.normpath(os.getcwd() + "/..")
+    sys.path.append(PROJECT_HOME)
+    
+    # We have just added appraise to the system path list, hence this works.
+    from appraise.wmt13.models import RankingTask
+    
+    _updated = 0
+    for task in RankingTask.objects.filter(system_ids='').select_related(
+      'hit'):
+        task.update_system_ids()
+        
+        # Use update() to avoid re-validation of the task's XML.
+        RankingTask.objects.filter(id=task.id).update(
+          system_ids=task.system_ids)
+        _updated = _updated + 1
+    
+    print 'Registered systems for {0} RankingTasks.'.format(_updated)
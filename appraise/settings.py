@@ -8,20 +8,30 @@ from django import VERSION as DJANGO_VERSION
 import os
 ROOT_PATH = os.getcwd()
 
-from subprocess import check_output
+# The commit tag is read from VERSION_FILE which should be written when
+# deploying, see start-server.sh.sample.  Otherwise, it is determined from
+# the git checkout when a process starts.
+VERSION_FILE = '{0}/version.txt'.format(ROOT_PATH)
 try:
-    commit_log = check_output(['git', 'log', '--pretty=oneline'])
-    # pylint: disable-msg=E1103
-    COMMIT_TAG = commit_log.split('\n')[0].split()[0]
+    with open(VERSION_FILE) as version_file:
+        COMMIT_TAG = version_file.read().strip() or None
 
-# pylint: disable-msg=W0703
-except Exception, e:
-    COMMIT_TAG = None
+except IOError:
+    from subprocess import check_output
+    try:
+        COMMIT_TAG = check_output(['git', 'rev-parse', 'HEAD']).strip()
+    
+    # pylint: disable-msg=W0703
+    except Exception, e:
+        COMMIT_TAG = None
 
 FORCE_SCRIPT_NAME = ""
 
 import logging
 from logging.handlers import RotatingFileHandler
+# The appraise package is not importable before setup_environ() has run.
+# pylint: disable-msg=W0403
+from logqueue import QueueHandler, SamplingFilter
 
 # Logging settings for this Django project.
 LOG_LEVEL = logging.DEBUG
@@ -30,15 +40,73 @@ LOG_FORMAT = "[%(asctime)s] %(name)s::%(levelname)s %(message)s"
 LOG_DATE = "%m/%d/%Y @ %H:%M:%S"
 LOG_FORMATTER = logging.Formatter(LOG_FORMAT, LOG_DATE)
 
-LOG_HANDLER = RotatingFileHandler(filename=LOG_FILENAME, mode="a",
+# Levels for individual loggers, overriding LOG_LEVEL for them and their
+# child loggers, e.g. {'appraise.wmt13.views': logging.INFO}.
+LOG_LEVELS = {}
+
+# Fraction of records below WARNING which are kept per logger, including
+# child loggers, e.g. {'appraise.wmt13.views': 0.01}.  All other records
+# are kept.
+LOG_SAMPLE_RATES = {}
+
+# Log records are written by a background thread, see appraise.logqueue.
+LOG_FILE_HANDLER = RotatingFileHandler(filename=LOG_FILENAME, mode="a",
   maxBytes=1024*1024, backupCount=5, encoding="utf-8")
+LOG_HANDLER = QueueHandler(LOG_FILE_HANDLER)
 LOG_HANDLER.setLevel(level=LOG_LEVEL)
 LOG_HANDLER.setFormatter(LOG_FORMATTER)
+LOG_HANDLER.addFilter(SamplingFilter(LOG_SAMPLE_RATES))
+
+for _name, _level in LOG_LEVELS.items():
+    logging.getLogger(_name).setLevel(_level)
+
+# The root logger writes to stderr, also using the background thread.  This
+# turns the logging.basicConfig() calls of the Appraise modules into no-ops.
+if not logging.root.handlers:
+    _stream_handler = QueueHandler(logging.StreamHandler())
+    _stream_handler.setFormatter(logging.Formatter(logging.BASIC_FORMAT))
+    _stream_handler.addFilter(SamplingFilter(LOG_SAMPLE_RATES))
+    logging.root.addHandler(_stream_handler)
+    logging.root.setLevel(LOG_LEVEL)
 
 LOGIN_URL = '/appraise/login/'
 LOGIN_REDIRECT_URL = '/appraise/'
 LOGOUT_URL = '/appraise/logout/'
 
+# HIT allocation policy for WMT13, see appraise.wmt13.allocation.  Either
+# 'random' or 'uncertainty', which prefers HITs comparing system pairs with
+# overlapping rank ranges.
+WMT13_HIT_ALLOCATION_POLICY = 'random'
+
+# Request profiling, see appraise.profiling.  Requests are profiled with the
+# given probability, and if a staff user sends the "X-Appraise-Profile"
+# header which Django exposes as HTTP_X_APPRAISE_PROFILE.  All requests pay
+# for counting and timing their queries;  only profiled requests, or all if
+# DEBUG is enabled, also format their SQL and keep it in memory.
+PROFILING_ROOT = '/tmp/appraise-profiling'
+PROFILING_SAMPLE_RATE = 0.001
+PROFILING_HEADER = 'HTTP_X_APPRAISE_PROFILE'
+
+# Operational metrics, see appraise.metrics.  Each process writes its metrics
+# to METRICS_ROOT, which should be emptied when the server is restarted.  The
+# metrics view is only available to the listed client addresses.
+METRICS_ROOT = '/tmp/appraise-metrics'
+METRICS_ALLOWED_ADDRESSES = ('127.0.0.1', '::1')
+
+# Snapshots of status, ranking and task caches shared by all processes, see
+# appraise.snapshots.  Snapshots older than SNAPSHOT_MAX_AGE seconds are not
+# used to fill empty caches.  Snapshots are computed by one process at a time;
+# locks older than SNAPSHOT_LOCK_TIMEOUT seconds are considered abandoned.
+SNAPSHOT_ROOT = '/tmp/appraise-snapshots'
+SNAPSHOT_MAX_AGE = 24 * 3600
+SNAPSHOT_LOCK_TIMEOUT = 600
+
+# WMT13 status data older than STATUS_MAX_AGE seconds is still served but
+# refreshed in the background.  If no data is available, the status view
+# waits at most STATUS_TIME_BUDGET seconds before showing what it has.
+STATUS_MAX_AGE = 300
+STATUS_TIME_BUDGET = 5.0
+
 DEBUG = True
 TEMPLATE_DEBUG = DEBUG
 
@@ -106,6 +174,7 @@ TEMPLATE_LOADERS = (
 )
 
 MIDDLEWARE_CLASSES = (
+  'appraise.profiling.RequestProfilingMiddleware',
   'django.middleware.common.CommonMiddleware',
   'django.contrib.sessions.middleware.SessionMiddleware',
   'django.contrib.messages.middleware.MessageMiddleware',
@@ -0,0 +1,219 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Project: Appraise evaluation system
+ Author: Christian Federmann <cfedermann@gmail.com>
+
+usage: python simulate_hit_allocation.py [-h] [--runs RUNS]
+                                         [--refresh N] [--resamples N]
+                                         [--target FRACTION] [--seed SEED]
+                                         language-pair
+
+Replays existing WMT13 results to compare HIT allocation policies.
+
+Each step, a policy chooses one of the HITs with remaining recorded results
+and consumes its next result.  The 'random' policy chooses uniformly, the
+'uncertainty' policy prefers HITs comparing system pairs whose bootstrap
+rank ranges still overlap, see appraise.wmt13.allocation.  For each policy,
+the number of HITs and annotator hours needed until TARGET of the system
+pairs resolved by all results are resolved is reported.
+
+positional arguments:
+  language-pair      Language pair code, e.g. deu2eng.
+
+optional arguments:
+  -h, --help         Show this help message and exit.
+  --runs RUNS        Number of replays per policy.
+  --refresh N        Number of HITs between recomputations of rank ranges.
+  --resamples N      Number of bootstrap resamples for rank ranges.
+  --target FRACTION  Fraction of finally resolved system pairs to reach.
+  --seed SEED        Seed for the random number generator.
+
+"""
+from __future__ import print_function
+
+import argparse
+import os
+import sys
+
+import numpy as np
+
+PARSER = argparse.ArgumentParser(description="Replays existing WMT13 " \
+  "results to compare HIT allocation policies.")
+PARSER.add_argument("language_pair", metavar="language-pair",
+  help="Language pair code, e.g. deu2eng.")
+PARSER.add_argument("--runs", action="store", default=5, dest="runs",
+  help="Number of replays per policy.", type=int)
+PARSER.add_argument("--refresh", action="store", default=100,
+  dest="refresh", metavar="N", help="Number of HITs between " \
+  "recomputations of rank ranges.", type=int)
+PARSER.add_argument("--resamples", action="store", default=1000,
+  dest="resamples", metavar="N", help="Number of bootstrap resamples for " \
+  "rank ranges.", type=int)
+PARSER.add_argument("--target", action="store", default=0.9,
+  dest="target", metavar="FRACTION", help="Fraction of finally resolved " \
+  "system pairs to reach.", type=float)
+PARSER.add_argument("--seed", action="store", default=None, dest="seed",
+  help="Seed for the random number generator.", type=int)
+
+
+def load_replay_data(language_pair):
+    """
+    Loads recorded results for the given language pair from the database.
+    
+    Returns (systems, hits, system_sets, assignments) where system_sets is
+    an (items x 5) array of system indices and hits the corresponding HIT
+    index per item.  assignments maps HIT indices to lists of (winners,
+    losers, seconds) tuples, one per annotator, in chronological order.
+    
+    """
+    from appraise.utils import datetime_to_seconds
+    from appraise.wmt13.models import PairwiseJudgment, RankingResult, \
+      RankingTask, System
+    
+    _systems = list(System.objects.filter(language_pair=language_pair)
+      .values_list('id', flat=True))
+    _index = dict((x, i) for i, x in enumerate(_systems))
+    
+    _tasks = RankingTask.objects.filter(hit__language_pair=language_pair,
+      hit__active=True).exclude(system_ids='').order_by('hit')
+    _hits = {}
+    hits = []
+    system_sets = []
+    for hit_id, system_ids in _tasks.values_list('hit', 'system_ids'):
+        hits.append(_hits.setdefault(hit_id, len(_hits)))
+        system_sets.append([_index[int(x)] for x in system_ids.split(',')])
+    
+    _seconds = {}
+    _order = []
+    for hit_id, user_id, duration in RankingResult.objects.filter(
+      item__hit__in=_hits.keys()).values_list('item__hit', 'user',
+      'duration'):
+        _key = (hit_id, user_id)
+        if not _key in _seconds:
+            _order.append(_key)
+        _seconds[_key] = _seconds.get(_key, 0) + (datetime_to_seconds(
+          duration) if duration else 0)
+    
+    _decisions = {}
+    for hit_id, judge_id, system_a, system_b, outcome in \
+      PairwiseJudgment.objects.filter(language_pair=language_pair,
+      result__item__hit__in=_hits.keys()).exclude(outcome=0).values_list(
+      'result__item__hit', 'judge', 'system_a', 'system_b', 'outcome'):
+        _winner, _loser = (system_a, system_b) if outcome > 0 \
+          else (system_b, system_a)
+        _decision = _decisions.setdefault((hit_id, judge_id), ([], []))
+        _decision[0].append(_index[_winner])
+        _decision[1].append(_index[_loser])
+    
+    assignments = {}
+    for _key in _order:
+        _winners, _losers = _decisions.get(_key, ([], []))
+        assignments.setdefault(_hits[_key[0]], []).append((
+          np.array(_winners, dtype=np.int64),
+          np.array(_losers, dtype=np.int64), _seconds[_key]))
+    
+    return (_systems, np.array(hits, dtype=np.int64),
+      np.array(system_sets, dtype=np.int64).reshape(-1, 5), assignments)
+
+
+def count_resolved_pairs(wins, resamples, seed):
+    """
+    Returns the resolved system pair matrix for the given win counts.
+    """
+    lower, upper = bootstrap_rank_ranges(wins, resamples, seed=seed)
+    resolved = ~compute_overlapping_pairs(lower, upper)
+    np.fill_diagonal(resolved, False)
+    return resolved
+
+
+def replay_allocation(policy, no_of_systems, hits, system_sets,
+  assignments, refresh, resamples, seed=None):
+    """
+    Replays recorded results in the order chosen by the given policy.
+    
+    Returns a list of (steps, hours, resolved) tuples, recorded after every
+    refresh steps, where resolved is the number of resolved system pairs.
+    
+    """
+    random = np.random.RandomState(seed)
+    wins = np.zeros((no_of_systems, no_of_systems), dtype=np.int64)
+    _remaining = dict((x, list(y)) for x, y in assignments.items())
+    _available = np.zeros(hits.max() + 1 if len(hits) else 0, dtype=bool)
+    _available[_remaining.keys()] = True
+    _scores = np.zeros(len(_available))
+    
+    curve = []
+    _steps = 0
+    _seconds = 0.0
+    while _available.any():
+        if _steps % refresh == 0:
+            _resolved = count_resolved_pairs(wins, resamples,
+              random.randint(2 ** 31))
+            curve.append((_steps, _seconds / 3600, _resolved.sum() // 2))
+            
+            if policy == 'uncertainty':
+                _unresolved = ~_resolved
+                np.fill_diagonal(_unresolved, False)
+                _scores = np.bincount(hits, weights=score_system_sets(
+                  system_sets, _unresolved), minlength=len(_available))
+        
+        # Ties, including all HITs for the random policy, are broken at
+        # random.
+        _keys = np.where(_available, _scores + random.uniform(
+          size=len(_available)), -1)
+        hit = np.argmax(_keys)
+        
+        _winners, _losers, _duration = _remaining[hit].pop(0)
+        np.add.at(wins, (_winners, _losers), 1)
+        _seconds += _duration
+        _steps += 1
+        if not _remaining[hit]:
+            _available[hit] = False
+    
+    _resolved = count_resolved_pairs(wins, resamples, random.randint(2 ** 31))
+    curve.append((_steps, _seconds / 3600, _resolved.sum() // 2))
+    return curve
+
+
+if __name__ == "__main__":
+    args = PARSER.parse_args()
+    
+    # Properly set DJANGO_SETTINGS_MODULE environment variable.
+    os.environ['DJANGO_SETTINGS_MODULE'] = 'settings'
+    PROJECT_HOME = os.path.normpath(os.getcwd() + "/..")
+    sys.path.append(PROJECT_HOME)
+    
+    # We have just added appraise to the system path list, hence this works.
+    from appraise.wmt13.allocation import ALLOCATION_POLICIES
+    from appraise.wmt13.analytics import bootstrap_rank_ranges, \
+      compute_overlapping_pairs, score_system_sets
+    
+    SYSTEMS, HITS, SYSTEM_SETS, ASSIGNMENTS = load_replay_data(
+      args.language_pair)
+    if not ASSIGNMENTS:
+        PARSER.error('no results for language pair {0}'.format(
+          args.language_pair))
+    
+    print('{0} systems, {1} HITs with {2} results.'.format(len(SYSTEMS),
+      len(ASSIGNMENTS), sum([len(x) for x in ASSIGNMENTS.values()])))
+    print()
+    print('Policy          HITs   Hours  (to {0:.0%} of resolved pairs, ' \
+      'mean of {1} runs)'.format(args.target, args.runs))
+    
+    for policy in ALLOCATION_POLICIES:
+        _needed = []
+        for run in range(args.runs):
+            _seed = None if args.seed is None else args.seed + run
+            curve = replay_allocation(policy, len(SYSTEMS), HITS,
+              SYSTEM_SETS, ASSIGNMENTS, args.refresh, args.resamples, _seed)
+            
+            # The target refers to the pairs resolved after all results.
+            _target = args.target * curve[-1][2]
+            _needed.append([(steps, hours) for steps, hours, resolved
+              in curve if resolved >= _target][0])
+        
+        _steps, _hours = np.mean(_needed, axis=0)
+        print('{0:<12} {1:>7.0f} {2:>7.1f}'.format(policy, _steps, _hours))
+    
+    print()
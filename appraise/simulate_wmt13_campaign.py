@@ -0,0 +1,286 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Project: Appraise evaluation system
+ Author: Christian Federmann <cfedermann@gmail.com>
+
+usage: python simulate_wmt13_campaign.py [-h] [--database DATABASE]
+                                         [--language-pairs LANGUAGE_PAIRS]
+                                         [--hits HITS]
+                                         [--annotators ANNOTATORS]
+                                         [--systems SYSTEMS]
+                                         [--max-hits MAX_HITS]
+                                         [--median-seconds SECONDS]
+                                         [--sigma SIGMA]
+                                         [--time-scale SCALE]
+                                         [--policy POLICY] [--seed SEED]
+
+Simulates a WMT13 annotation campaign to plan capacity.
+
+A synthetic campaign is created in a fresh SQLite database.  Simulated
+annotators then work concurrently, one thread each:  they fetch HITs using
+_compute_next_task_for_user(), spend a log-normally distributed time on
+each item and store random rankings using _save_results().  Reports HIT
+completion throughput, latency percentiles, query counts and lock waits.
+
+optional arguments:
+  -h, --help            Show this help message and exit.
+  --database DATABASE   SQLite database file, re-created for each run.
+  --language-pairs LANGUAGE_PAIRS
+                        Comma-separated language pair codes.
+  --hits HITS           Number of HITs per language pair.
+  --annotators ANNOTATORS
+                        Number of annotators per language pair.
+  --systems SYSTEMS     Number of systems per language pair.
+  --max-hits MAX_HITS   Number of HITs after which an annotator stops.
+                        Annotators work until no HIT is left by default.
+  --median-seconds SECONDS
+                        Median time an annotator spends on one item.
+  --sigma SIGMA         Log-normal shape of the per-item time distribution.
+  --time-scale SCALE    Factor applied to simulated item times before
+                        sleeping;  0 means annotators do not wait at all.
+  --policy POLICY       HIT allocation policy, 'random' or 'uncertainty'.
+  --seed SEED           Seed for the random number generators.
+
+"""
+from datetime import timedelta
+from random import Random, uniform
+from threading import Lock, Thread
+from time import sleep, time
+import argparse
+import logging
+import os
+import sys
+
+import numpy as np
+
+PARSER = argparse.ArgumentParser(description="Simulates a WMT13 " \
+  "annotation campaign to plan capacity.")
+PARSER.add_argument("--database", action="store",
+  default="/tmp/appraise-simulation.db", dest="database", help="SQLite " \
+  "database file, re-created for each run.")
+PARSER.add_argument("--language-pairs", action="store", default="deu2eng",
+  dest="language_pairs", help="Comma-separated language pair codes.")
+PARSER.add_argument("--hits", action="store", default=200, dest="hits",
+  help="Number of HITs per language pair.", type=int)
+PARSER.add_argument("--annotators", action="store", default=10,
+  dest="annotators", help="Number of annotators per language pair.",
+  type=int)
+PARSER.add_argument("--systems", action="store", default=12,
+  dest="systems", help="Number of systems per language pair.", type=int)
+PARSER.add_argument("--max-hits", action="store", default=None,
+  dest="max_hits", help="Number of HITs after which an annotator stops.  " \
+  "Annotators work until no HIT is left by default.", type=int)
+PARSER.add_argument("--median-seconds", action="store", default=60.0,
+  dest="median_seconds", metavar="SECONDS", help="Median time an " \
+  "annotator spends on one item.", type=float)
+PARSER.add_argument("--sigma", action="store", default=0.5, dest="sigma",
+  help="Log-normal shape of the per-item time distribution.", type=float)
+PARSER.add_argument("--time-scale", action="store", default=0.0,
+  dest="time_scale", metavar="SCALE", help="Factor applied to simulated " \
+  "item times before sleeping;  0 means annotators do not wait at all.",
+  type=float)
+PARSER.add_argument("--policy", action="store", default="random",
+  dest="policy", help="HIT allocation policy, 'random' or 'uncertainty'.")
+PARSER.add_argument("--seed", action="store", default=None, dest="seed",
+  help="Seed for the random number generators.", type=int)
+
+# Seconds to wait before retrying an operation on a locked database;  the
+# wait is randomly increased with each retry to avoid livelocks.
+LOCK_RETRY_SECONDS = 0.005
+
+
+class CampaignStatistics(object):
+    """
+    Collects measurements from all annotator threads.
+    """
+    def __init__(self):
+        """
+        Creates empty measurement lists.
+        """
+        self.lock = Lock()
+        self.hits = 0
+        self.items = 0
+        self.latencies = {'assign': [], 'item': [], 'save': []}
+        self.queries = {'assign': [], 'item': [], 'save': []}
+        self.lock_errors = 0
+        self.lock_wait = 0.0
+    
+    def add(self, operation, latency, queries, lock_errors, lock_wait):
+        """
+        Adds the measurements for one operation.
+        """
+        with self.lock:
+            self.latencies[operation].append(latency)
+            self.queries[operation].append(queries)
+            self.lock_errors += lock_errors
+            self.lock_wait += lock_wait
+
+
+def measure(statistics, operation, function, *args):
+    """
+    Calls function, retrying while the database is locked.
+    
+    Latency, query count and lock waits are added to statistics.  With
+    the SQLite busy timeout disabled, every lock conflict raises an
+    OperationalError, hence lock waits are measured here.
+    
+    """
+    from django.db import connection, transaction
+    
+    _errors = 0
+    _wait = 0.0
+    _start = time()
+    while True:
+        connection.queries = []
+        try:
+            result = function(*args)
+            break
+        
+        # Commits raise the driver's OperationalError, not DatabaseError.
+        # pylint: disable-msg=W0703
+        except Exception, msg:
+            if not 'database is locked' in str(msg):
+                raise
+            
+            transaction.rollback_unless_managed()
+            _errors += 1
+            _retry = time()
+            sleep(LOCK_RETRY_SECONDS * uniform(1, 2 ** min(_errors, 8)))
+            _wait += time() - _retry
+    
+    statistics.add(operation, time() - _start, len(connection.queries),
+      _errors, _wait)
+    return result
+
+
+def annotate(user, language_pair, args, statistics, seed):
+    """
+    Simulates one annotator working on the given language pair.
+    """
+    from django.db import connection
+    from appraise.wmt13.models import RankingTask
+    from appraise.wmt13.views import _compute_next_task_for_user, \
+      _find_next_item_to_process, _save_results
+    
+    connection.use_debug_cursor = True
+    random = Random(seed)
+    _hits = 0
+    try:
+        while args.max_hits is None or _hits < args.max_hits:
+            hit = measure(statistics, 'assign', _compute_next_task_for_user,
+              user, language_pair)
+            if hit is None:
+                break
+            
+            items = RankingTask.objects.filter(hit=hit)
+            while True:
+                item = measure(statistics, 'item',
+                  _find_next_item_to_process, items, user)
+                if item is None:
+                    break
+                
+                _seconds = args.median_seconds * random.lognormvariate(0,
+                  args.sigma)
+                if args.time_scale:
+                    sleep(_seconds * args.time_scale)
+                
+                _ranks = ','.join([str(random.randint(1, 5))
+                  for _ in range(5)])
+                measure(statistics, 'save', _save_results, item, user,
+                  timedelta(seconds=int(_seconds)), _ranks)
+                with statistics.lock:
+                    statistics.items += 1
+            
+            _hits += 1
+            with statistics.lock:
+                statistics.hits += 1
+    
+    finally:
+        connection.close()
+
+
+def describe(values, unit, scale=1):
+    """
+    Returns a String with mean and percentiles of the given values.
+    """
+    if not values:
+        return 'n/a'
+    
+    _values = np.asarray(values) * scale
+    return 'mean {0:8.2f}{4}  p50 {1:8.2f}{4}  p90 {2:8.2f}{4}  ' \
+      'p99 {3:8.2f}{4}'.format(_values.mean(), *(list(np.percentile(
+      _values, [50, 90, 99])) + [unit]))
+
+
+if __name__ == "__main__":
+    args = PARSER.parse_args()
+    
+    # Properly set DJANGO_SETTINGS_MODULE environment variable.
+    os.environ['DJANGO_SETTINGS_MODULE'] = 'settings'
+    PROJECT_HOME = os.path.normpath(os.getcwd() + "/..")
+    sys.path.append(PROJECT_HOME)
+    
+    # Use a fresh database without busy timeout, before connecting.
+    from django.conf import settings
+    settings.DATABASES['default'] = {'ENGINE':
+      'django.db.backends.sqlite3', 'NAME': os.path.abspath(args.database),
+      'OPTIONS': {'timeout': 0}}
+    if os.path.exists(args.database):
+        os.remove(args.database)
+    
+    # Logging of individual requests and queries would dominate timings.
+    logging.disable(logging.INFO)
+    
+    from django.core.management import call_command
+    from django.db import connection
+    from appraise.wmt13 import views
+    from appraise.wmt13.synthetic import create_campaign
+    
+    if not args.policy in ('random', 'uncertainty'):
+        PARSER.error('unknown policy {0}'.format(args.policy))
+    views.WMT13_HIT_ALLOCATION_POLICY = args.policy
+    
+    call_command('syncdb', interactive=False, verbosity=0)
+    _start = time()
+    USERS = create_campaign(args.language_pairs.split(','), args.hits,
+      args.annotators, args.systems, args.seed)
+    connection.close()
+    print 'Created campaign in {0:.2f}s.'.format(time() - _start)
+    
+    statistics = CampaignStatistics()
+    threads = []
+    for language_pair, users in USERS.items():
+        for user in users:
+            _seed = None if args.seed is None else args.seed + len(threads)
+            threads.append(Thread(target=annotate, args=(user,
+              language_pair, args, statistics, _seed)))
+    
+    _start = time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    _elapsed = max(time() - _start, 1e-6)
+    
+    print
+    print '{0} annotators completed {1} HIT assignments ({2} items) in ' \
+      '{3:.2f}s.'.format(len(threads), statistics.hits, statistics.items,
+      _elapsed)
+    print 'Throughput:     {0:.1f} assignments/min, {1:.1f} items/s'.format(
+      60 * statistics.hits / _elapsed, statistics.items / _elapsed)
+    print 'Assignment:     {0}'.format(describe(
+      statistics.latencies['assign'], 'ms', 1000))
+    print 'Next item:      {0}'.format(describe(
+      statistics.latencies['item'], 'ms', 1000))
+    print 'Save:           {0}'.format(describe(
+      statistics.latencies['save'], 'ms', 1000))
+    print 'Assign queries: {0}'.format(describe(
+      statistics.queries['assign'], ''))
+    print 'Item queries:   {0}'.format(describe(
+      statistics.queries['item'], ''))
+    print 'Save queries:   {0}'.format(describe(
+      statistics.queries['save'], ''))
+    print 'Lock waits:     {0} retries, {1:.2f}s total'.format(
+      statistics.lock_errors, statistics.lock_wait)
+    print
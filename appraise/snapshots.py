@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+"""
+Project: Appraise evaluation system
+ Author: Christian Federmann <cfedermann@gmail.com>
+
+Shared snapshots of cached data for Appraise.
+
+Each process keeps status, ranking and task data in module-level caches.
+These are written through to snapshot files in SNAPSHOT_ROOT, so that a
+process with an empty cache can load a snapshot instead of computing the
+data again.  warm_up() computes all snapshots once, e.g. using the
+warm_caches management command before the server is started.  Lock files
+make sure that only one process at a time computes a given snapshot.
+
+"""
+import cPickle
+import logging
+import os
+
+from hashlib import sha1
+from threading import current_thread
+from time import time
+
+from appraise.settings import LOG_LEVEL, LOG_HANDLER, SNAPSHOT_MAX_AGE, \
+  SNAPSHOT_LOCK_TIMEOUT, SNAPSHOT_ROOT
+from appraise.utils import create_directory
+
+# Setup logging support.
+logging.basicConfig(level=LOG_LEVEL)
+LOGGER = logging.getLogger('appraise.snapshots')
+LOGGER.addHandler(LOG_HANDLER)
+
+
+create_directory(SNAPSHOT_ROOT)
+
+
+def _get_path(key, extension='pickle'):
+    """
+    Returns the snapshot file path for the given key.
+    """
+    return os.path.join(SNAPSHOT_ROOT, '{0}.{1}'.format(
+      sha1(key.encode('utf-8')).hexdigest(), extension))
+
+
+def get_snapshot(key, max_age=SNAPSHOT_MAX_AGE):
+    """
+    Returns a (created, value) tuple for the given key or None.
+    
+    Snapshots older than max_age seconds are ignored unless max_age is
+    None;  created is given in seconds since the epoch.
+    
+    """
+    try:
+        with open(_get_path(key), 'rb') as snapshot_file:
+            created, value = cPickle.load(snapshot_file)
+    
+    # Snapshots may not exist or be removed by other processes.
+    except (IOError, EOFError, cPickle.UnpicklingError):
+        return None
+    
+    if max_age is not None and time() - created > max_age:
+        return None
+    
+    return created, value
+
+
+def set_snapshot(key, value):
+    """
+    Stores the given value as snapshot for the given key.
+    
+    Returns the creation time of the snapshot in seconds since the epoch.
+    
+    """
+    _created = time()
+    _path = _get_path(key)
+    
+    # Other processes must never read partially written files.
+    _tmp = '{0}.{1}.{2}.tmp'.format(_path, os.getpid(),
+      current_thread().ident)
+    try:
+        with open(_tmp, 'wb') as snapshot_file:
+            cPickle.dump((_created, value), snapshot_file,
+              cPickle.HIGHEST_PROTOCOL)
+        os.rename(_tmp, _path)
+    
+    except (IOError, OSError), msg:
+        LOGGER.error('Could not write snapshot {0}: {1}'.format(key, msg))
+    
+    return _created
+
+
+def acquire_lock(key, timeout=SNAPSHOT_LOCK_TIMEOUT):
+    """
+    Tries to acquire the lock for the given key, returns True on success.
+    
+    Locks which are older than timeout seconds have been left behind by a
+    terminated process and are removed.  The lock must be released using
+    release_lock() once the snapshot has been written.
+    
+    """
+    _path = _get_path(key, extension='lock')
+    for _ in range(2):
+        try:
+            os.close(os.open(_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            return True
+        
+        except OSError:
+            pass
+        
+        try:
+            if time() - os.path.getmtime(_path) <= timeout:
+                return False
+            
+            LOGGER.warning('Removing abandoned lock for {0}.'.format(key))
+            os.remove(_path)
+        
+        # The lock may have been released in the meantime.
+        except OSError:
+            pass
+    
+    return False
+
+
+def release_lock(key):
+    """
+    Releases the lock for the given key.
+    """
+    try:
+        os.remove(_get_path(key, extension='lock'))
+    
+    except OSError, msg:
+        LOGGER.warning('Could not release lock for {0}: {1}'.format(key,
+          msg))
+
+
+def warm_up(status=True, rankings=True, tasks=True):
+    """
+    Fills the caches of the current process and all snapshots.
+    
+    WMT13 status data is computed using update_status(), ranking clusters
+    are loaded from the last ranking cluster dump and task data is computed
+    for the users and staff members who can see the respective task.
+    Returns a dictionary with the number of cache entries per cache.
+    
+    """
+    from django.contrib.auth.models import User
+    from appraise.evaluation.models import EvaluationTask
+    from appraise.evaluation.views import _update_task_cache
+    from appraise.wmt13.views import RANKINGS_CACHE, STATUS_CACHE, \
+      update_ranking, update_status
+    
+    counts = {'status': 0, 'rankings': 0, 'tasks': 0}
+    if status:
+        update_status()
+        counts['status'] = len(STATUS_CACHE)
+    
+    if rankings:
+        try:
+            update_ranking(load_file=True)
+            counts['rankings'] = len(RANKINGS_CACHE)
+        
+        # The Perl script may not have been run yet.
+        except (IOError, KeyError), msg:
+            LOGGER.warning('Could not load ranking clusters: {0}'.format(
+              msg))
+    
+    if tasks:
+        _staff = list(User.objects.filter(is_staff=True))
+        for task in EvaluationTask.objects.all():
+            _users = set(task.users.all()) if task.active else set()
+            _users.update([x for x in _staff
+              if task.active or x.is_superuser])
+            
+            for user in _users:
+                _update_task_cache(task, user)
+                counts['tasks'] += 1
+    
+    return counts
@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Project: Appraise evaluation system
+ Author: Christian Federmann <cfedermann@gmail.com>
+
+usage: update_wmt13_agreement_scores.py [-h] [--interval SECONDS]
+
+Computes the cached agreement scores for HITs whose scores are stale.
+Saving or deleting results only marks the scores of their HIT as stale,
+hence run this periodically, e.g. from cron, or keep it running using
+--interval.  After upgrading, this computes the scores of all HITs which
+have been annotated before agreement scores were cached.
+
+optional arguments:
+  -h, --help          Show this help message and exit.
+  --interval SECONDS  Repeat the update every SECONDS seconds.
+
+"""
+from time import sleep
+import argparse
+import os
+import sys
+
+PARSER = argparse.ArgumentParser(description="Computes the cached " \
+  "agreement scores for HITs whose scores are stale.")
+PARSER.add_argument("--interval", action="store", default=None,
+  dest="interval", metavar="SECONDS", help="Repeat the update every " \
+  "SECONDS seconds.", type=int)
+
+
+if __name__ == "__main__":
+    args = PARSER.parse_args()
+    
+    # Properly set DJANGO_SETTINGS_MODULE environment variable.
+    os.environ['DJANGO_SETTINGS_MODULE'] = 'settings'
+    PROJECT_HOME = os.path.normpath(os.getcwd() + "/..")
+    sys.path.append(PROJECT_HOME)
+    
+    # We have just added appraise to the system path list, hence this works.
+    from appraise.wmt13.models import HIT
+    
+    while True:
+        _updated, _empty = HIT.update_stale_agreement_scores()
+        print 'Updated agreement scores for {0} HITs, {1} HITs without ' \
+          'results.'.format(_updated, _empty)
+        
+        if not args.interval:
+            break
+        
+        sleep(args.interval)
@@ -0,0 +1,42 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Project: Appraise evaluation system
+ Author: Christian Federmann <cfedermann@gmail.com>
+
+usage: update_wmt13_content_hashes.py
+
+Computes content hashes for HITs and RankingTasks which have been imported
+before content hashes were introduced.  These are required to detect
+duplicates using import_wmt13_xml.py --report-duplicates.
+
+"""
+import os
+import sys
+
+
+if __name__ == "__main__":
+    # Properly set DJANGO_SETTINGS_MODULE environment variable.
+    os.environ['DJANGO_SETTINGS_MODULE'] = 'settings'
+    PROJECT_HOME = os.path.normpath(os.getcwd() + "/..")
+    sys.path.append(PROJECT_HOME)
+    
+    # We have just added appraise to the system path list, hence this works.
+    from appraise.wmt13.models import HIT, RankingTask
+    
+    # Use update() to avoid re-validation of the XML.
+    _hits = 0
+    for hit in HIT.objects.filter(content_hash=''):
+        hit.update_content_hash()
+        HIT.objects.filter(id=hit.id).update(content_hash=hit.content_hash)
+        _hits = _hits + 1
+    
+    _tasks = 0
+    for task in RankingTask.objects.filter(content_hash=''):
+        task.update_content_hash()
+        RankingTask.objects.filter(id=task.id).update(
+          content_hash=task.content_hash)
+        _tasks = _tasks + 1
+    
+    print 'Updated content hashes for {0} HITs and {1} RankingTasks.'.format(
+      _hits, _tasks)
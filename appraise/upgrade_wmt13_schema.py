@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Project: Appraise evaluation system
+ Author: Christian Federmann <cfedermann@gmail.com>
+
+usage: upgrade_wmt13_schema.py [-h] [--sql]
+
+Adds missing columns and their indexes to existing Appraise tables.
+
+syncdb creates tables for new models, e.g. System or PairwiseJudgment, but
+never alters existing tables.  Deployments created before the following
+columns were introduced have to be upgraded before the server is started:
+
+  wmt13_hit            content_hash, agreement_alpha, agreement_kappa,
+                       agreement_pi, agreement_S, agreement_stale
+  wmt13_rankingtask    content_hash, system_ids
+  wmt13_rankingresult  modified
+
+For SQLite, the script executes statements like these:
+
+  ALTER TABLE "wmt13_hit" ADD COLUMN "agreement_alpha" real;
+  ALTER TABLE "wmt13_hit" ADD COLUMN "agreement_stale" bool NOT NULL
+    DEFAULT '1';
+  CREATE INDEX "wmt13_hit_..." ON "wmt13_hit" ("agreement_stale");
+
+Run syncdb first, then this script, then update_wmt13_content_hashes.py,
+update_wmt13_agreement_scores.py, register_wmt13_systems.py and
+materialize_pairwise_judgments.py to fill the new columns and tables.
+
+optional arguments:
+  -h, --help  Show this help message and exit.
+  --sql       Print the SQL statements instead of executing them.
+
+"""
+import argparse
+import os
+import sys
+
+PARSER = argparse.ArgumentParser(description="Adds missing columns and " \
+  "their indexes to existing Appraise tables.")
+PARSER.add_argument("--sql", action="store_true", default=False,
+  dest="sql_only", help="Print the SQL statements instead of executing " \
+  "them.")
+
+# Applications whose tables are upgraded.
+UPGRADE_APPS = ('wmt13', 'evaluation')
+
+
+def _format_default(value):
+    """
+    Returns the given default value as quoted SQL literal.
+    
+    Quoted '1' and '0' are valid booleans for SQLite, PostgreSQL and MySQL.
+    
+    """
+    if isinstance(value, bool):
+        value = int(value)
+    
+    return u"'{0}'".format(unicode(value).replace("'", "''"))
+
+
+def compute_upgrade_sql(connection):
+    """
+    Returns the SQL statements adding missing columns and their indexes.
+    
+    Only tables which already exist are considered;  syncdb creates missing
+    tables including all of their columns.
+    
+    """
+    from django.core.management.color import no_style
+    from django.db.models import get_app, get_models
+    
+    _quote = connection.ops.quote_name
+    _cursor = connection.cursor()
+    _tables = connection.introspection.table_names()
+    
+    statements = []
+    for app_label in UPGRADE_APPS:
+        for model in get_models(get_app(app_label)):
+            _table = model._meta.db_table
+            if _table not in _tables:
+                continue
+            
+            _columns = set([x[0] for x in
+              connection.introspection.get_table_description(_cursor,
+              _table)])
+            
+            for field in model._meta.local_fields:
+                if field.column in _columns:
+                    continue
+                
+                _sql = u'ALTER TABLE {0} ADD COLUMN {1} {2}'.format(
+                  _quote(_table), _quote(field.column),
+                  field.db_type(connection=connection))
+                
+                # Existing rows need a value for NOT NULL columns.
+                if not field.null:
+                    _sql += u' NOT NULL DEFAULT {0}'.format(
+                      _format_default(field.get_default()))
+                
+                statements.append(_sql + u';')
+                statements.extend(connection.creation.sql_indexes_for_field(
+                  model, field, no_style()))
+    
+    return statements
+
+
+if __name__ == "__main__":
+    args = PARSER.parse_args()
+    
+    # Properly set DJANGO_SETTINGS_MODULE environment variable.
+    os.environ['DJANGO_SETTINGS_MODULE'] = 'settings'
+    PROJECT_HOME = os.path.normpath(os.getcwd() + "/..")
+    sys.path.append(PROJECT_HOME)
+    
+    # We have just added appraise to the system path list, hence this works.
+    from django.db import connection, transaction
+    
+    STATEMENTS = compute_upgrade_sql(connection)
+    if args.sql_only:
+        for statement in STATEMENTS:
+            print statement
+        sys.exit(0)
+    
+    with transaction.commit_on_success():
+        _cursor = connection.cursor()
+        for statement in STATEMENTS:
+            print statement
+            _cursor.execute(statement)
+    
+    print 'Executed {0} statements.'.format(len(STATEMENTS))
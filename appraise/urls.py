@@ -23,6 +23,13 @@ urlpatterns = patterns('',
     {'next_page': '/appraise/'}),
 
   (r'^appraise/admin/', include(admin.site.urls)),
+  
+  (r'^appraise/metrics/$', 'appraise.views.metrics'),
+
+  (r'^appraise/profiling/$', 'appraise.views.profiling'),
+
+  (r'^appraise/profiling/(?P<profile_id>[0-9a-f-]+)\.(?P<extension>' \
+    'prof|json)$', 'appraise.views.download_profile'),
 
   (r'^appraise/evaluation/$', 'appraise.evaluation.views.overview'),
 
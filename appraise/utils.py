@@ -3,12 +3,34 @@
 Project: Appraise evaluation system
  Author: Christian Federmann <cfedermann@gmail.com>
 """
+import errno
 import logging
+import os
+import uuid
 from datetime import timedelta
-from nltk.metrics.agreement import AnnotationTask
 
 log = logging.getLogger(__file__)
 
+# Observed id collision rate above which UniqueIdAllocator logs a warning.
+ID_COLLISION_WARNING_RATE = 0.001
+
+def create_directory(path):
+    """
+    Creates the directory at path including parents, unless it exists.
+    
+    Several processes may try to create the same directory at once, e.g.
+    when FastCGI workers are started;  hence, the directory is created
+    without checking first and an existing directory is no error.
+    
+    """
+    try:
+        os.makedirs(path)
+    
+    except OSError, msg:
+        if msg.errno != errno.EEXIST:
+            raise
+
+
 def datetime_to_seconds(value):
     """
     Converts the given datetime value to seconds.
@@ -28,34 +50,84 @@ def seconds_to_timedelta(value):
     _secs = value % 60
     return timedelta(days=_days, hours=_hours, minutes=_mins, seconds=_secs)
 
-# pylint: disable-msg=E0102
-class AnnotationTask(AnnotationTask):
+class UniqueIdAllocator(object):
     """
-    Makes sure that agr() works correctly for unordered input.
+    Allocates random hex ids which are unique for an indexed model field.
     
-    This would have returned a wrong value (0.0) in @785fb79 as coders are in
-    the wrong order. Subsequently, all values for pi(), S(), and kappa() would
-    have been wrong as they are computed with avg_Ao().
-    >>> t1 = AnnotationTask(data=[('b','1','stat'),('a','1','stat')])
-    >>> t1.avg_Ao()
-    1.0
+    Instead of one query per id, candidates for a whole batch are checked
+    with one IN query;  only colliding candidates are re-generated.  Ids for
+    single objects are taken from a reserve which is refilled in batches.
+    As the id space fills up, collisions become more likely;  the observed
+    collision rate is tracked and reported once it gets noticeable.
     
     """
-    # pylint: disable-msg=C0103,W0221
-    def agr(self, cA, cB, i, data=None):
-        """Agreement between two coders on a given item
+    def __init__(self, model, field, length, batch_size=100):
+        """
+        Creates an allocator for ids of the given length for model.field.
+        """
+        self.model = model
+        self.field = field
+        self.length = length
+        self.batch_size = batch_size
+        self.candidates = 0
+        self.collisions = 0
+        self._reserve = []
+    
+    def allocate(self, count):
+        """
+        Returns a list of count ids which are not used in the database.
+        """
+        new_ids = set()
+        _candidates = 0
+        _collisions = 0
+        while len(new_ids) < count:
+            _needed = count - len(new_ids)
+            _batch = set([uuid.uuid4().hex[:self.length]
+              for _ in range(_needed)]).difference(new_ids)
+            
+            _lookup = {'{0}__in'.format(self.field): _batch}
+            _taken = self.model.objects.filter(**_lookup).values_list(
+              self.field, flat=True)
+            _batch.difference_update(_taken)
+            
+            _candidates += _needed
+            _collisions += _needed - len(_batch)
+            new_ids.update(_batch)
         
+        self.candidates += _candidates
+        self.collisions += _collisions
+        if _collisions and \
+          _collisions > ID_COLLISION_WARNING_RATE * _candidates:
+            self.report()
+        
+        return list(new_ids)
+    
+    def next_id(self):
+        """
+        Returns a single unused id, refilling the reserve if necessary.
+        
+        Reserved ids are not locked in the database;  they are as likely to
+        be taken concurrently as an id checked right before saving.
+        
+        """
+        if not self._reserve:
+            self._reserve = self.allocate(self.batch_size)
+        
+        return self._reserve.pop()
+    
+    def collision_rate(self):
+        """
+        Returns the fraction of candidates which collided with used ids.
+        """
+        return self.collisions / float(self.candidates or 1)
+    
+    def report(self):
+        """
+        Logs the observed and expected collision rates for this allocator.
         """
-        data = data or self.data
-        k1 = (x for x in data if x['coder'] in (cA, cB) and x['item']==i).next()
-        if k1['coder'] == cA:
-            k2 = (x for x in data if x['coder']==cB and x['item']==i).next()
-        else:
-            k2 = (x for x in data if x['coder']==cA and x['item']==i).next()
-
-        ret = 1.0 - float(self.distance(k1['labels'], k2['labels']))
-        log.debug("Observed agreement between %s and %s on %s: %f",
-                      cA, cB, i, ret)
-        log.debug("Distance between \"%r\" and \"%r\": %f",
-                      k1['labels'], k2['labels'], 1.0 - ret)
-        return ret
+        _used = self.model.objects.count()
+        _expected = _used / float(16 ** self.length)
+        log.warning('{0}.{1}: {2} of {3} id candidates collided ({4:.4%}),' \
+          ' {5} of {6} ids used, expected collision rate {7:.4%}.'.format(
+          self.model.__name__, self.field, self.collisions, self.candidates,
+          self.collision_rate(), _used, 16 ** self.length, _expected))
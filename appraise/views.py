@@ -4,9 +4,16 @@ Project: Appraise evaluation system
  Author: Christian Federmann <cfedermann@gmail.com>
 """
 import logging
+import os
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.views import login as LOGIN, logout as LOGOUT
+from django.http import Http404, HttpResponse, HttpResponseForbidden
 from django.shortcuts import render
-from appraise.settings import LOG_LEVEL, LOG_HANDLER, COMMIT_TAG
+from appraise.metrics import render_metrics
+from appraise.profiling import compute_endpoint_stats, get_profile_path, \
+  iter_request_records, list_profiles
+from appraise.settings import LOG_LEVEL, LOG_HANDLER, COMMIT_TAG, \
+  METRICS_ALLOWED_ADDRESSES
 
 # Setup logging support.
 logging.basicConfig(level=LOG_LEVEL)
@@ -56,4 +63,60 @@ def logout(request, next_page):
     LOGGER.info('Logging out user "{0}", redirecting to "{1}".'.format(
       request.user.username or "Anonymous", next_page)) 
     
-    return LOGOUT(request, next_page)
\ No newline at end of file
+    return LOGOUT(request, next_page)
+
+
+@staff_member_required
+def profiling(request):
+    """
+    Renders the slowest endpoints and stored profiles for staff users.
+    """
+    LOGGER.info('Rendering profiling view for user "{0}".'.format(
+      request.user.username))
+    
+    dictionary = {
+      'commit_tag': COMMIT_TAG,
+      'endpoints': compute_endpoint_stats(iter_request_records())[:50],
+      'profiles': list_profiles(),
+      'title': 'Request Profiling',
+    }
+    
+    return render(request, 'profiling.html', dictionary)
+
+
+@staff_member_required
+def download_profile(request, profile_id, extension):
+    """
+    Returns the cProfile data or query list of the given profile.
+    """
+    _path = get_profile_path(profile_id, extension)
+    if _path is None:
+        raise Http404
+    
+    with open(_path, 'rb') as profile_file:
+        _data = profile_file.read()
+    
+    _mimetype = 'application/octet-stream' if extension == 'prof' \
+      else 'application/json; charset=UTF-8'
+    response = HttpResponse(_data, mimetype=_mimetype)
+    response['Content-Disposition'] = 'attachment; filename="{0}"'.format(
+      os.path.basename(_path))
+    return response
+
+
+def metrics(request):
+    """
+    Returns the metrics of all processes in Prometheus text format.
+    
+    Collectors cannot log in, hence access is restricted to the client
+    addresses given in METRICS_ALLOWED_ADDRESSES.
+    
+    """
+    _address = request.META.get('REMOTE_ADDR')
+    if not _address in METRICS_ALLOWED_ADDRESSES:
+        LOGGER.warning('Denied metrics access for address {0}.'.format(
+          _address))
+        return HttpResponseForbidden('Metrics are only available locally.')
+    
+    return HttpResponse(render_metrics(),
+      mimetype='text/plain; version=0.0.4; charset=utf-8')
@@ -10,8 +10,8 @@ from django.http import HttpResponse
 from django.template import Context
 from django.template.loader import get_template
 
-from appraise.wmt13.models import HIT, RankingTask, RankingResult, \
-  UserHITMapping
+from appraise.wmt13.models import HIT, LanguagePairStatus, RankingTask, \
+  RankingResult, PairwiseJudgment, System, UserHITMapping
 
 from appraise.settings import LOG_LEVEL, LOG_HANDLER
 
@@ -74,10 +74,12 @@ def export_hit_results_to_apf(modeladmin, request, queryset):
     """
     Exports HIT results to Artstein and Poesio (2007) format.
     """
+    # System names are loaded once instead of once per result.
+    _names = System.get_system_names()
     results = []
     for hit in queryset:
         if isinstance(hit, HIT):
-            results.append(hit.export_to_apf())
+            results.append(hit.export_to_apf(_names))
     
     export_apf = u"\n".join(results)
     return HttpResponse(export_apf, mimetype='text/plain')
@@ -89,23 +91,26 @@ export_hit_results_to_apf.short_description = "Export HIT results to " \
 def export_hit_results_agreements(modeladmin, request, queryset):
     """
     Exports HIT results' agreement among researchers.
+    
+    Agreement scores are cached with the HIT instances, hence no scores are
+    computed here;  stale scores are re-computed by
+    update_wmt13_agreement_scores.py.
+    
     """
-    results = []
-    scores = [0, 0, 0, 0]
-    for hit in queryset:
-        if isinstance(hit, HIT):
-            _scores = hit.compute_agreement_scores()
-            if not _scores:
-                continue
-            
-            for i in range(4):
-                scores[i] += _scores[i]
-            
-            results.append(','.join([str(x) for x in _scores]))
+    _stale = queryset.filter(agreement_stale=True).count()
+    if _stale:
+        modeladmin.message_user(request, 'Exported outdated agreement ' \
+          'scores for {0} HITs, run update_wmt13_agreement_scores.py to ' \
+          're-compute them.'.format(_stale))
     
-    for i in range(4):
-        scores[i] = scores[i] / (len(results) or 1)
+    _scores = queryset.filter(agreement_kappa__isnull=False).values_list(
+      'agreement_alpha', 'agreement_kappa', 'agreement_pi', 'agreement_S')
     
+    results = []
+    for _score in _scores:
+        results.append(','.join([str(x) for x in _score]))
+    
+    scores = HIT.compute_average_agreement_scores(queryset)
     results.append(','.join([str(x) for x in scores]))
     
     export_apf = u"\n".join(results)
@@ -161,9 +166,11 @@ def export_results_to_csv(modeladmin, request, queryset):
       'system3Id,system4Number,system4Id,system5Number,system5Id,' \
       'system1rank,system2rank,system3rank,system4rank,system5rank']
     
+    # System names are loaded once instead of once per result.
+    _names = System.get_system_names()
     for result in queryset:
         if isinstance(result, RankingResult):
-            results.append(result.export_to_csv())
+            results.append(result.export_to_csv(_names))
     
     export_csv = u"\n".join(results)
     return HttpResponse(export_csv, mimetype='text/plain')
@@ -181,6 +188,64 @@ class RankingResultAdmin(admin.ModelAdmin):
     actions = (export_results_to_csv,)
 
 
+class SystemAdmin(admin.ModelAdmin):
+    """
+    ModelAdmin class for System instances.
+    """
+    list_display = ('name', 'language_pair', 'id')
+    list_filter = ('language_pair',)
+    search_fields = ('name',)
+
+
+class PairwiseJudgmentAdmin(admin.ModelAdmin):
+    """
+    ModelAdmin class for PairwiseJudgment instances.
+    """
+    list_display = ('result', 'language_pair', 'segment', 'judge',
+      'system_a', 'system_b', 'outcome')
+    list_filter = ('language_pair', 'outcome')
+    search_fields = ('system_a__name', 'system_b__name', 'judge__username')
+
+
+def mark_saturated(modeladmin, request, queryset):
+    """
+    Manually marks the language pairs in the given queryset as saturated.
+    """
+    queryset.update(override=True)
+
+mark_saturated.short_description = "Manually mark as saturated"
+
+
+def mark_open(modeladmin, request, queryset):
+    """
+    Manually marks the language pairs in the given queryset as open.
+    """
+    queryset.update(override=False)
+
+mark_open.short_description = "Manually mark as open"
+
+
+def clear_override(modeladmin, request, queryset):
+    """
+    Hands the language pairs in the given queryset back to the monitor.
+    """
+    queryset.update(override=None)
+
+clear_override.short_description = "Use convergence monitor"
+
+
+class LanguagePairStatusAdmin(admin.ModelAdmin):
+    """
+    ModelAdmin class for LanguagePairStatus instances.
+    """
+    list_display = ('language_pair', 'is_saturated', 'saturated', 'override',
+      'stable_checks', 'judgments', 'checked')
+    list_filter = ('saturated', 'override')
+    readonly_fields = ('saturated', 'clusters', 'stable_checks', 'judgments',
+      'checked')
+    actions = (mark_saturated, mark_open, clear_override)
+
+
 class UserHITMappingAdmin(admin.ModelAdmin):
     """
     ModelAdmin class for RankingResult instances.
@@ -191,6 +256,9 @@ class UserHITMappingAdmin(admin.ModelAdmin):
 
 
 admin.site.register(HIT, HITAdmin)
+admin.site.register(LanguagePairStatus, LanguagePairStatusAdmin)
 admin.site.register(RankingTask)
 admin.site.register(RankingResult, RankingResultAdmin)
+admin.site.register(PairwiseJudgment, PairwiseJudgmentAdmin)
+admin.site.register(System, SystemAdmin)
 admin.site.register(UserHITMapping, UserHITMappingAdmin)
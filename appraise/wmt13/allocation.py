@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+"""
+Project: Appraise evaluation system
+ Author: Christian Federmann <cfedermann@gmail.com>
+
+HIT allocation policies for WMT13.
+
+By default, _compute_next_task_for_user() tries compatible HITs in random
+order.  The 'uncertainty' policy instead tries HITs first which compare
+more system pairs whose bootstrap rank ranges still overlap, based on the
+current PairwiseJudgment win counts.  Rank ranges and HIT scores are cached
+per language pair and recomputed every ALLOCATION_REFRESH_SECONDS.
+
+"""
+import logging
+
+from time import time
+
+from appraise.wmt13.analytics import bootstrap_rank_ranges, \
+  compute_overlapping_pairs, compute_win_matrix, score_system_sets
+from appraise.wmt13.models import PairwiseJudgment, RankingTask, System
+from appraise.settings import LOG_LEVEL, LOG_HANDLER
+
+# Setup logging support.
+logging.basicConfig(level=LOG_LEVEL)
+LOGGER = logging.getLogger('appraise.wmt13.allocation')
+LOGGER.addHandler(LOG_HANDLER)
+
+
+ALLOCATION_POLICIES = ('random', 'uncertainty')
+
+# Seconds until cached HIT scores for a language pair are recomputed.
+ALLOCATION_REFRESH_SECONDS = 300
+
+# Number of bootstrap resamples used to compute rank ranges.
+ALLOCATION_RESAMPLES = 1000
+
+# Maps language pairs to (timestamp, {block_id: score}) tuples.
+ALLOCATION_CACHE = {}
+
+
+def compute_unresolved_pairs(language_pair, systems=None,
+  resamples=ALLOCATION_RESAMPLES, seed=None):
+    """
+    Returns (systems, unresolved) for the given language pair.
+    
+    systems is the list of system names, by default all registered systems
+    of the language pair;  unresolved is a boolean matrix marking pairs of
+    systems with overlapping bootstrap rank ranges.
+    
+    """
+    if systems is None:
+        systems = list(System.objects.filter(language_pair=language_pair)
+          .values_list('name', flat=True))
+    
+    wins = compute_win_matrix(PairwiseJudgment.compute_win_counts(
+      language_pair), systems)
+    lower, upper = bootstrap_rank_ranges(wins, resamples, seed=seed)
+    return (systems, compute_overlapping_pairs(lower, upper))
+
+
+def compute_hit_scores(language_pair):
+    """
+    Returns a dict mapping block-ids to their number of unresolved pairs.
+    
+    Scores are summed over all segments of the active HITs of the given
+    language pair;  task system ids are fetched with a single query.
+    
+    """
+    _systems = list(System.objects.filter(language_pair=language_pair)
+      .values_list('id', 'name'))
+    _unused, unresolved = compute_unresolved_pairs(language_pair,
+      [x[1] for x in _systems])
+    _index = dict((x[0], i) for i, x in enumerate(_systems))
+    
+    _tasks = RankingTask.objects.filter(hit__language_pair=language_pair,
+      hit__active=True).exclude(system_ids='').values_list('hit__block_id',
+      'system_ids')
+    
+    block_ids = []
+    system_sets = []
+    for block_id, system_ids in _tasks.iterator():
+        _set = [_index.get(int(x)) for x in system_ids.split(',')]
+        if None in _set or len(_set) != 5:
+            continue
+        
+        block_ids.append(block_id)
+        system_sets.append(_set)
+    
+    scores = {}
+    if system_sets:
+        for block_id, score in zip(block_ids, score_system_sets(
+          system_sets, unresolved)):
+            scores[block_id] = scores.get(block_id, 0) + int(score)
+    
+    return scores
+
+
+def get_hit_scores(language_pair):
+    """
+    Returns the cached HIT scores for the given language pair.
+    
+    Group instances are accepted as well;  the cache is keyed by codes.
+    
+    """
+    language_pair = unicode(language_pair)
+    _cached = ALLOCATION_CACHE.get(language_pair)
+    if _cached is None or time() - _cached[0] > ALLOCATION_REFRESH_SECONDS:
+        LOGGER.debug('Recomputing HIT scores for {0}.'.format(
+          language_pair))
+        _cached = (time(), compute_hit_scores(language_pair))
+        ALLOCATION_CACHE[language_pair] = _cached
+    
+    return _cached[1]
+
+
+def prioritize_block_ids(language_pair, block_ids):
+    """
+    Sorts the given block-ids by descending score for the language pair.
+    
+    The sort is stable, hence shuffled block-ids with equal scores remain in
+    random order.  HITs without a score are tried last.
+    
+    """
+    scores = get_hit_scores(language_pair)
+    return sorted(block_ids, key=lambda x: -scores.get(x, -1))
@@ -0,0 +1,811 @@
+# -*- coding: utf-8 -*-
+"""
+Project: Appraise evaluation system
+ Author: Christian Federmann <cfedermann@gmail.com>
+
+Shared data loading for the offline WMT13 analysis scripts.
+
+Ranking judgements can be loaded from WMT13 export CSV files or directly from
+the Django database.  Either way, each five-way ranking is expanded into its
+ten pairwise comparisons which are stored as integer-coded NumPy columns in a
+PairwiseJudgements dataset;  the corresponding strings are kept in a shared
+Codebook instance.
+
+This module does not import Django on module level, so that CSV based
+analysis works without a configured Django project.
+
+Datasets can be saved to a directory containing one .npy file per column and
+a codebook.npz file with the string dictionaries.  Columns are loaded as
+read-only memory maps, hence repeated analyses start instantly and several
+processes working on the same dataset share their pages.
+
+"""
+from csv import reader
+from hashlib import sha1
+from io import BytesIO
+from itertools import combinations
+from os import fstat, makedirs, rename
+from os.path import abspath, exists, join
+from shutil import rmtree
+from xml.etree.ElementTree import fromstring, iterparse
+
+import numpy as np
+
+# The ten pairwise comparisons implied by a five-way ranking.
+RANKING_PAIRS = np.array(list(combinations(range(5), 2)))
+
+WMT_CSV_HEADER = u'srclang,trglang,srcIndex,documentId,segmentId,judgeId,' \
+  'system1Number,system1Id,system2Number,system2Id,system3Number,' \
+  'system3Id,system4Number,system4Id,system5Number,system5Id,' \
+  'system1rank,system2rank,system3rank,system4rank,system5rank'
+
+# Maps language names and ISO-639-2 codes to ISO-639-3 codes.
+LANGUAGE_CODES = {'czech': 'ces', 'ces': 'ces', 'cze': 'ces', 'deu': 'deu',
+  'german': 'deu', 'ger': 'deu', 'spa': 'spa', 'spanish': 'spa',
+  'eng': 'eng', 'english': 'eng', 'french': 'fra', 'fra': 'fra',
+  'fre': 'fra', 'russian': 'rus', 'rus': 'rus'}
+
+LANGUAGE_NAMES = {'ces': 'Czech', 'deu': 'German', 'eng': 'English',
+  'spa': 'Spanish', 'fra': 'French', 'rus': 'Russian'}
+
+# Number of rows fetched from the database per query.
+DATABASE_CHUNK_SIZE = 10000
+
+# Integer types used for compact columns, from smallest to largest.
+COMPACT_DTYPES = (np.int8, np.int16, np.int32, np.int64)
+
+# Standard normal quantile for 95% confidence intervals.
+DEFAULT_Z_SCORE = 1.96
+
+
+def compact_dtype(minimum, maximum):
+    """
+    Returns the smallest integer type which can hold [minimum, maximum].
+    """
+    for dtype in COMPACT_DTYPES:
+        _info = np.iinfo(dtype)
+        if _info.min <= minimum and maximum <= _info.max:
+            return dtype
+    
+    return np.int64
+
+
+def language_pair_code(srclang, trglang):
+    """
+    Returns the xxx2yyy language pair code for the given languages.
+    """
+    _src = LANGUAGE_CODES.get(srclang.lower(), srclang.lower())
+    _trg = LANGUAGE_CODES.get(trglang.lower(), trglang.lower())
+    return u'{0}2{1}'.format(_src, _trg)
+
+
+def language_pair_name(code):
+    """
+    Returns the WMT name, e.g. "German-English", for a language pair code.
+    """
+    _src, _trg = code.split('2')
+    return u'{0}-{1}'.format(LANGUAGE_NAMES.get(_src, _src),
+      LANGUAGE_NAMES.get(_trg, _trg))
+
+
+class Codebook(object):
+    """
+    String dictionaries for the integer-coded columns of a dataset.
+    
+    Datasets which should be compared to each other need to share the same
+    Codebook instance, otherwise their integer codes are not compatible.
+    
+    """
+    KINDS = ('language_pairs', 'judges', 'systems')
+    
+    def __init__(self, language_pairs=(), judges=(), systems=()):
+        """
+        Initialises the string dictionaries from the given sequences.
+        """
+        self.language_pairs = []
+        self.judges = []
+        self.systems = []
+        self._codes = dict((kind, {}) for kind in self.KINDS)
+        
+        for kind, values in zip(self.KINDS,
+          (language_pairs, judges, systems)):
+            for value in values:
+                self.encode(kind, value)
+    
+    def encode(self, kind, value):
+        """
+        Returns the integer code for value, adding it to the dictionary.
+        """
+        _codes = self._codes[kind]
+        code = _codes.get(value)
+        if code is None:
+            code = len(_codes)
+            _codes[value] = code
+            getattr(self, kind).append(value)
+        
+        return code
+    
+    def lookup(self, kind, value):
+        """
+        Returns the integer code for value or None if it is unknown.
+        """
+        return self._codes[kind].get(value)
+
+    def save(self, path, **extra):
+        """
+        Saves the string dictionaries, and optional extra arrays, to path.
+        """
+        arrays = dict((kind, np.array(getattr(self, kind), dtype=np.unicode_))
+          for kind in self.KINDS)
+        arrays.update(extra)
+        with open(path, 'wb') as outfile:
+            np.savez(outfile, **arrays)
+    
+    @classmethod
+    def load(cls, path):
+        """
+        Loads a Codebook instance from the given .npz file.
+        """
+        with np.load(path) as _data:
+            _values = [[unicode(x) for x in _data[kind]]
+              for kind in cls.KINDS]
+        
+        return cls(*_values)
+
+
+class PairwiseJudgements(object):
+    """
+    Columnar dataset of pairwise ranking decisions.
+    
+    Each row describes one comparison of system_a and system_b from a five-way
+    ranking result.  The outcome is +1 if system_a has been ranked better than
+    system_b, -1 if it has been ranked worse and 0 for ties.  The result
+    column identifies the five-way ranking a row has been derived from.
+    
+    """
+    COLUMNS = ('result', 'language_pair', 'segment', 'judge', 'system_a',
+      'system_b', 'outcome')
+    
+    # Default types for empty columns;  compact() narrows them if possible.
+    DTYPES = {'result': np.int32, 'language_pair': np.int8,
+      'segment': np.int16, 'judge': np.int16, 'system_a': np.int16,
+      'system_b': np.int16, 'outcome': np.int8}
+    
+    def __init__(self, codebook=None, **columns):
+        """
+        Creates a new dataset from the given column arrays.
+        
+        Column arrays keep their type, which allows to use memory maps.
+        
+        """
+        self.codebook = codebook or Codebook()
+        for column in self.COLUMNS:
+            _values = columns.get(column)
+            if _values is None:
+                _values = np.zeros(0, dtype=self.DTYPES[column])
+            setattr(self, column, np.asanyarray(_values))
+    
+    def __len__(self):
+        """
+        Returns the number of pairwise judgements in this dataset.
+        """
+        return len(self.outcome)
+    
+    def __getitem__(self, index):
+        """
+        Returns a new dataset containing the rows selected by index.
+        """
+        columns = dict((x, getattr(self, x)[index]) for x in self.COLUMNS)
+        return PairwiseJudgements(self.codebook, **columns)
+    
+    def for_language_pair(self, code):
+        """
+        Returns the subset of this dataset for the given language pair code.
+        """
+        _code = self.codebook.lookup('language_pairs', code)
+        if _code is None:
+            return self[np.zeros(len(self), dtype=bool)]
+        
+        return self[self.language_pair == _code]
+    
+    def compact(self):
+        """
+        Returns a copy of this dataset using the smallest possible types.
+        """
+        columns = {}
+        for column in self.COLUMNS:
+            _values = getattr(self, column)
+            if not len(_values):
+                columns[column] = _values.astype(self.DTYPES[column])
+                continue
+            
+            _dtype = compact_dtype(_values.min(), _values.max())
+            columns[column] = _values.astype(_dtype)
+        
+        return PairwiseJudgements(self.codebook, **columns)
+    
+    def recode(self, codebook):
+        """
+        Returns a copy of this dataset using codes from the given Codebook.
+        
+        This is needed to compare datasets which have been loaded from
+        different cache directories.
+        
+        """
+        if codebook is self.codebook:
+            return self
+        
+        columns = dict((x, getattr(self, x)) for x in self.COLUMNS)
+        for kind, names in (('language_pairs', ('language_pair',)),
+          ('judges', ('judge',)), ('systems', ('system_a', 'system_b'))):
+            _mapping = np.array([codebook.encode(kind, x)
+              for x in getattr(self.codebook, kind)], dtype=np.int64)
+            for name in names:
+                if len(_mapping):
+                    columns[name] = _mapping[columns[name]]
+        
+        return PairwiseJudgements(codebook, **columns).compact()
+    
+    def save(self, path, stamp=u''):
+        """
+        Saves this dataset to the directory at path.
+        
+        The directory contains one .npy file per column and a codebook.npz
+        file including the given stamp which identifies the data source.  The
+        dataset is written to a temporary directory which is renamed once all
+        files are complete, hence readers never see partial datasets.
+        
+        """
+        _temp = u'{0}.tmp'.format(path)
+        if exists(_temp):
+            rmtree(_temp)
+        makedirs(_temp)
+        
+        for column in self.COLUMNS:
+            np.save(join(_temp, u'{0}.npy'.format(column)),
+              getattr(self, column))
+        
+        self.codebook.save(join(_temp, 'codebook.npz'),
+          stamp=np.array([stamp], dtype=np.unicode_))
+        
+        if exists(path):
+            rmtree(path)
+        rename(_temp, path)
+    
+    @classmethod
+    def load(cls, path, mmap_mode='r'):
+        """
+        Loads a dataset from the directory at path using memory maps.
+        """
+        codebook = Codebook.load(join(path, 'codebook.npz'))
+        columns = {}
+        for column in cls.COLUMNS:
+            columns[column] = np.load(join(path, u'{0}.npy'.format(column)),
+              mmap_mode=mmap_mode)
+        
+        return cls(codebook, **columns)
+    
+    @staticmethod
+    def load_stamp(path):
+        """
+        Returns the stamp of the dataset at path or None if there is none.
+        """
+        try:
+            with np.load(join(path, 'codebook.npz')) as _data:
+                return unicode(_data['stamp'][0])
+        
+        except (IOError, KeyError):
+            return None
+    
+    @classmethod
+    def from_rankings(cls, rankings, codebook=None, chunk_size=100000):
+        """
+        Creates a dataset from an iterable of five-way ranking tuples.
+        
+        Each tuple contains (result, language_pair, segment, judge, systems,
+        ranks) where systems and ranks are sequences of length five.  Ranking
+        tuples are encoded and expanded into pairwise rows chunk by chunk.
+        
+        """
+        codebook = codebook or Codebook()
+        chunks = dict((x, []) for x in cls.COLUMNS)
+        
+        rows = []
+        for ranking in rankings:
+            rows.append(ranking)
+            if len(rows) >= chunk_size:
+                cls._expand_rankings(rows, codebook, chunks)
+                rows = []
+        
+        cls._expand_rankings(rows, codebook, chunks)
+        
+        columns = {}
+        for column in cls.COLUMNS:
+            if chunks[column]:
+                columns[column] = np.concatenate(chunks[column])
+        
+        return cls(codebook, **columns).compact()
+    
+    @classmethod
+    def from_rows(cls, rows, codebook=None):
+        """
+        Creates a dataset from an iterable of pairwise row tuples.
+        
+        Each tuple contains (result, language_pair, segment, judge, system_a,
+        system_b, outcome) with string values for the coded columns.
+        
+        """
+        codebook = codebook or Codebook()
+        _encode = codebook.encode
+        columns = dict((x, []) for x in cls.COLUMNS)
+        
+        for result, language_pair, segment, judge, system_a, system_b, \
+          outcome in rows:
+            columns['result'].append(result)
+            columns['language_pair'].append(_encode('language_pairs',
+              language_pair))
+            columns['segment'].append(segment)
+            columns['judge'].append(_encode('judges', judge))
+            columns['system_a'].append(_encode('systems', system_a))
+            columns['system_b'].append(_encode('systems', system_b))
+            columns['outcome'].append(outcome)
+        
+        for column in cls.COLUMNS:
+            columns[column] = np.array(columns[column], dtype=np.int64)
+        
+        return cls(codebook, **columns).compact()
+    
+    @classmethod
+    def _expand_rankings(cls, rows, codebook, chunks):
+        """
+        Appends the pairwise column chunks for the given five-way rankings.
+        """
+        if not rows:
+            return
+        
+        _encode = codebook.encode
+        results = np.array([x[0] for x in rows], dtype=np.int64)
+        language_pairs = np.array([_encode('language_pairs', x[1])
+          for x in rows], dtype=np.int32)
+        segments = np.array([x[2] for x in rows], dtype=np.int64)
+        judges = np.array([_encode('judges', x[3]) for x in rows],
+          dtype=np.int32)
+        systems = np.array([[_encode('systems', y) for y in x[4]]
+          for x in rows], dtype=np.int32)
+        ranks = np.array([x[5] for x in rows], dtype=np.int64)
+        
+        _a = RANKING_PAIRS[:, 0]
+        _b = RANKING_PAIRS[:, 1]
+        _pairs = len(RANKING_PAIRS)
+        
+        # A lower rank is better, hence a positive outcome iff rank_a < rank_b.
+        chunks['result'].append(np.repeat(results, _pairs))
+        chunks['language_pair'].append(np.repeat(language_pairs, _pairs))
+        chunks['segment'].append(np.repeat(segments, _pairs))
+        chunks['judge'].append(np.repeat(judges, _pairs))
+        chunks['system_a'].append(systems[:, _a].ravel())
+        chunks['system_b'].append(systems[:, _b].ravel())
+        chunks['outcome'].append(
+          np.sign(ranks[:, _b] - ranks[:, _a]).astype(np.int8).ravel())
+
+
+def iter_csv_rankings(csv_file):
+    """
+    Yields five-way ranking tuples from the given WMT13 export CSV file.
+    
+    Results which have been skipped, i.e. which only contain -1 ranks, are
+    ignored.  The row number is used as result id.
+    
+    """
+    _reader = reader(csv_file)
+    _header = [x.strip() for x in _reader.next()]
+    _index = dict((name, i) for i, name in enumerate(_header))
+    
+    _srclang = _index['srclang']
+    _trglang = _index['trglang']
+    _segment = _index['srcIndex']
+    _judge = _index['judgeId']
+    _systems = [_index['system{0}Id'.format(x + 1)] for x in range(5)]
+    _ranks = [_index['system{0}rank'.format(x + 1)] for x in range(5)]
+    
+    for result_id, row in enumerate(_reader):
+        if not row or row[0] == 'srclang':
+            continue
+        
+        ranks = [int(row[x]) for x in _ranks]
+        if all([x == -1 for x in ranks]):
+            continue
+        
+        language_pair = language_pair_code(row[_srclang], row[_trglang])
+        systems = [row[x].decode('utf-8') for x in _systems]
+        yield (result_id, language_pair, int(row[_segment]),
+          row[_judge].decode('utf-8'), systems, ranks)
+
+
+def _root_attributes(xml_string):
+    """
+    Returns the XML attributes of the root element without a full parse.
+    """
+    for _unused, element in iterparse(BytesIO(xml_string.encode('utf-8')),
+      events=('start',)):
+        return dict(element.attrib)
+    
+    return {}
+
+
+def iter_database_rankings(hits_qs=None, chunk_size=DATABASE_CHUNK_SIZE,
+  judge_field='user__username'):
+    """
+    Yields five-way ranking tuples for RankingResult objects in the database.
+    
+    By default, all results for active, non-MTurk HITs are used.  Data is
+    fetched using chunked values_list() queries which bypass instantiation of
+    model objects;  the XML of each HIT and RankingTask is only parsed once.
+    Judges are identified by judge_field, e.g. 'user' to yield user ids.
+    
+    """
+    from appraise.wmt13.models import HIT, RankingTask, RankingResult, System
+    
+    if hits_qs is None:
+        hits_qs = HIT.objects.filter(active=True, mturk_only=False)
+    
+    _names = System.get_system_names()
+    
+    # Collect language pair and HIT-level system ids for all HITs.
+    _hits = {}
+    for hit_id, hit_xml, language_pair in hits_qs.order_by().values_list(
+      'id', 'hit_xml', 'language_pair').iterator():
+        _systems = _root_attributes(hit_xml).get('systems')
+        if _systems:
+            _systems = _systems.split(',')
+        _hits[hit_id] = (language_pair, _systems)
+    
+    # Collect segment ids and system ids for all RankingTask objects.
+    _tasks = {}
+    _tasks_qs = RankingTask.objects.filter(hit__in=hits_qs).order_by()
+    for task_id, hit_id, item_xml, system_ids in _tasks_qs.values_list('id',
+      'hit_id', 'item_xml', 'system_ids').iterator():
+        language_pair, _systems = _hits[hit_id]
+        _tree = fromstring(item_xml)
+        
+        # Note that srcIndex is 1-indexed for compatibility with evaluation
+        # scripts from previous editions of the WMT.
+        segment_id = 1 + int(_tree.find('source').attrib['id'])
+        
+        # Prefer integer System keys;  older tasks only have XML attributes.
+        if system_ids:
+            _systems = [_names[int(x)] for x in system_ids.split(',')]
+        
+        elif not _systems:
+            _systems = [x.attrib['system'] for x in
+              _tree.iterfind('translation')]
+        
+        _tasks[task_id] = (language_pair, segment_id, _systems)
+    
+    # Finally, fetch results in chunks ordered by primary key.
+    _results_qs = RankingResult.objects.filter(item__hit__in=hits_qs)
+    _last_id = 0
+    while True:
+        _chunk = list(_results_qs.filter(id__gt=_last_id).order_by('id')
+          .values_list('id', 'item_id', judge_field, 'raw_result')
+          [:chunk_size])
+        if not _chunk:
+            break
+        
+        for result_id, task_id, username, raw_result in _chunk:
+            if not raw_result or raw_result == 'SKIPPED':
+                continue
+            
+            try:
+                ranks = [int(x) for x in raw_result.split(',')]
+            
+            except ValueError:
+                continue
+            
+            if len(ranks) != 5 or all([x == -1 for x in ranks]):
+                continue
+            
+            language_pair, segment_id, systems = _tasks[task_id]
+            yield (result_id, language_pair, segment_id, username, systems,
+              ranks)
+        
+        _last_id = _chunk[-1][0]
+
+
+def iter_materialized_judgements(hits_qs=None,
+  chunk_size=DATABASE_CHUNK_SIZE):
+    """
+    Yields pairwise rows from the materialized PairwiseJudgment table.
+    
+    Each row contains (result, language_pair, segment, judge, system_a,
+    system_b, outcome) and corresponds to one row of a PairwiseJudgements
+    dataset, hence no ranking XML needs to be parsed.
+    
+    """
+    from appraise.wmt13.models import HIT, PairwiseJudgment
+    
+    if hits_qs is None:
+        hits_qs = HIT.objects.filter(active=True, mturk_only=False)
+    
+    _judgments_qs = PairwiseJudgment.objects.filter(
+      result__item__hit__in=hits_qs)
+    _last_id = 0
+    while True:
+        _chunk = list(_judgments_qs.filter(id__gt=_last_id).order_by('id')
+          .values_list('id', 'result', 'language_pair', 'segment',
+          'judge__username', 'system_a__name', 'system_b__name', 'outcome')
+          [:chunk_size])
+        if not _chunk:
+            break
+        
+        for _row in _chunk:
+            yield _row[1:]
+        
+        _last_id = _chunk[-1][0]
+
+
+def _load_cached(cache_dir, name, stamp, loader, codebook=None,
+  refresh=False):
+    """
+    Returns the dataset cached as name in cache_dir or creates it.
+    
+    The cached dataset is only used if its stamp matches the given stamp.
+    Otherwise, loader() is called and its result is saved to the cache.
+    
+    """
+    _path = join(cache_dir, name)
+    if not refresh and PairwiseJudgements.load_stamp(_path) == stamp:
+        dataset = PairwiseJudgements.load(_path)
+        if codebook is not None:
+            dataset = dataset.recode(codebook)
+        return dataset
+    
+    dataset = loader()
+    if not exists(cache_dir):
+        makedirs(cache_dir)
+    dataset.save(_path, stamp=stamp)
+    return dataset
+
+
+def load_csv(csv_file, codebook=None, cache_dir=None):
+    """
+    Loads a PairwiseJudgements dataset from a WMT13 export CSV file.
+    
+    If cache_dir is given, the dataset is cached there and re-used as long
+    as the CSV file's size and modification time do not change.
+    
+    """
+    _loader = lambda: PairwiseJudgements.from_rankings(
+      iter_csv_rankings(csv_file), codebook=codebook)
+    
+    if not cache_dir:
+        return _loader()
+    
+    _name = sha1(abspath(csv_file.name).encode('utf-8')).hexdigest()[:16]
+    _stat = fstat(csv_file.fileno())
+    _stamp = u'csv:{0}:{1}'.format(_stat.st_size, _stat.st_mtime)
+    return _load_cached(cache_dir, u'csv-{0}'.format(_name), _stamp, _loader,
+      codebook)
+
+
+def database_stamp(hits_qs=None, materialized=False):
+    """
+    Returns a stamp describing the current state of the WMT13 results.
+    
+    This changes whenever results are added, removed or updated.  If
+    materialized is True, it also changes with the PairwiseJudgment rows,
+    which may be re-created using materialize_pairwise_judgments.py.
+    
+    """
+    from django.db.models import Count, Max
+    from appraise.wmt13.models import HIT, PairwiseJudgment, RankingResult
+    
+    if hits_qs is None:
+        hits_qs = HIT.objects.filter(active=True, mturk_only=False)
+    
+    _results = RankingResult.objects.filter(item__hit__in=hits_qs).aggregate(
+      count=Count('id'), last=Max('id'), modified=Max('modified'))
+    stamp = u'database:{0}:{1}:{2}'.format(_results['count'],
+      _results['last'], _results['modified'])
+    
+    if materialized:
+        _judgments = PairwiseJudgment.objects.filter(
+          result__item__hit__in=hits_qs).aggregate(count=Count('id'),
+          last=Max('id'))
+        stamp += u':{0}:{1}'.format(_judgments['count'], _judgments['last'])
+    
+    return stamp
+
+
+def load_database(hits_qs=None, codebook=None, cache_dir=None,
+  refresh=False, materialized=False):
+    """
+    Loads a PairwiseJudgements dataset from the Django database.
+    
+    If materialized is True, rows are read from the PairwiseJudgment table
+    instead of expanding the five-way rankings.  If cache_dir is given, the
+    dataset is cached there and re-used until the database_stamp() changes
+    or a refresh is requested.
+    
+    """
+    if materialized:
+        _loader = lambda: PairwiseJudgements.from_rows(
+          iter_materialized_judgements(hits_qs), codebook=codebook)
+    
+    else:
+        _loader = lambda: PairwiseJudgements.from_rankings(
+          iter_database_rankings(hits_qs), codebook=codebook)
+    
+    if not cache_dir:
+        return _loader()
+    
+    # Both modes are cached separately, so that switching between them
+    # never returns the dataset of the other mode.
+    _name = u'database-materialized' if materialized else u'database'
+    return _load_cached(cache_dir, _name, database_stamp(hits_qs,
+      materialized), _loader, codebook, refresh)
+
+
+def write_csv(rankings, outfile):
+    """
+    Writes the given five-way ranking tuples in WMT13 export CSV format.
+    
+    This allows to feed database results into external tools, such as the
+    Perl ranking clusters script, without instantiating any model objects.
+    
+    """
+    outfile.write(WMT_CSV_HEADER.encode('utf-8') + '\n')
+    for _unused, language_pair, segment_id, judge, systems, ranks \
+      in rankings:
+        _src, _trg = language_pair.split('2')
+        values = [LANGUAGE_NAMES.get(_src, _src),
+          LANGUAGE_NAMES.get(_trg, _trg), str(segment_id), '-1',
+          str(segment_id), judge]
+        for system in systems:
+            values.extend(('-1', system))
+        values.extend([str(x) for x in ranks])
+        outfile.write(u','.join(values).encode('utf-8') + '\n')
+
+
+def compute_win_matrix(win_counts, systems):
+    """
+    Returns a (systems x systems) matrix of pairwise win counts.
+    
+    win_counts maps (winner, loser) system names to counts, as returned by
+    PairwiseJudgment.compute_win_counts();  entry [a, b] counts how often
+    systems[a] has been ranked better than systems[b].  Other systems are
+    ignored.
+    
+    """
+    _index = dict((name, i) for i, name in enumerate(systems))
+    wins = np.zeros((len(systems), len(systems)), dtype=np.int64)
+    for (winner, loser), count in win_counts.items():
+        if winner in _index and loser in _index:
+            wins[_index[winner], _index[loser]] += count
+    
+    return wins
+
+
+def compute_win_rate_intervals(win_counts, systems,
+  z_score=DEFAULT_Z_SCORE):
+    """
+    Computes Wilson score intervals for the win rate of each system.
+    
+    win_counts maps (winner, loser) system names to counts, as returned by
+    PairwiseJudgment.compute_win_counts().  Returns (rates, lower, upper)
+    arrays in the order of systems;  systems without any decided comparison
+    get the uninformative interval [0, 1].
+    
+    """
+    _matrix = compute_win_matrix(win_counts, systems)
+    wins = _matrix.sum(axis=1).astype(np.float64)
+    totals = wins + _matrix.sum(axis=0)
+    
+    _n = np.maximum(totals, 1)
+    rates = wins / _n
+    _z2 = z_score ** 2
+    _center = (rates + _z2 / (2 * _n)) / (1 + _z2 / _n)
+    _half = z_score * np.sqrt(rates * (1 - rates) / _n
+      + _z2 / (4 * _n ** 2)) / (1 + _z2 / _n)
+    
+    lower = np.where(totals > 0, _center - _half, 0.0)
+    upper = np.where(totals > 0, _center + _half, 1.0)
+    return (rates, lower, upper)
+
+
+def compute_overlapping_pairs(lower, upper):
+    """
+    Returns a symmetric boolean matrix marking systems with overlapping
+    intervals, i.e., system pairs which have not yet been separated.
+    """
+    overlap = (lower[:, None] <= upper[None, :]) \
+      & (lower[None, :] <= upper[:, None])
+    np.fill_diagonal(overlap, False)
+    return overlap
+
+
+def compute_expected_wins(wins):
+    """
+    Computes the expected wins score for the given (..., systems x systems)
+    win count matrices, i.e., the average win rate against all opponents
+    which have been compared to a system at least once.
+    """
+    wins = np.asarray(wins, dtype=np.float64)
+    totals = wins + np.swapaxes(wins, -1, -2)
+    _rates = wins / np.maximum(totals, 1)
+    _opponents = (totals > 0).sum(axis=-1)
+    return _rates.sum(axis=-1) / np.maximum(_opponents, 1)
+
+
+def bootstrap_rank_ranges(wins, resamples=1000, confidence=0.95,
+  seed=None):
+    """
+    Computes bootstrap rank ranges from a pairwise win count matrix.
+    
+    For each resample, the decided comparisons of every system pair are
+    redrawn from a binomial distribution with the observed win rate;
+    systems are then ranked by expected wins.  Returns (lower, upper)
+    arrays with the 1-based rank range of each system at the given
+    confidence.  Systems are ranked 1 if their score is highest.
+    
+    """
+    wins = np.asarray(wins, dtype=np.int64)
+    _systems = len(wins)
+    if not _systems:
+        return (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64))
+    
+    random = np.random.RandomState(seed)
+    _a, _b = np.triu_indices(_systems, 1)
+    _totals = wins[_a, _b] + wins[_b, _a]
+    _rates = wins[_a, _b] / np.maximum(_totals, 1).astype(np.float64)
+    
+    _wins = random.binomial(_totals, _rates, size=(resamples, len(_a)))
+    samples = np.zeros((resamples, _systems, _systems), dtype=np.int64)
+    samples[:, _a, _b] = _wins
+    samples[:, _b, _a] = _totals - _wins
+    
+    # Ties in the score are broken at random, not in favour of low indices.
+    _scores = compute_expected_wins(samples) \
+      + random.uniform(0, 1e-9, size=(resamples, _systems))
+    ranks = np.argsort(np.argsort(-_scores, axis=1), axis=1) + 1
+    
+    alpha = 100 * (1.0 - confidence) / 2.0
+    lower, upper = np.percentile(ranks, [alpha, 100 - alpha], axis=0)
+    return (np.floor(lower).astype(np.int64),
+      np.ceil(upper).astype(np.int64))
+
+
+def score_system_sets(system_sets, pairs):
+    """
+    Counts the marked system pairs compared within each set of systems.
+    
+    system_sets is an (items x 5) array of system indices, pairs a boolean
+    (systems x systems) matrix such as the one returned by
+    compute_overlapping_pairs().  Returns an array with one count per item.
+    
+    """
+    system_sets = np.asarray(system_sets, dtype=np.int64).reshape(-1, 5)
+    return pairs[system_sets[:, RANKING_PAIRS[:, 0]],
+      system_sets[:, RANKING_PAIRS[:, 1]]].sum(axis=1)
+
+
+def compute_rank_clusters(lower, upper):
+    """
+    Groups systems into clusters of transitively overlapping rank ranges.
+    
+    lower and upper are the rank ranges as returned by
+    bootstrap_rank_ranges().  Returns a list of clusters, best first, each
+    a sorted list of system indices.  A new cluster starts once a system's
+    lower rank exceeds the upper ranks of all systems before it.
+    
+    """
+    clusters = []
+    _upper = 0
+    for index in np.lexsort((upper, lower)):
+        if not clusters or lower[index] > _upper:
+            clusters.append([])
+        
+        clusters[-1].append(int(index))
+        _upper = max(_upper, upper[index])
+    
+    return [sorted(x) for x in clusters]
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+"""
+Project: Appraise evaluation system
+ Author: Christian Federmann <cfedermann@gmail.com>
+
+Convergence monitor for WMT13 ranking clusters.
+
+Each check computes bootstrap rank ranges from the current PairwiseJudgment
+win counts and groups systems with overlapping rank ranges into clusters.
+A check only counts once CONVERGENCE_MIN_JUDGMENTS new decided judgments
+have been collected since the previous one;  a language pair is marked as
+saturated once its clusters did not change for CONVERGENCE_STABLE_CHECKS
+consecutive checks.
+
+"""
+import logging
+
+from datetime import datetime
+
+from appraise.metrics import timed
+from appraise.wmt13.analytics import bootstrap_rank_ranges, \
+  compute_rank_clusters, compute_win_matrix
+from appraise.wmt13.models import LANGUAGE_PAIR_CHOICES, \
+  LanguagePairStatus, PairwiseJudgment, System
+from appraise.settings import LOG_LEVEL, LOG_HANDLER
+
+# Setup logging support.
+logging.basicConfig(level=LOG_LEVEL)
+LOGGER = logging.getLogger('appraise.wmt13.convergence')
+LOGGER.addHandler(LOG_HANDLER)
+
+
+# Number of consecutive checks with unchanged clusters for saturation.
+CONVERGENCE_STABLE_CHECKS = 3
+
+# Number of new decided judgments required before the next check.
+CONVERGENCE_MIN_JUDGMENTS = 1000
+
+# Number of bootstrap resamples used to compute rank ranges.
+CONVERGENCE_RESAMPLES = 1000
+
+
+@timed('appraise_ranking_recomputation_seconds', method='bootstrap')
+def compute_clusters(language_pair, resamples=CONVERGENCE_RESAMPLES,
+  seed=None):
+    """
+    Returns the ranking clusters for the given language pair.
+    
+    Clusters are lists of system names, best first.
+    
+    """
+    systems = sorted(System.objects.filter(language_pair=language_pair)
+      .values_list('name', flat=True))
+    wins = compute_win_matrix(PairwiseJudgment.compute_win_counts(
+      language_pair), systems)
+    lower, upper = bootstrap_rank_ranges(wins, resamples, seed=seed)
+    return [[systems[x] for x in cluster]
+      for cluster in compute_rank_clusters(lower, upper)]
+
+
+def check_convergence(language_pair, force=False, seed=None):
+    """
+    Checks the ranking clusters of the given language pair.
+    
+    Returns the updated LanguagePairStatus instance.  Unless force is True,
+    the check is skipped if too few new judgments have been collected.
+    
+    """
+    status, _unused = LanguagePairStatus.objects.get_or_create(
+      language_pair=language_pair)
+    
+    judgments = PairwiseJudgment.objects.filter(
+      language_pair=language_pair).exclude(outcome=0).count()
+    if not force and judgments - status.judgments \
+      < CONVERGENCE_MIN_JUDGMENTS:
+        return status
+    
+    clusters = u' > '.join([u', '.join(x) for x in compute_clusters(
+      language_pair, seed=seed)])
+    if judgments and clusters == status.clusters:
+        status.stable_checks += 1
+    
+    else:
+        status.stable_checks = 0
+        status.clusters = clusters
+    
+    _saturated = status.stable_checks >= CONVERGENCE_STABLE_CHECKS
+    if _saturated != status.saturated:
+        LOGGER.info('Language pair {0} is {1} saturated.'.format(
+          language_pair, 'now' if _saturated else 'no longer'))
+    
+    status.saturated = _saturated
+    status.judgments = judgments
+    status.checked = datetime.now()
+    status.save()
+    return status
+
+
+def update_convergence(force=False):
+    """
+    Checks all language pairs, returns their LanguagePairStatus instances.
+    """
+    return [check_convergence(x[0], force=force)
+      for x in LANGUAGE_PAIR_CHOICES]
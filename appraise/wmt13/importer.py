@@ -0,0 +1,601 @@
+# -*- coding: utf-8 -*-
+"""
+Project: Appraise evaluation system
+ Author: Christian Federmann <cfedermann@gmail.com>
+
+Bulk import of WMT13 HITs.
+
+HIT.save() validates, allocates an id and creates three RankingTask objects
+for one HIT at a time, each with its own queries and commit.  The functions
+in this module insert HITRecord instances, as returned by the single-pass
+parser in appraise.wmt13.validators, using bulk_create() inside one
+transaction per chunk.
+
+Streaming imports record the number of HITs processed up to the last
+commit in a checkpoint file, which allows to resume an interrupted import.
+Parsing and validation can be distributed to a process pool using
+ParallelValidator, while the calling process remains the single database
+writer.
+
+Campaigns can also be ingested directly from parallel text files, without
+building an intermediate HITs XML file, using iter_corpus_records().  The
+systems shown per segment are chosen by a BalancedSystemSampler, which
+balances how often each system is shown, or a PairBalancedSampler, which
+balances how often each system pair is compared.
+
+"""
+import logging
+
+from collections import deque
+from itertools import chain, combinations, islice, izip_longest
+from multiprocessing import Pool
+from os import remove, rename
+from os.path import basename, exists
+from random import Random
+from time import time
+from xml.etree.ElementTree import Element, SubElement
+
+import numpy as np
+
+from django.db import transaction
+
+from django.core.exceptions import ValidationError
+
+from appraise.wmt13.models import HIT, RankingTask, System
+from appraise.wmt13.validators import extract_hit_record, \
+  extract_hits_xml_fragment, get_language_pair, iter_hits_xml_fragments
+from appraise.settings import LOG_LEVEL, LOG_HANDLER
+
+# Setup logging support.
+logging.basicConfig(level=LOG_LEVEL)
+LOGGER = logging.getLogger('appraise.wmt13.importer')
+LOGGER.addHandler(LOG_HANDLER)
+
+
+# Number of HITs inserted per transaction.
+DEFAULT_CHUNK_SIZE = 1000
+
+# Each HIT contains 3 segments with 5 translations each.
+SEGMENTS_PER_HIT = 3
+SYSTEMS_PER_SEGMENT = 5
+
+
+class ImportStatistics(object):
+    """
+    Collects counts and timing for a bulk import.
+    """
+    def __init__(self):
+        """
+        Starts the import timer.
+        """
+        self.hits = 0
+        self.tasks = 0
+        self.duplicates = 0
+        self.duplicate_segments = 0
+        self.started = time()
+    
+    def add(self, hits, tasks):
+        """
+        Adds the given numbers of inserted HITs and tasks.
+        """
+        self.hits += hits
+        self.tasks += tasks
+    
+    def elapsed(self):
+        """
+        Returns the number of seconds since the import has been started.
+        """
+        return max(time() - self.started, 1e-6)
+    
+    def __unicode__(self):
+        """
+        Returns a Unicode String describing the import throughput.
+        """
+        _elapsed = self.elapsed()
+        return u'{0} HITs, {1} tasks in {2:.2f}s: {3:.0f} rows/s, ' \
+          '{4:.0f} HITs/min'.format(self.hits, self.tasks, _elapsed,
+          (self.hits + self.tasks) / _elapsed, 60 * self.hits / _elapsed)
+    
+    def describe_duplicates(self):
+        """
+        Returns a Unicode String describing the duplicates found so far.
+        """
+        return u'Found {0} duplicate HITs and {1} duplicate segments.' \
+          .format(self.duplicates, self.duplicate_segments)
+
+
+def _insert_chunk(chunk, mturk_only, system_ids):
+    """
+    Inserts the given (language_pair, HITRecord) tuples.
+    
+    Returns the number of RankingTask objects which have been created.
+    system_ids caches integer System keys per (language pair, name).
+    
+    """
+    hit_ids = HIT._create_hit_ids(len(chunk))
+    
+    hits = []
+    for hit_id, (language_pair, record) in zip(hit_ids, chunk):
+        hits.append(HIT(hit_id=hit_id, block_id=record.block_id,
+          hit_xml=record.hit_xml, language_pair=language_pair,
+          mturk_only=mturk_only, hit_attributes=record.attributes,
+          content_hash=record.content_hash))
+    
+    HIT.objects.bulk_create(hits)
+    
+    # bulk_create() does not set primary keys, hence we fetch them by HIT id.
+    _pks = dict(HIT.objects.filter(hit_id__in=hit_ids).values_list('hit_id',
+      'id'))
+    
+    tasks = []
+    for hit_id, (language_pair, record) in zip(hit_ids, chunk):
+        for segment in record.segments:
+            _names = segment.systems
+            _missing = [x for x in _names if not (language_pair, x)
+              in system_ids]
+            if _missing:
+                for name, system_id in zip(_missing, System.get_system_ids(
+                  language_pair, _missing)):
+                    system_ids[(language_pair, name)] = system_id
+            
+            _ids = [str(system_ids[(language_pair, x)]) for x in _names]
+            tasks.append(RankingTask(hit_id=_pks[hit_id],
+              item_xml=segment.item_xml, system_ids=','.join(_ids),
+              segment=segment))
+    
+    RankingTask.objects.bulk_create(tasks)
+    return len(tasks)
+
+
+def bulk_import_hits(records, mturk_only=False,
+  chunk_size=DEFAULT_CHUNK_SIZE, statistics=None, on_commit=None):
+    """
+    Imports the given HITRecord instances into the database.
+    
+    HITs are inserted in chunks of chunk_size, each inside a transaction.
+    If given, on_commit is called with the last HITRecord of each committed
+    chunk.  Returns an ImportStatistics instance.
+    
+    """
+    if statistics is None:
+        statistics = ImportStatistics()
+    
+    system_ids = {}
+    chunk = []
+    for record in records:
+        chunk.append((get_language_pair(record.attributes), record))
+        
+        if len(chunk) >= chunk_size:
+            with transaction.commit_on_success():
+                _tasks = _insert_chunk(chunk, mturk_only, system_ids)
+            statistics.add(len(chunk), _tasks)
+            LOGGER.debug(unicode(statistics))
+            if on_commit:
+                on_commit(chunk[-1][1])
+            chunk = []
+    
+    if chunk:
+        with transaction.commit_on_success():
+            _tasks = _insert_chunk(chunk, mturk_only, system_ids)
+        statistics.add(len(chunk), _tasks)
+        if on_commit:
+            on_commit(chunk[-1][1])
+    
+    return statistics
+
+
+class ParallelValidator(object):
+    """
+    Validates HITs XML files in a process pool, ahead of the writer.
+    
+    Files are split into fragments of complete <hit> elements which worker
+    processes parse, validate and convert into HITRecord instances.  At most
+    window fragments are in flight;  as these may belong to the next file,
+    parsing of one file overlaps with the database writes for the previous.
+    
+    """
+    def __init__(self, paths, processes, fragment_size=1 << 20,
+      window=None):
+        """
+        Creates the process pool;  call this before opening the database.
+        """
+        self.fragment_size = fragment_size
+        self.window = window or 2 * processes
+        self._pool = Pool(processes=processes)
+        self._results = self._iter_results(paths)
+        self._lookahead = None
+    
+    def _iter_results(self, paths):
+        """
+        Yields (file index, (records, error)) tuples in file order.
+        """
+        pending = deque()
+        for index, path in enumerate(paths):
+            try:
+                for _fragment in iter_hits_xml_fragments(path,
+                  self.fragment_size):
+                    _result = self._pool.apply_async(
+                      extract_hits_xml_fragment, (_fragment,))
+                    pending.append((index, _result.get))
+                    
+                    while len(pending) >= self.window:
+                        _index, _get = pending.popleft()
+                        yield (_index, _get())
+            
+            # Errors are reported in order, after all previous fragments.
+            except ValidationError, msg:
+                _error = ([], u'; '.join(msg.messages))
+                pending.append((index, lambda error=_error: error))
+        
+        while pending:
+            _index, _get = pending.popleft()
+            yield (_index, _get())
+    
+    def iter_records(self, index):
+        """
+        Yields the HITRecords of the file with the given index.
+        
+        Files have to be consumed in order.  Raises ValidationError for the
+        first invalid HIT, after all previous HITs have been yielded;  the
+        remaining HITs of that file are skipped when reading the next file.
+        
+        """
+        while True:
+            if self._lookahead is None:
+                self._lookahead = next(self._results, None)
+                if self._lookahead is None:
+                    return
+            
+            _index, (records, error) = self._lookahead
+            if _index < index:
+                self._lookahead = None
+                continue
+            
+            if _index != index:
+                return
+            
+            self._lookahead = None
+            for record in records:
+                yield record
+            
+            if error:
+                raise ValidationError(error)
+    
+    def close(self):
+        """
+        Terminates the process pool.
+        """
+        self._pool.terminate()
+        self._pool.join()
+
+
+def check_duplicates(records, statistics, skip=False,
+  chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Yields records, counting those which duplicate existing or earlier ones.
+    
+    Records are checked in batches of chunk_size, using one IN query on the
+    indexed content hashes of HITs and one of RankingTasks per batch.  If
+    skip is True, duplicate HITs are not yielded.  Segments are only
+    counted, as each HIT is imported as a whole.
+    
+    """
+    _seen = set()
+    _seen_segments = set()
+    
+    batch = []
+    for record in chain(records, [None]):
+        if record is not None:
+            batch.append(record)
+            if len(batch) < chunk_size:
+                continue
+        
+        if not batch:
+            break
+        
+        _hashes = set([x.content_hash for x in batch])
+        _seen.update(HIT.objects.filter(content_hash__in=_hashes)
+          .values_list('content_hash', flat=True))
+        
+        _hashes = set([y.content_hash for x in batch for y in x.segments])
+        _seen_segments.update(RankingTask.objects.filter(
+          content_hash__in=_hashes).values_list('content_hash', flat=True))
+        
+        for _record in batch:
+            for segment in _record.segments:
+                if segment.content_hash in _seen_segments:
+                    statistics.duplicate_segments += 1
+                _seen_segments.add(segment.content_hash)
+            
+            if _record.content_hash in _seen:
+                statistics.duplicates += 1
+                if skip:
+                    continue
+            
+            _seen.add(_record.content_hash)
+            yield _record
+        
+        batch = []
+
+
+def number_records(records):
+    """
+    Yields the given HITRecords with their position in the file as index.
+    """
+    for index, record in enumerate(records):
+        yield record._replace(index=index)
+
+
+def resume_after_records(records, count, statistics,
+  chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Skips the first count of the given HITRecords.
+    
+    An import may have been interrupted after committing a chunk but before
+    its checkpoint was saved.  Hence, HITs of the next chunk_size records
+    are skipped if they already exist and counted as duplicates.  Raises
+    ValueError if there are less than count records.
+    
+    """
+    _records = iter(records)
+    for _skipped in xrange(count):
+        if next(_records, None) is None:
+            raise ValueError('Checkpoint after {0} HITs, but only {1} HITs ' \
+              'found.'.format(count, _skipped))
+    
+    for record in check_duplicates(islice(_records, chunk_size),
+      statistics, skip=True, chunk_size=chunk_size):
+        yield record
+    
+    for record in _records:
+        yield record
+
+
+def load_checkpoint(path):
+    """
+    Returns the number of processed HITs stored at path or None.
+    
+    Raises ValueError for checkpoints storing a block-id, as written by
+    earlier versions, since block-ids do not identify a HIT.
+    
+    """
+    if not exists(path):
+        return None
+    
+    with open(path) as infile:
+        _checkpoint = infile.read().split()
+    
+    if len(_checkpoint) != 2 or _checkpoint[0] != 'hits':
+        raise ValueError('Invalid checkpoint {0}, please remove it and ' \
+          'import the missing HITs using --skip-duplicates.'.format(path))
+    
+    return int(_checkpoint[1])
+
+
+def save_checkpoint(path, record):
+    """
+    Atomically stores the number of HITs up to the given record at path.
+    
+    The record has to be numbered using number_records().
+    
+    """
+    _temp = '{0}.tmp'.format(path)
+    with open(_temp, 'w') as outfile:
+        outfile.write('hits {0}\n'.format(record.index + 1))
+    rename(_temp, path)
+
+
+def remove_checkpoint(path):
+    """
+    Removes the checkpoint at path once an import has been completed.
+    """
+    if exists(path):
+        remove(path)
+
+
+class BalancedSystemSampler(object):
+    """
+    Samples systems per segment s.t. all systems are shown equally often.
+    
+    Each sample consists of the least often used systems, ties are broken
+    at random.  Hence, usage counts of any two systems differ by at most one.
+    
+    """
+    def __init__(self, systems, seed=None):
+        """
+        Creates a sampler for the given list of system names.
+        """
+        if len(systems) < SYSTEMS_PER_SEGMENT:
+            raise ValueError('at least {0} systems required, got {1}'.format(
+              SYSTEMS_PER_SEGMENT, len(systems)))
+        
+        self.systems = list(systems)
+        self.counts = [0] * len(systems)
+        self.random = Random(seed)
+    
+    def sample(self):
+        """
+        Returns a list of SYSTEMS_PER_SEGMENT system indices.
+        """
+        _order = sorted(range(len(self.systems)),
+          key=lambda x: (self.counts[x], self.random.random()))
+        selected = _order[:SYSTEMS_PER_SEGMENT]
+        for index in selected:
+            self.counts[index] += 1
+        
+        return selected
+
+
+class PairBalancedSampler(object):
+    """
+    Samples systems per segment s.t. system pairs are compared as targeted.
+    
+    weights is a symmetric (systems x systems) matrix of relative pair
+    frequencies, by default all pairs are compared equally often.  Samples
+    are drawn in vectorized batches of batch_size segments:  the first
+    system is drawn proportional to its pairs' deficits w.r.t. the targeted
+    frequencies, each further system proportional to its summed deficits
+    with the systems drawn so far.  Counts and deficits only include the
+    segments which have actually been returned by sample() or sample_batch().
+    
+    """
+    def __init__(self, systems, weights=None, seed=None, batch_size=1000):
+        """
+        Creates a sampler for the given list of system names.
+        """
+        if len(systems) < SYSTEMS_PER_SEGMENT:
+            raise ValueError('at least {0} systems required, got {1}'.format(
+              SYSTEMS_PER_SEGMENT, len(systems)))
+        
+        _size = len(systems)
+        if weights is None:
+            weights = np.ones((_size, _size))
+        
+        weights = np.array(weights, dtype=np.float64)
+        np.fill_diagonal(weights, 0)
+        
+        self.systems = list(systems)
+        self.targets = weights / weights.sum()
+        self.pair_counts = np.zeros((_size, _size), dtype=np.int64)
+        self.counts = np.zeros(_size, dtype=np.int64)
+        self.random = np.random.RandomState(seed)
+        self.batch_size = batch_size
+        self._batch = []
+    
+    def _draw_batch(self, size):
+        """
+        Returns a (size x SYSTEMS_PER_SEGMENT) array, without counting it.
+        """
+        _systems = len(self.systems)
+        _pairs = SYSTEMS_PER_SEGMENT * (SYSTEMS_PER_SEGMENT - 1)
+        _expected = self.targets * (self.pair_counts.sum() + size * _pairs)
+        deficits = np.maximum(_expected - self.pair_counts, 0) + 1e-9
+        np.fill_diagonal(deficits, 0)
+        
+        # Gumbel-max trick:  argmax(log(p) + G) samples each row from p.
+        scores = np.tile(np.log(deficits.sum(axis=1)), (size, 1))
+        selected = np.zeros((size, SYSTEMS_PER_SEGMENT), dtype=np.int64)
+        _rows = np.arange(size)
+        _affinity = np.zeros((size, _systems))
+        for position in range(SYSTEMS_PER_SEGMENT):
+            _choice = np.argmax(scores + self.random.gumbel(
+              size=(size, _systems)), axis=1)
+            selected[:, position] = _choice
+            _affinity += deficits[_choice]
+            with np.errstate(divide='ignore'):
+                scores = np.log(_affinity)
+            scores[_rows[:, None], selected[:, :position + 1]] = -np.inf
+        
+        return selected
+    
+    def sample_batch(self, size):
+        """
+        Returns a (size x SYSTEMS_PER_SEGMENT) array of system indices.
+        """
+        selected = self._draw_batch(size)
+        _systems = len(self.systems)
+        for a, b in combinations(range(SYSTEMS_PER_SEGMENT), 2):
+            _keys = np.concatenate((selected[:, a] * _systems
+              + selected[:, b], selected[:, b] * _systems + selected[:, a]))
+            self.pair_counts += np.bincount(_keys,
+              minlength=_systems ** 2).reshape(_systems, _systems)
+        self.counts += np.bincount(selected.ravel(), minlength=_systems)
+        
+        return selected
+    
+    def sample(self):
+        """
+        Returns a list of SYSTEMS_PER_SEGMENT system indices.
+        
+        Segments are drawn in batches, but only counted once returned.
+        
+        """
+        if not self._batch:
+            self._batch = list(self._draw_batch(self.batch_size))
+            self._batch.reverse()
+        
+        selected = self._batch.pop()
+        # np.ix_() also pairs each system with itself, hence the correction.
+        self.pair_counts[np.ix_(selected, selected)] += 1
+        self.pair_counts[selected, selected] -= 1
+        self.counts[selected] += 1
+        return selected.tolist()
+
+
+def _iter_lines(path):
+    """
+    Yields the stripped, UTF-8 decoded lines of the text file at path.
+    """
+    with open(path) as infile:
+        for line in infile:
+            yield line.decode('utf-8').strip()
+
+
+def iter_corpus_records(source_path, reference_path, system_paths,
+  source_language, target_language, system_names=None, block_id=1,
+  sampler=None):
+    """
+    Yields HITRecords built from parallel source, reference and system files.
+    
+    Files are read line by line in lockstep, hence memory use is constant in
+    corpus size.  Each segment shows the 5 systems chosen by sampler, each
+    HIT groups 3 consecutive segments and gets the next block-id.  Segment
+    ids are 0-based line numbers, all segments share the source file name
+    as doc-id.  Trailing segments which do not fill a HIT are skipped.
+    System names default to the file names of system_paths;  directories
+    are omitted so that names do not depend on where files are stored.
+    
+    Raises ValidationError for files of different length or empty lines.
+    
+    """
+    if system_names is None:
+        system_names = [basename(x) for x in system_paths]
+    
+    if sampler is None:
+        sampler = BalancedSystemSampler(system_names)
+    
+    _files = [_iter_lines(x) for x in [source_path, reference_path]
+      + list(system_paths)]
+    
+    hit = None
+    for index, lines in enumerate(izip_longest(*_files)):
+        if None in lines:
+            raise ValidationError('Line {0}: input files differ in length, ' \
+              '{1} is exhausted.'.format(index + 1,
+              ([source_path, reference_path] + list(system_paths))[
+              lines.index(None)]))
+        
+        if hit is None:
+            hit = Element('hit', {'block-id': unicode(block_id),
+              'source-language': source_language,
+              'target-language': target_language})
+        
+        _segment = SubElement(hit, 'seg', {'id': unicode(index),
+          'doc-id': basename(source_path)})
+        
+        # Empty lines become elements without text, which fail validation.
+        SubElement(_segment, 'source', {'id': unicode(index)}).text = \
+          lines[0] or None
+        SubElement(_segment, 'reference').text = lines[1] or None
+        for system in sampler.sample():
+            SubElement(_segment, 'translation',
+              {'system': system_names[system]}).text = lines[2 + system] \
+              or None
+        
+        if len(hit) < SEGMENTS_PER_HIT:
+            continue
+        
+        try:
+            yield extract_hit_record(hit)
+        
+        except ValidationError, msg:
+            raise ValidationError(u'Lines {0}-{1}: {2}'.format(
+              index + 2 - SEGMENTS_PER_HIT, index + 1,
+              u'; '.join(msg.messages)))
+        
+        hit = None
+        block_id += 1
+    
+    if hit is not None:
+        LOGGER.warning('Skipped {0} trailing segment(s) after block-id ' \
+          '{1}.'.format(len(hit), block_id - 1))
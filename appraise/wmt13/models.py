@@ -4,9 +4,8 @@ Project: Appraise evaluation system
  Author: Christian Federmann <cfedermann@gmail.com>
 """
 import logging
-import uuid
 
-from xml.etree.ElementTree import fromstring, ParseError, tostring
+from xml.etree.ElementTree import fromstring, ParseError
 
 from django.dispatch import receiver
 
@@ -16,9 +15,10 @@ from django.db import models
 from django.template import Context
 from django.template.loader import get_template
 
-from appraise.wmt13.validators import validate_hit_xml, validate_segment_xml
+from appraise.wmt13.validators import compute_content_hash, \
+  extract_hit_record, validate_hit_xml, validate_segment_xml
 from appraise.settings import LOG_LEVEL, LOG_HANDLER
-from appraise.utils import datetime_to_seconds, AnnotationTask
+from appraise.utils import datetime_to_seconds, UniqueIdAllocator
 
 # Setup logging support.
 logging.basicConfig(level=LOG_LEVEL)
@@ -40,6 +40,80 @@ LANGUAGE_PAIR_CHOICES = (
 )
 
 
+# pylint: disable-msg=E1101
+class System(models.Model):
+    """
+    System object model for the MT systems of a language pair.
+    
+    System names are stored once per language pair;  RankingTask and
+    PairwiseJudgment instances refer to them by integer key.
+    
+    """
+    name = models.CharField(
+      max_length=200,
+      db_index=True,
+      help_text="System identifier as used in the HIT XML.",
+      verbose_name="System name"
+    )
+    
+    language_pair = models.CharField(
+      max_length=7,
+      choices=LANGUAGE_PAIR_CHOICES,
+      db_index=True,
+      help_text="Language pair choice for this System instance.",
+      verbose_name="Language pair"
+    )
+    
+    class Meta:
+        """
+        Metadata options for the System object model.
+        """
+        ordering = ('language_pair', 'name')
+        unique_together = (('language_pair', 'name'),)
+        verbose_name = "System instance"
+        verbose_name_plural = "System instances"
+    
+    def __unicode__(self):
+        """
+        Returns a Unicode String for this System object.
+        """
+        return u'<system id="{0}" name="{1}" language-pair="{2}">'.format(
+          self.id, self.name, self.language_pair)
+    
+    @classmethod
+    def get_system_ids(cls, language_pair, names):
+        """
+        Returns the integer keys for the given system names, in order.
+        
+        System instances for previously unknown names are created.
+        
+        """
+        _names = set(names)
+        system_ids = dict(cls.objects.filter(language_pair=language_pair,
+          name__in=_names).values_list('name', 'id'))
+        
+        for name in _names.difference(system_ids.keys()):
+            _system = cls.objects.create(language_pair=language_pair,
+              name=name)
+            system_ids[name] = _system.id
+        
+        return [system_ids[x] for x in names]
+    
+    @classmethod
+    def get_system_names(cls, system_ids=None):
+        """
+        Returns a dict mapping integer keys to system names.
+        
+        If system_ids is None, all System instances are returned.
+        
+        """
+        systems_qs = cls.objects.all()
+        if system_ids is not None:
+            systems_qs = systems_qs.filter(id__in=set(system_ids))
+        
+        return dict(systems_qs.order_by().values_list('id', 'name'))
+
+
 # pylint: disable-msg=E1101
 class HIT(models.Model):
     """
@@ -76,9 +150,21 @@ class HIT(models.Model):
       help_text="Language pair choice for this HIT instance.",
       verbose_name="Language pair"
     )
+    
+    content_hash = models.CharField(
+      max_length=40,
+      blank=True,
+      db_index=True,
+      editable=False,
+      help_text="SHA-1 hash of the extracted HIT contents.",
+      verbose_name="Content hash"
+    )
 
     # This is derived from hit_xml and NOT stored in the database.
     hit_attributes = {}
+    
+    # Validated SegmentRecord instances for HITs created from a HITRecord.
+    segments = None
 
     users = models.ManyToManyField(
       User,
@@ -101,6 +187,47 @@ class HIT(models.Model):
       help_text="Indicates that this HIT instance is ONLY usable via MTurk.",
       verbose_name="MTurk only?"
     )
+    
+    # Agreement scores are cached with the HIT instance and marked as stale
+    # whenever one of the corresponding RankingResult instances changes.
+    # Stale scores are re-computed by update_wmt13_agreement_scores.py, not
+    # while results are submitted, as this requires importing NLTK.
+    agreement_alpha = models.FloatField(
+      blank=True,
+      editable=False,
+      null=True,
+      verbose_name="Alpha agreement"
+    )
+    
+    agreement_kappa = models.FloatField(
+      blank=True,
+      editable=False,
+      null=True,
+      verbose_name="Kappa agreement"
+    )
+    
+    agreement_pi = models.FloatField(
+      blank=True,
+      editable=False,
+      null=True,
+      verbose_name="Pi agreement"
+    )
+    
+    # pylint: disable-msg=C0103
+    agreement_S = models.FloatField(
+      blank=True,
+      editable=False,
+      null=True,
+      verbose_name="Bennett's S agreement"
+    )
+    
+    agreement_stale = models.BooleanField(
+      db_index=True,
+      default=True,
+      editable=False,
+      help_text="Indicates that cached agreement scores are out of date.",
+      verbose_name="Agreement stale?"
+    )
 
     class Meta:
         """
@@ -114,14 +241,23 @@ class HIT(models.Model):
     def __init__(self, *args, **kwargs):
         """
         Makes sure that self.hit_attributes are available.
+        
+        Already extracted hit_attributes can be given as keyword argument,
+        in which case hit_xml is not parsed again.
+        
         """
+        _attributes = kwargs.pop('hit_attributes', None)
         super(HIT, self).__init__(*args, **kwargs)
         
         if not self.hit_id:
             self.hit_id = self.__class__._create_hit_id()
         
+        if _attributes is not None:
+            self.hit_attributes = dict(_attributes)
+        
         # If a hit_xml file is available, populate self.hit_attributes.
-        self.reload_dynamic_fields()
+        else:
+            self.reload_dynamic_fields()
     
     def __unicode__(self):
         """
@@ -130,14 +266,31 @@ class HIT(models.Model):
         return u'<HIT id="{0}" hit="{1}" block="{2}" language-pair="{3}">' \
           .format(self.id, self.hit_id, self.block_id, self.language_pair)
     
+    @classmethod
+    def from_record(cls, record, language_pair, **kwargs):
+        """
+        Creates a new HIT instance from the given validated HITRecord.
+        
+        The record's XML is neither parsed nor validated again on save().
+        
+        """
+        hit = cls(block_id=record.block_id, hit_xml=record.hit_xml,
+          language_pair=language_pair, hit_attributes=record.attributes,
+          content_hash=record.content_hash, **kwargs)
+        hit.segments = record.segments
+        return hit
+    
     @classmethod
     def _create_hit_id(cls):
         """Creates a random UUID-4 8-digit hex number for use as HIT id."""
-        new_id = uuid.uuid4().hex[:8]
-        while cls.objects.filter(hit_id=new_id):
-            new_id = uuid.uuid4().hex[:8]
-        
-        return new_id
+        return HIT_ID_ALLOCATOR.next_id()
+    
+    @classmethod
+    def _create_hit_ids(cls, count):
+        """
+        Creates count unique HIT ids using one query per round of candidates.
+        """
+        return HIT_ID_ALLOCATOR.allocate(count)
     
     @classmethod
     def compute_remaining_hits(cls, language_pair=None):
@@ -215,17 +368,27 @@ class HIT(models.Model):
         """
         Makes sure that validation is run before saving an object instance.
         """
-        # Enforce validation before saving HIT objects.
+        # Enforce validation before saving HIT objects.  For HITs created
+        # from a HITRecord, hit_xml has already been validated.
         if not self.id:
-            self.full_clean()
+            if self.segments is None:
+                self.full_clean()
+                _record = extract_hit_record(fromstring(
+                  self.hit_xml.encode("utf-8")))
+                self.segments = _record.segments
+                self.content_hash = _record.content_hash
+            
+            else:
+                self.full_clean(exclude=('hit_xml',))
             
             # We have to call save() here to get an id for this instance.
             super(HIT, self).save(*args, **kwargs)
             
-            _tree = fromstring(self.hit_xml.encode("utf-8"))
+            _items = [RankingTask(hit=self, item_xml=x.item_xml, segment=x)
+              for x in self.segments]
             
-            for _child in _tree:
-                new_item = RankingTask(hit=self, item_xml=tostring(_child))
+            for new_item in _items:
+                new_item.update_system_ids()
                 new_item.save()
         
         super(HIT, self).save(*args, **kwargs)
@@ -263,6 +426,13 @@ class HIT(models.Model):
             except (ParseError), msg:
                 self.hit_attributes = {'note': msg}
     
+    def update_content_hash(self):
+        """
+        Sets self.content_hash from the extracted HIT contents.
+        """
+        _record = extract_hit_record(fromstring(self.hit_xml.encode("utf-8")))
+        self.content_hash = _record.content_hash
+    
     def export_to_xml(self):
         """
         Renders this HIT as XML String.
@@ -286,14 +456,23 @@ class HIT(models.Model):
           'results': list(enumerate(results))}
         return template.render(Context(context))
     
-    def export_to_apf(self):
+    def export_to_apf(self, system_names=None):
         """
         Exports this HIT's results to Artstein and Poesio (2007) format.
+        
+        system_names is a dict as returned by System.get_system_names();  if
+        not given, the names of this HIT's systems are loaded once.
+        
         """
+        _items = list(RankingTask.objects.filter(hit=self))
+        if system_names is None:
+            system_names = System.get_system_names([x for item in _items
+              for x in item.get_system_ids()])
+        
         results = []
-        for item in RankingTask.objects.filter(hit=self):
+        for item in _items:
             for _result in item.rankingresult_set.all():
-                _apf_output = _result.export_to_apf()
+                _apf_output = _result.export_to_apf(system_names)
                 if _apf_output:
                     results.append(_apf_output)
         return u"\n".join(results)
@@ -316,7 +495,9 @@ class HIT(models.Model):
         except IndexError:
             return None
         
-        # Compute alpha, kappa, pi, and S scores.
+        # Compute alpha, kappa, pi, and S scores.  NLTK is only imported
+        # here as it takes long to import.
+        from appraise.agreement import AnnotationTask
         _task = AnnotationTask(data=_data)
         try:
             _alpha = _task.alpha()
@@ -330,6 +511,91 @@ class HIT(models.Model):
             return None
         
         return (_alpha, _kappa, _pi, _S)
+    
+    def update_agreement_scores(self):
+        """
+        Re-computes and stores the cached agreement scores for this HIT.
+        """
+        _scores = self.compute_agreement_scores() or (None, None, None, None)
+        
+        self.agreement_alpha = _scores[0]
+        self.agreement_kappa = _scores[1]
+        self.agreement_pi = _scores[2]
+        self.agreement_S = _scores[3]
+        self.agreement_stale = False
+        
+        # We use update() here to avoid the HIT.save() validation overhead.
+        HIT.objects.filter(pk=self.pk).update(agreement_alpha=_scores[0],
+          agreement_kappa=_scores[1], agreement_pi=_scores[2],
+          agreement_S=_scores[3], agreement_stale=False)
+    
+    def get_agreement_scores(self):
+        """
+        Returns cached alpha, kappa, pi and Bennett's S agreement scores.
+        
+        Scores are only re-computed if the cached values are stale.  Returns
+        None if no agreement scores can be computed for this HIT.
+        
+        """
+        if self.agreement_stale:
+            self.update_agreement_scores()
+        
+        if self.agreement_kappa is None:
+            return None
+        
+        return (self.agreement_alpha, self.agreement_kappa,
+          self.agreement_pi, self.agreement_S)
+    
+    @classmethod
+    def compute_average_agreement_scores(cls, hits_qs=None):
+        """
+        Computes average agreement scores for the given HITs QuerySet.
+        
+        Averages are computed from the cached scores using a single
+        aggregate query.  HITs without agreement scores are ignored.  Returns
+        a tuple (alpha, kappa, pi, S).
+        
+        """
+        if hits_qs is None:
+            hits_qs = cls.objects.all()
+        
+        _averages = hits_qs.filter(agreement_kappa__isnull=False).aggregate(
+          alpha=models.Avg('agreement_alpha'),
+          kappa=models.Avg('agreement_kappa'),
+          pi=models.Avg('agreement_pi'), S=models.Avg('agreement_S'))
+        
+        return tuple(_averages[x] or 0 for x in ('alpha', 'kappa', 'pi', 'S'))
+    
+    @classmethod
+    def update_stale_agreement_scores(cls, hits_qs=None):
+        """
+        Re-computes the stale agreement scores for the given HITs QuerySet.
+        
+        Returns a tuple (updated, empty) of the number of HITs with results
+        whose scores have been re-computed and of HITs without any results,
+        which are only marked as up to date.
+        
+        """
+        if hits_qs is None:
+            hits_qs = cls.objects.all()
+        
+        _stale = hits_qs.filter(agreement_stale=True)
+        
+        updated = 0
+        for hit in _stale.filter(rankingtask__rankingresult__isnull=False) \
+          .distinct():
+            hit.update_agreement_scores()
+            updated = updated + 1
+        
+        # HITs without any results have no agreement scores.
+        empty = _stale.exclude(rankingtask__rankingresult__isnull=False) \
+          .update(agreement_stale=False)
+        
+        return (updated, empty)
+
+
+# Allocates HIT ids in batches, see HIT._create_hit_id().
+HIT_ID_ALLOCATOR = UniqueIdAllocator(HIT, 'hit_id', 8)
 
 
 class RankingTask(models.Model):
@@ -347,12 +613,32 @@ class RankingTask(models.Model):
       verbose_name="RankingTask source XML"
     )
     
+    content_hash = models.CharField(
+      max_length=40,
+      blank=True,
+      db_index=True,
+      editable=False,
+      help_text="SHA-1 hash of the extracted segment contents.",
+      verbose_name="Content hash"
+    )
+    
+    # Integer System keys in the order of the <translation> elements.
+    system_ids = models.CommaSeparatedIntegerField(
+      max_length=200,
+      blank=True,
+      editable=False,
+      verbose_name="System keys"
+    )
+    
     # These fields are derived from item_xml and NOT stored in the database.
     attributes = None
     source = None
     reference = None
     translations = None
     
+    # Indicates that item_xml has already been validated.
+    validated = False
+    
     class Meta:
         """
         Metadata options for the RankingTask object model.
@@ -365,11 +651,25 @@ class RankingTask(models.Model):
     def __init__(self, *args, **kwargs):
         """
         Makes sure that self.translations are available.
+        
+        A validated SegmentRecord can be given as segment keyword argument,
+        in which case item_xml is not parsed or validated again.
+        
         """
+        _segment = kwargs.pop('segment', None)
         super(RankingTask, self).__init__(*args, **kwargs)
         
+        if _segment is not None:
+            self.attributes = _segment.attributes
+            self.source = _segment.source
+            self.reference = _segment.reference
+            self.translations = _segment.translations
+            self.content_hash = _segment.content_hash
+            self.validated = True
+        
         # If item_xml is available, populate dynamic fields.
-        self.reload_dynamic_fields()
+        else:
+            self.reload_dynamic_fields()
     
     def __unicode__(self):
         """
@@ -383,7 +683,13 @@ class RankingTask(models.Model):
         Makes sure that validation is run before saving an object instance.
         """
         # Enforce validation before saving RankingTask objects.
-        self.full_clean()        
+        if self.validated:
+            self.full_clean(exclude=('item_xml',))
+        else:
+            self.full_clean()
+        
+        if not self.content_hash:
+            self.update_content_hash()
         
         super(RankingTask, self).save(*args, **kwargs)
     
@@ -414,6 +720,62 @@ class RankingTask(models.Model):
                 self.source = None
                 self.reference = None
                 self.translations = None
+    
+    def update_content_hash(self):
+        """
+        Sets self.content_hash from the extracted segment contents.
+        """
+        self.content_hash = compute_content_hash(self.attributes,
+          self.source, self.reference, self.translations)
+    
+    def get_system_ids(self):
+        """
+        Returns the list of integer System keys for this RankingTask.
+        """
+        if not self.system_ids:
+            return []
+        
+        return [int(x) for x in self.system_ids.split(',')]
+    
+    def get_systems(self, system_names=None):
+        """
+        Returns the list of system names for this RankingTask's translations.
+        
+        Names are looked up using the stored System keys;  for tasks created
+        before System keys have been introduced, they are parsed from XML.
+        Callers handling many tasks should pass system_names, a dict as
+        returned by System.get_system_names(), to avoid one query per task.
+        
+        """
+        _ids = self.get_system_ids()
+        if _ids:
+            _names = system_names
+            if _names is None or not all([x in _names for x in _ids]):
+                _names = System.get_system_names(_ids)
+            return [_names[x] for x in _ids]
+        
+        return self.parse_systems()
+    
+    def parse_systems(self):
+        """
+        Returns the list of system names from the HIT or segment XML.
+        """
+        # System ids can be retrieved from HIT or segment level.
+        if 'systems' in self.hit.hit_attributes.keys():
+            return self.hit.hit_attributes['systems'].split(',')
+        
+        # On segment level, we have to extract the individual "system" values
+        # from the <translation> attributes which are stored in the second
+        # position of the translation tuple: (text, attrib).
+        return [x[1]['system'] for x in self.translations]
+    
+    def update_system_ids(self):
+        """
+        Sets self.system_ids from the system names in the XML.
+        """
+        _ids = System.get_system_ids(self.hit.language_pair,
+          self.parse_systems())
+        self.system_ids = ','.join([str(x) for x in _ids])
 
 
 class RankingResult(models.Model):
@@ -440,6 +802,15 @@ class RankingResult(models.Model):
     
     raw_result = models.TextField(editable=False, blank=False)
     
+    # Results may be updated in place, hence cached datasets have to check
+    # modification times, see appraise.wmt13.analytics.database_stamp().
+    modified = models.DateTimeField(
+      auto_now=True,
+      blank=True,
+      null=True,
+      verbose_name="Last modified"
+    )
+    
     results = None
     
     class Meta:
@@ -466,9 +837,21 @@ class RankingResult(models.Model):
         """
         return u'<ranking-result id="{0}">'.format(self.id)
     
+    # pylint: disable-msg=E1002
+    def save(self, *args, **kwargs):
+        """
+        Makes sure that self.results match raw_result before saving.
+        
+        The post_save receivers, e.g. update_pairwise_judgments, rely on
+        self.results;  raw_result is usually set after object creation.
+        
+        """
+        self.reload_dynamic_fields()
+        super(RankingResult, self).save(*args, **kwargs)
+    
     def reload_dynamic_fields(self):
         """
-        Reloads source, reference, and translations from self.item_xml.
+        Reloads self.results from self.raw_result.
         """
         if self.raw_result and self.raw_result != 'SKIPPED':
             try:
@@ -478,6 +861,9 @@ class RankingResult(models.Model):
             # pylint: disable-msg=W0703
             except Exception, msg:
                 self.results = msg
+        
+        else:
+            self.results = None
     
     def export_to_xml(self):
         """
@@ -514,9 +900,12 @@ class RankingResult(models.Model):
         
         return template.render(Context(context))
     
-    def export_to_csv(self):
+    def export_to_csv(self, system_names=None):
         """
         Exports this RankingResult in CSV format.
+        
+        See RankingTask.get_systems() for system_names.
+        
         """
         item = self.item
         hit = self.item.hit
@@ -530,17 +919,7 @@ class RankingResult(models.Model):
         _src_lang = hit.hit_attributes['source-language']
         _trg_lang = hit.hit_attributes['target-language']
         
-        # System ids can be retrieved from HIT or segment level.
-        if 'systems' in hit.hit_attributes.keys():
-            _systems = hit.hit_attributes['systems'].split(',')
-        
-        # On segment level, we have to extract the individual "system" values
-        # from the <translation> attributes which are stored in the second
-        # position of the translation tuple: (text, attrib).
-        else:
-            _systems = []
-            for translation in item.translations:
-                _systems.append(translation[1]['system'])
+        _systems = item.get_systems(system_names)
         
         # Note that srcIndex and segmentId are 1-indexed for compatibility
         # with evaluation scripts from previous editions of the WMT.
@@ -571,24 +950,15 @@ class RankingResult(models.Model):
     
     
     # pylint: disable-msg=C0103
-    def export_to_apf(self):
+    def export_to_apf(self, system_names=None):
         """
         Exports this RankingResult to Artstein and Poesio (2007) format.
-        """
-        item = self.item
-        hit = self.item.hit
         
-        # System ids can be retrieved from HIT or segment level.
-        if 'systems' in hit.hit_attributes.keys():
-            _systems = hit.hit_attributes['systems'].split(',')
+        See RankingTask.get_systems() for system_names.
         
-        # On segment level, we have to extract the individual "system" values
-        # from the <translation> attributes which are stored in the second
-        # position of the translation tuple: (text, attrib).
-        else:
-            _systems = []
-            for translation in item.translations:
-                _systems.append(translation[1]['system'])
+        """
+        item = self.item
+        _systems = item.get_systems(system_names)
         
         from itertools import combinations
         results = []
@@ -610,6 +980,169 @@ class RankingResult(models.Model):
             
             results.append('{0},{1},{2}'.format(_c, _i, _v))
         return u'\n'.join(results)
+    
+    def compute_pairwise_judgments(self):
+        """
+        Returns unsaved PairwiseJudgment instances for this RankingResult.
+        
+        Skipped or invalid results do not imply any pairwise judgments.
+        
+        """
+        if not isinstance(self.results, list) or len(self.results) != 5:
+            return []
+        
+        if all([x == -1 for x in self.results]):
+            return []
+        
+        item = self.item
+        hit = self.item.hit
+        
+        _systems = item.get_system_ids()
+        if not _systems:
+            _systems = System.get_system_ids(hit.language_pair,
+              item.parse_systems())
+        
+        # Note that srcIndex is 1-indexed for compatibility with evaluation
+        # scripts from previous editions of the WMT.
+        _segment = 1 + int(item.source[1]['id'])
+        
+        from itertools import combinations
+        judgments = []
+        
+        # A lower rank is better, hence a positive outcome iff rank_a < rank_b.
+        for a, b in combinations(range(5), 2):
+            judgments.append(PairwiseJudgment(result_id=self.id,
+              language_pair=hit.language_pair, segment=_segment,
+              judge_id=self.user_id, system_a_id=_systems[a],
+              system_b_id=_systems[b],
+              outcome=cmp(self.results[b], self.results[a])))
+        
+        return judgments
+
+
+class PairwiseJudgment(models.Model):
+    """
+    Pairwise comparison of two systems, derived from a RankingResult.
+    
+    Each five-way ranking implies ten pairwise comparisons;  these are stored
+    once when the RankingResult is saved, so that win counts and agreement
+    scores can be computed using indexed queries instead of re-parsing the
+    ranking XML.  Rows are removed together with their RankingResult.
+    
+    """
+    OUTCOME_CHOICES = (
+      (1, 'better'),
+      (0, 'tie'),
+      (-1, 'worse'),
+    )
+    
+    result = models.ForeignKey(
+      RankingResult,
+      db_index=True
+    )
+    
+    language_pair = models.CharField(
+      max_length=7,
+      choices=LANGUAGE_PAIR_CHOICES,
+      db_index=True
+    )
+    
+    segment = models.IntegerField(db_index=True)
+    
+    judge = models.ForeignKey(
+      User,
+      db_index=True
+    )
+    
+    system_a = models.ForeignKey(
+      System,
+      db_index=True,
+      related_name='judgments_a'
+    )
+    
+    system_b = models.ForeignKey(
+      System,
+      db_index=True,
+      related_name='judgments_b'
+    )
+    
+    outcome = models.SmallIntegerField(choices=OUTCOME_CHOICES)
+    
+    class Meta:
+        """
+        Metadata options for the PairwiseJudgment object model.
+        """
+        ordering = ('id',)
+        verbose_name = "PairwiseJudgment object"
+        verbose_name_plural = "PairwiseJudgment objects"
+    
+    def __unicode__(self):
+        """
+        Returns a Unicode String for this PairwiseJudgment object.
+        """
+        return u'<pairwise-judgment id="{0}" result="{1}">'.format(self.id,
+          self.result_id)
+    
+    @classmethod
+    def compute_win_counts(cls, language_pair):
+        """
+        Returns a dict mapping (winner, loser) system pairs to their counts.
+        
+        Ties are not counted.  This is a single GROUP BY query on integer
+        System keys, names are joined afterwards.
+        
+        """
+        from django.db.models import Count
+        
+        _counts = cls.objects.filter(language_pair=language_pair).exclude(
+          outcome=0).order_by().values('system_a', 'system_b',
+          'outcome').annotate(count=Count('id'))
+        
+        win_counts = {}
+        for _row in _counts:
+            if _row['outcome'] > 0:
+                _key = (_row['system_a'], _row['system_b'])
+            else:
+                _key = (_row['system_b'], _row['system_a'])
+            win_counts[_key] = win_counts.get(_key, 0) + _row['count']
+        
+        _names = System.get_system_names(
+          [x for _key in win_counts.keys() for x in _key])
+        return dict(((_names[a], _names[b]), count)
+          for (a, b), count in win_counts.items())
+    
+    @classmethod
+    def compute_agreement_counts(cls, language_pair):
+        """
+        Returns inter-annotator (identical, comparable, ties, total) counts.
+        
+        Items are identified by segment and the ordered pair of system ids,
+        as in compute_agreement_scores.py;  label counts per item are fetched
+        with a single GROUP BY query.
+        
+        """
+        from django.db.models import Count
+        
+        _counts = cls.objects.filter(language_pair=language_pair).order_by(
+          ).values('segment', 'system_a', 'system_b', 'outcome').annotate(
+          count=Count('id'))
+        
+        identical = 0
+        ties = 0
+        total = 0
+        _sizes = {}
+        for _row in _counts:
+            _count = _row['count']
+            identical += _count * (_count - 1) // 2
+            total += _count
+            if _row['outcome'] == 0:
+                ties += _count
+            
+            _item = (_row['segment'], _row['system_a'], _row['system_b'])
+            _sizes[_item] = _sizes.get(_item, 0) + _count
+        
+        comparable = sum([x * (x - 1) // 2 for x in _sizes.values()])
+        return (identical, comparable, ties, total)
 
 
 @receiver(models.signals.post_save, sender=RankingResult)
@@ -644,6 +1177,27 @@ def remove_user_from_hit(sender, instance, **kwargs):
     from appraise.wmt13.views import _compute_next_task_for_user
     _compute_next_task_for_user(user, hit.language_pair)
 
+@receiver(models.signals.post_save, sender=RankingResult)
+def update_pairwise_judgments(sender, instance, created, **kwargs):
+    """
+    Materializes the pairwise judgments implied by the saved RankingResult.
+    """
+    if not created:
+        PairwiseJudgment.objects.filter(result=instance).delete()
+    
+    _judgments = instance.compute_pairwise_judgments()
+    if _judgments:
+        PairwiseJudgment.objects.bulk_create(_judgments)
+
+@receiver(models.signals.post_save, sender=RankingResult)
+@receiver(models.signals.post_delete, sender=RankingResult)
+def invalidate_hit_agreement_scores(sender, instance, **kwargs):
+    """
+    Marks the cached agreement scores of the corresponding HIT as stale.
+    """
+    HIT.objects.filter(rankingtask__id=instance.item_id).update(
+      agreement_stale=True)
+
 
 # pylint: disable-msg=E1101
 class UserHITMapping(models.Model):
@@ -672,3 +1226,102 @@ class UserHITMapping(models.Model):
         """
         return u'<hitmap id="{0}" user="{1}" hit="{2}">'.format(self.id,
           self.user.username, self.hit.hit_id)
+
+
+class LanguagePairStatus(models.Model):
+    """
+    Object model tracking the convergence of a language pair's ranking.
+    
+    The convergence monitor in appraise.wmt13.convergence compares ranking
+    clusters across checks and marks a language pair as saturated once its
+    clusters have been stable for enough checks.  Saturated language pairs
+    are only handed out if annotators have no other open language pair.
+    
+    """
+    language_pair = models.CharField(
+      max_length=7,
+      choices=LANGUAGE_PAIR_CHOICES,
+      db_index=True,
+      unique=True,
+      help_text="Language pair choice for this status instance.",
+      verbose_name="Language pair"
+    )
+    
+    saturated = models.BooleanField(
+      db_index=True,
+      default=False,
+      editable=False,
+      help_text="Indicates that ranking clusters have converged.",
+      verbose_name="Saturated?"
+    )
+    
+    override = models.NullBooleanField(
+      blank=True,
+      null=True,
+      help_text="Manually marks this language pair as saturated or open;  " \
+        "leave empty to use the convergence monitor.",
+      verbose_name="Manual override"
+    )
+    
+    clusters = models.TextField(
+      blank=True,
+      editable=False,
+      help_text="Ranking clusters found by the last check.",
+      verbose_name="Ranking clusters"
+    )
+    
+    stable_checks = models.PositiveIntegerField(
+      default=0,
+      editable=False,
+      help_text="Number of consecutive checks with unchanged clusters.",
+      verbose_name="Stable checks"
+    )
+    
+    judgments = models.PositiveIntegerField(
+      default=0,
+      editable=False,
+      help_text="Number of decided pairwise judgments at the last check.",
+      verbose_name="Judgments"
+    )
+    
+    checked = models.DateTimeField(
+      blank=True,
+      editable=False,
+      null=True,
+      verbose_name="Last checked"
+    )
+    
+    class Meta:
+        """
+        Metadata options for the LanguagePairStatus object model.
+        """
+        ordering = ('language_pair',)
+        verbose_name = "Language pair status instance"
+        verbose_name_plural = "Language pair status instances"
+    
+    def __unicode__(self):
+        """
+        Returns a Unicode String for this LanguagePairStatus object.
+        """
+        return u'<language-pair-status language-pair="{0}" ' \
+          'saturated="{1}">'.format(self.language_pair, self.is_saturated())
+    
+    def is_saturated(self):
+        """
+        Returns True if this language pair is saturated, unless overridden.
+        """
+        if self.override is not None:
+            return self.override
+        
+        return self.saturated
+    
+    is_saturated.boolean = True
+    is_saturated.short_description = "Effectively saturated?"
+    
+    @classmethod
+    def get_saturated_language_pairs(cls):
+        """
+        Returns the set of language pair codes which are saturated.
+        """
+        return set([x.language_pair for x in cls.objects.all()
+          if x.is_saturated()])
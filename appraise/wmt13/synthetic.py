@@ -0,0 +1,375 @@
+# -*- coding: utf-8 -*-
+"""
+Project: Appraise evaluation system
+ Author: Christian Federmann <cfedermann@gmail.com>
+
+Synthetic WMT13 campaigns for simulations and benchmarks.
+
+HITs are built as <hit> elements and imported using the bulk importer, so
+they pass the same validation as HITs imported from XML files.  Annotators
+are created as users in the WMT13 group and their language pair groups.
+
+For benchmarks, create_large_campaign() additionally creates the groups of
+the wmt13-groups.json fixture, users belonging to one institution and one
+language pair each, and RankingResult instances with rankings derived from
+latent system qualities.  Results are inserted as raw rows with
+pre-allocated primary keys, hence signal handlers do not run;  the
+PairwiseJudgment and HIT.users rows they would create are inserted as well.
+
+"""
+import json
+import os
+
+from datetime import time
+from random import Random
+from xml.etree.ElementTree import Element, SubElement, fromstring
+
+import numpy as np
+
+from django.contrib.auth.hashers import make_password, UNUSABLE_PASSWORD
+from django.contrib.auth.models import Group, User
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.db.models import Max
+
+from appraise.wmt13.analytics import RANKING_PAIRS
+from appraise.wmt13.importer import BalancedSystemSampler, \
+  bulk_import_hits, SEGMENTS_PER_HIT
+from appraise.wmt13.models import HIT, LANGUAGE_PAIR_CHOICES, \
+  PairwiseJudgment, RankingResult, RankingTask
+from appraise.wmt13.validators import extract_hit_record
+
+
+# Fixture defining the language pair, WMT13 and institution groups.
+WMT13_GROUPS_FIXTURE = os.path.join(os.path.dirname(__file__), 'fixtures',
+  'wmt13-groups.json')
+
+# Number of rows inserted per transaction by the bulk generators.
+SYNTHETIC_CHUNK_SIZE = 10000
+
+# Median and log-normal shape of the time annotators spend on one item.
+MEDIAN_ITEM_SECONDS = 45.0
+ITEM_SECONDS_SIGMA = 0.6
+
+# Fraction of results which annotators skip using "Flag Error".
+SKIPPED_FRACTION = 0.01
+
+
+def iter_synthetic_hit_records(language_pair, count, systems=12,
+  block_id=1, seed=None):
+    """
+    Yields count HITRecords for the given language pair.
+    
+    Each segment shows 5 of the given number of systems, chosen by a
+    BalancedSystemSampler.  Texts are short synthetic sentences.
+    
+    """
+    _source, _target = language_pair.split('2')
+    _names = ['newstest2013.{0}-{1}.system{2}'.format(_source, _target, x)
+      for x in range(systems)]
+    sampler = BalancedSystemSampler(_names, seed=seed)
+    random = Random(seed)
+    
+    for _block_id in range(block_id, block_id + count):
+        hit = Element('hit', {'block-id': unicode(_block_id),
+          'source-language': _source, 'target-language': _target})
+        
+        for index in range(SEGMENTS_PER_HIT):
+            _id = unicode(SEGMENTS_PER_HIT * (_block_id - 1) + index)
+            segment = SubElement(hit, 'seg', {'id': _id,
+              'doc-id': 'synthetic{0}'.format(_block_id)})
+            SubElement(segment, 'source', {'id': _id}).text = \
+              u'Source sentence {0}.'.format(_id)
+            SubElement(segment, 'reference').text = \
+              u'Reference translation {0}.'.format(_id)
+            for system in sampler.sample():
+                SubElement(segment, 'translation', {'system': _names[system]
+                  }).text = u'Translation {0} by system {1}, {2:.4f}.' \
+                  .format(_id, system, random.random())
+        
+        yield extract_hit_record(hit)
+
+
+def create_annotators(language_pair, count, prefix='annotator'):
+    """
+    Creates count annotators for the given language pair.
+    
+    Users are added to the WMT13 group and the language pair group, both of
+    which are created if missing.  Returns the list of users.
+    
+    """
+    _wmt13, _unused = Group.objects.get_or_create(name='WMT13')
+    _group, _unused = Group.objects.get_or_create(name=language_pair)
+    
+    users = []
+    for index in range(count):
+        user, _unused = User.objects.get_or_create(
+          username='{0}-{1}-{2}'.format(prefix, language_pair, index))
+        user.groups.add(_wmt13, _group)
+        users.append(user)
+    
+    return users
+
+
+def create_campaign(language_pairs, hits, annotators, systems=12,
+  seed=None):
+    """
+    Creates a synthetic campaign in the current database.
+    
+    For each language pair, hits HITs and annotators users are created.
+    Returns a dict mapping language pairs to their lists of users.
+    
+    """
+    users = {}
+    for index, language_pair in enumerate(language_pairs):
+        _seed = None if seed is None else seed + index
+        bulk_import_hits(iter_synthetic_hit_records(language_pair, hits,
+          systems, seed=_seed))
+        users[language_pair] = create_annotators(language_pair, annotators)
+    
+    return users
+
+
+def _allocate_ids(model, count):
+    """
+    Returns count consecutive, unused primary keys for the given model.
+    
+    Only safe if no other process inserts into the same table meanwhile.
+    Once the rows have been inserted, _reset_sequences() has to be called.
+    
+    """
+    _first = (model.objects.aggregate(Max('id'))['id__max'] or 0) + 1
+    return range(_first, _first + count)
+
+
+def _reset_sequences(*models):
+    """
+    Resets the primary key sequences of the given models to their maximum.
+    
+    Otherwise, PostgreSQL would hand out the explicitly inserted primary
+    keys again for later inserts;  SQLite and MySQL need no statements.
+    
+    """
+    _cursor = connection.cursor()
+    for statement in connection.ops.sequence_reset_sql(no_style(), models):
+        _cursor.execute(statement)
+
+
+def _insert_rows(model, columns, rows):
+    """
+    Inserts the given row tuples into the table of the given model.
+    
+    Compared to bulk_create(), this avoids creating model instances and
+    compiling SQL for each batch, which dominates for millions of rows.
+    
+    """
+    _sql = 'INSERT INTO {0} ({1}) VALUES ({2})'.format(
+      connection.ops.quote_name(model._meta.db_table),
+      ', '.join([connection.ops.quote_name(x) for x in columns]),
+      ', '.join(['%s'] * len(columns)))
+    connection.cursor().executemany(_sql, rows)
+
+
+def create_fixture_groups(path=WMT13_GROUPS_FIXTURE):
+    """
+    Creates the groups defined in the given fixture if missing.
+    
+    Returns a tuple (language_pairs, wmt13, institutions) where
+    language_pairs maps language pair codes to groups, wmt13 is the WMT13
+    group and institutions is the list of all other groups.
+    
+    """
+    with open(path) as fixture:
+        _names = [x['fields']['name'] for x in json.load(fixture)
+          if x['model'] == 'auth.group']
+    
+    _codes = set([x[0] for x in LANGUAGE_PAIR_CHOICES])
+    language_pairs = {}
+    wmt13 = None
+    institutions = []
+    for name in _names:
+        group, _unused = Group.objects.get_or_create(name=name)
+        if name in _codes:
+            language_pairs[name] = group
+        elif name == 'WMT13':
+            wmt13 = group
+        else:
+            institutions.append(group)
+    
+    return (language_pairs, wmt13, institutions)
+
+
+def create_users(language_pairs, count, prefix='user', password=None,
+  seed=None):
+    """
+    Bulk creates count users, assigned round-robin to the language pairs.
+    
+    Each user belongs to the WMT13 group, to one language pair group and to
+    one randomly chosen institution group, as in the wmt13-groups.json
+    fixture.  Without password, users cannot log in.  Returns a dict mapping
+    language pairs to lists of user primary keys.
+    
+    """
+    _groups, _wmt13, _institutions = create_fixture_groups()
+    random = Random(seed)
+    
+    # Hashing is slow by design, hence all users share the same hash.
+    _password = make_password(password) if password else UNUSABLE_PASSWORD
+    
+    users = dict((x, []) for x in language_pairs)
+    _memberships = User.groups.through
+    with transaction.commit_on_success():
+        _ids = _allocate_ids(User, count)
+        for start in range(0, count, SYNTHETIC_CHUNK_SIZE):
+            _users = []
+            _rows = []
+            for user_id in _ids[start:start + SYNTHETIC_CHUNK_SIZE]:
+                language_pair = language_pairs[user_id % len(language_pairs)]
+                _users.append(User(id=user_id, username='{0}{1}'.format(
+                  prefix, user_id), password=_password))
+                for group in (_wmt13, _groups[language_pair],
+                  random.choice(_institutions)):
+                    _rows.append(_memberships(user_id=user_id,
+                      group_id=group.id))
+                users[language_pair].append(user_id)
+            
+            User.objects.bulk_create(_users)
+            _memberships.objects.bulk_create(_rows)
+        
+        _reset_sequences(User)
+    
+    return users
+
+
+def sample_rankings(quality, system_sets, noise, random):
+    """
+    Returns an (items x 5) array of ranks for the given system sets.
+    
+    Each system is scored as its latent quality plus Gaussian noise with the
+    given per-item standard deviation;  scores closer than 0.5 to each other
+    tend to be tied.  Ranks are 1-based, lower is better, and ties share the
+    best rank of their group as in the WMT13 interface.
+    
+    """
+    _scores = quality[system_sets] + random.normal(size=system_sets.shape) \
+      * np.asarray(noise).reshape(-1, 1)
+    _bins = np.floor(_scores / 0.5)
+    return 1 + (_bins[:, np.newaxis, :] > _bins[:, :, np.newaxis]).sum(axis=2)
+
+
+def create_results(language_pair, count, users, annotators_per_hit=3,
+  quality=None, seed=None):
+    """
+    Bulk creates count RankingResult instances for the given language pair.
+    
+    Annotators, chosen from the given user primary keys, complete all items
+    of a HIT;  each HIT is completed by at most annotators_per_hit users.
+    Rankings are sampled from the latent system quality, a dict mapping
+    System keys to floats, which defaults to standard normal values.  Each
+    annotator has an individual noise level.  Returns the number of results.
+    
+    """
+    random = np.random.RandomState(seed)
+    _tasks = RankingTask.objects.filter(hit__language_pair=language_pair,
+      hit__active=True).exclude(system_ids='').order_by('hit', 'id')
+    
+    _hits = {}
+    for task_id, hit_id, system_ids, item_xml in _tasks.values_list('id',
+      'hit', 'system_ids', 'item_xml'):
+        # Note that segment is 1-indexed, see compute_pairwise_judgments().
+        _segment = 1 + int(fromstring(item_xml.encode('utf-8')).find(
+          'source').get('id'))
+        _hits.setdefault(hit_id, []).append((task_id, _segment,
+          [int(x) for x in system_ids.split(',')]))
+    
+    _assignments = [(hit_id, int(user_id)) for hit_id in _hits
+      for user_id in random.permutation(users)[:annotators_per_hit]]
+    random.shuffle(_assignments)
+    
+    if quality is None:
+        _systems = set([y for x in _hits.values() for z in x for y in z[2]])
+        quality = dict((x, random.normal()) for x in sorted(_systems))
+    
+    _quality = np.zeros(max(quality.keys()) + 1 if quality else 0)
+    _quality[quality.keys()] = quality.values()
+    _noise = dict((x, random.uniform(0.5, 2.0)) for x in users)
+    
+    created = 0
+    with transaction.commit_on_success():
+        while created < count and _assignments:
+            _chunk = []
+            _completed = []
+            while len(_chunk) < SYNTHETIC_CHUNK_SIZE and created + \
+              len(_chunk) < count and _assignments:
+                hit_id, user_id = _assignments.pop()
+                _items = _hits[hit_id][:count - created - len(_chunk)]
+                _chunk.extend([(x, user_id) for x in _items])
+                if len(_items) == len(_hits[hit_id]):
+                    _completed.append((hit_id, user_id))
+            
+            _ids = _allocate_ids(RankingResult, len(_chunk))
+            _system_sets = np.array([x[0][2] for x in _chunk])
+            _ranks = sample_rankings(_quality, _system_sets,
+              [_noise[x[1]] for x in _chunk], random)
+            _seconds = np.minimum(MEDIAN_ITEM_SECONDS * random.lognormal(0,
+              ITEM_SECONDS_SIGMA, len(_chunk)), 3599).astype(int).tolist()
+            _skipped = random.uniform(size=len(_chunk)) < SKIPPED_FRACTION
+            
+            results = []
+            judgments = []
+            for index, ((task_id, segment, systems), user_id) in \
+              enumerate(_chunk):
+                _duration = connection.ops.value_to_db_time(time(0,
+                  _seconds[index] // 60, _seconds[index] % 60))
+                if _skipped[index]:
+                    results.append((_ids[index], task_id, user_id,
+                      _duration, 'SKIPPED'))
+                    continue
+                
+                _rank = _ranks[index].tolist()
+                results.append((_ids[index], task_id, user_id, _duration,
+                  ','.join([str(x) for x in _rank])))
+                for a, b in RANKING_PAIRS.tolist():
+                    judgments.append((_ids[index], language_pair, segment,
+                      user_id, systems[a], systems[b],
+                      cmp(_rank[b], _rank[a])))
+            
+            _insert_rows(RankingResult, ('id', 'item_id', 'user_id',
+              'duration', 'raw_result'), results)
+            _insert_rows(PairwiseJudgment, ('result_id', 'language_pair',
+              'segment', 'judge_id', 'system_a_id', 'system_b_id',
+              'outcome'), judgments)
+            _insert_rows(HIT.users.through, ('hit_id', 'user_id'),
+              _completed)
+            created += len(results)
+        
+        _reset_sequences(RankingResult)
+    
+    HIT.objects.filter(id__in=_hits.keys()).update(agreement_stale=True)
+    return created
+
+
+def create_large_campaign(language_pairs, hits, users, results,
+  systems=12, seed=None):
+    """
+    Creates a synthetic campaign for benchmarks in the current database.
+    
+    For each language pair, hits HITs are imported;  users and results are
+    the total numbers of users and RankingResult instances, divided evenly
+    between language pairs.  Returns a dict mapping language pairs to lists
+    of user primary keys.
+    
+    """
+    _users = create_users(language_pairs, users, seed=seed)
+    for index, language_pair in enumerate(language_pairs):
+        _seed = None if seed is None else seed + index
+        _block_id = 1 + index * hits
+        bulk_import_hits(iter_synthetic_hit_records(language_pair, hits,
+          systems, block_id=_block_id, seed=_seed))
+        
+        _results = results // len(language_pairs) + (index < results
+          % len(language_pairs))
+        create_results(language_pair, _results, _users[language_pair],
+          seed=_seed)
+    
+    return _users
@@ -0,0 +1,1454 @@
+# -*- coding: utf-8 -*-
+"""
+Project: Appraise evaluation system
+ Author: Christian Federmann <cfedermann@gmail.com>
+"""
+import json
+import logging
+import sys
+
+from argparse import Namespace
+from datetime import time
+from io import BytesIO
+from os import close, listdir, remove, write
+from os.path import abspath, dirname, join
+from shutil import rmtree
+from subprocess import check_output
+from tempfile import mkdtemp, mkstemp
+from threading import current_thread, Event
+
+import numpy as np
+
+from django.contrib.auth.models import Group, User
+from django.core.exceptions import ValidationError
+from django.db import connection, DatabaseError
+from django.http import HttpResponse
+from django.test import TestCase
+from django.test.client import RequestFactory
+
+from appraise import logqueue, metrics, snapshots
+from appraise.benchmark_views import compare_results, measure_in_child
+from appraise.compute_agreement_scores import bootstrap_kappa, \
+  compute_kappa, compute_segment_scores, LABEL_BETTER, LABEL_TIE, \
+  LABEL_WORSE
+from appraise.profiling import get_profile_path, PROFILING_HEADER, \
+  REQUEST_LOGGER, RequestProfilingMiddleware
+from appraise.simulate_wmt13_campaign import annotate, \
+  CampaignStatistics, measure
+from appraise.snapshots import acquire_lock, get_snapshot, release_lock, \
+  set_snapshot, warm_up
+from appraise.utils import log as UTILS_LOGGER, UniqueIdAllocator
+from appraise.wmt13 import views
+from appraise.wmt13.admin import export_hit_results_agreements
+from appraise.wmt13.allocation import ALLOCATION_CACHE, \
+  compute_hit_scores, get_hit_scores, prioritize_block_ids
+from appraise.wmt13.analytics import bootstrap_rank_ranges, \
+  compute_overlapping_pairs, iter_database_rankings, load_csv, \
+  load_database, score_system_sets, write_csv
+from appraise.wmt13.importer import BalancedSystemSampler, \
+  bulk_import_hits, check_duplicates, ImportStatistics, \
+  iter_corpus_records, load_checkpoint, number_records, \
+  PairBalancedSampler, ParallelValidator, resume_after_records, \
+  save_checkpoint
+from appraise.wmt13.models import HIT, LanguagePairStatus, \
+  PairwiseJudgment, RankingResult, RankingTask, System
+from appraise.wmt13.synthetic import create_campaign, \
+  iter_synthetic_hit_records
+from appraise.wmt13.validators import iter_hits_xml_file, \
+  parse_hits_xml_file
+from appraise.wmt13.views import _compute_convergence_stats, \
+  _compute_next_task_for_user, _save_results
+
+
+class PairwiseJudgmentTests(TestCase):
+    """
+    Checks the PairwiseJudgment rows materialized for saved results.
+    """
+    def setUp(self):
+        """
+        Creates a synthetic HIT and annotator.
+        """
+        _users = create_campaign(['deu2eng'], 1, 1, seed=1)
+        self.user = _users['deu2eng'][0]
+        self.item = RankingTask.objects.all()[0]
+    
+    def _get_outcomes(self):
+        """
+        Returns the outcomes of the item's judgments by system pair.
+        """
+        _systems = self.item.get_system_ids()
+        _judgments = PairwiseJudgment.objects.filter(result__item=self.item,
+          judge=self.user)
+        return dict([((_systems.index(x.system_a_id),
+          _systems.index(x.system_b_id)), x.outcome) for x in _judgments])
+    
+    def test_created_result(self):
+        """
+        A new result creates one judgment per system pair.
+        """
+        _save_results(self.item, self.user, time(0, 1), '1,2,3,4,5')
+        
+        _outcomes = self._get_outcomes()
+        self.assertEqual(len(_outcomes), 10)
+        self.assertEqual(set(_outcomes.values()), set([1]))
+    
+    def test_updated_result(self):
+        """
+        Re-ranking an item replaces the judgments of the previous ranking.
+        """
+        _save_results(self.item, self.user, time(0, 1), '1,2,3,4,5')
+        _save_results(self.item, self.user, time(0, 2), '5,4,3,2,1')
+        
+        _outcomes = self._get_outcomes()
+        self.assertEqual(len(_outcomes), 10)
+        self.assertEqual(set(_outcomes.values()), set([-1]))
+    
+    def test_export_with_system_names(self):
+        """
+        Exports do not query system names which have been passed in.
+        """
+        _save_results(self.item, self.user, time(0, 1), '1,2,3,4,5')
+        _expected = RankingResult.objects.get().export_to_csv()
+        
+        _names = System.get_system_names()
+        _result = RankingResult.objects.select_related('item__hit',
+          'user').get()
+        with self.assertNumQueries(0):
+            self.assertEqual(_result.export_to_csv(_names), _expected)
+    
+    def test_skipped_result(self):
+        """
+        Skipping a ranked item removes its judgments.
+        """
+        _save_results(self.item, self.user, time(0, 1), '1,2,3,4,5')
+        _save_results(self.item, self.user, time(0, 2), 'SKIPPED')
+        
+        self.assertEqual(self._get_outcomes(), {})
+
+
+class LanguagePairValidationTests(TestCase):
+    """
+    Checks that HITs with unknown language pairs are never imported.
+    """
+    def setUp(self):
+        """
+        Creates the XML for one valid and one invalid HIT.
+        """
+        _record = next(iter_synthetic_hit_records('deu2eng', 1, seed=1))
+        self.valid_xml = _record.hit_xml
+        self.invalid_xml = _record.hit_xml.replace(
+          'source-language="deu"', 'source-language="xyz"')
+    
+    def test_iso_639_2_codes(self):
+        """
+        ISO-639-2 codes are mapped to their ISO-639-3 equivalents.
+        """
+        _xml = self.valid_xml.replace('source-language="deu"',
+          'source-language="ger"')
+        _records = parse_hits_xml_file(u'<hits>{0}</hits>'.format(_xml))
+        
+        bulk_import_hits(_records)
+        self.assertEqual(HIT.objects.get().language_pair, 'deu2eng')
+    
+    def test_unknown_language_pair(self):
+        """
+        An unknown language pair is reported as validation error.
+        """
+        _xml = u'<hits>{0}{1}</hits>'.format(self.valid_xml,
+          self.invalid_xml)
+        self.assertRaises(ValidationError, parse_hits_xml_file, _xml)
+        self.assertEqual(HIT.objects.count(), 0)
+
+
+class ResumeImportTests(TestCase):
+    """
+    Checks resuming an interrupted streaming import from its checkpoint.
+    """
+    def setUp(self):
+        """
+        Creates five synthetic HITs sharing the same block-id.
+        """
+        self.records = [x._replace(block_id=1) for x in
+          iter_synthetic_hit_records('deu2eng', 5, seed=1)]
+        _handle, self.checkpoint = mkstemp()
+        close(_handle)
+    
+    def tearDown(self):
+        """
+        Removes the checkpoint file.
+        """
+        remove(self.checkpoint)
+    
+    def test_interrupted_before_checkpoint(self):
+        """
+        HITs committed after the last checkpoint are not imported again.
+        """
+        def _on_commit(record):
+            """Saves the first checkpoint, fails before the second."""
+            if record.index > 1:
+                raise RuntimeError('interrupted')
+            save_checkpoint(self.checkpoint, record)
+        
+        self.assertRaises(RuntimeError, bulk_import_hits,
+          number_records(self.records), chunk_size=2, on_commit=_on_commit)
+        self.assertEqual(HIT.objects.count(), 4)
+        self.assertEqual(load_checkpoint(self.checkpoint), 2)
+        
+        statistics = ImportStatistics()
+        bulk_import_hits(resume_after_records(number_records(self.records),
+          2, statistics, chunk_size=2), chunk_size=2, statistics=statistics)
+        self.assertEqual(HIT.objects.count(), 5)
+        self.assertEqual(statistics.hits, 1)
+        self.assertEqual(statistics.duplicates, 2)
+    
+    def test_checkpoint_after_end(self):
+        """
+        A checkpoint beyond the last HIT is reported instead of ignored.
+        """
+        _records = resume_after_records(number_records(self.records), 6,
+          ImportStatistics())
+        self.assertRaises(ValueError, list, _records)
+
+
+class ImportModeTests(TestCase):
+    """
+    Checks that all import modes create the same HITs from parsed records.
+    """
+    def setUp(self):
+        """
+        Creates the XML for three synthetic HITs.
+        """
+        _records = iter_synthetic_hit_records('deu2eng', 3, seed=1)
+        self.hits_xml = u'<hits>{0}</hits>'.format(u''.join(
+          [x.hit_xml for x in _records]))
+    
+    def _get_contents(self):
+        """
+        Returns the content hashes and system keys of all imported HITs.
+        """
+        return [(x.content_hash, x.block_id, [(y.content_hash, y.system_ids)
+          for y in x.rankingtask_set.all()]) for x in HIT.objects.all()]
+    
+    def test_stream(self):
+        """
+        Streaming yields the same records as parsing the whole file.
+        """
+        _records = parse_hits_xml_file(self.hits_xml)
+        _streamed = list(iter_hits_xml_file(BytesIO(
+          self.hits_xml.encode('utf-8'))))
+        self.assertEqual(len(_streamed), 3)
+        self.assertEqual([x.content_hash for x in _streamed],
+          [x.content_hash for x in _records])
+        self.assertEqual([x.hit_xml for x in _streamed],
+          [x.hit_xml for x in _records])
+    
+    def test_bulk(self):
+        """
+        Bulk inserts create the same HITs and tasks as saving each HIT.
+        """
+        for _record in parse_hits_xml_file(self.hits_xml):
+            HIT.from_record(_record, 'deu2eng').save()
+        
+        _contents = self._get_contents()
+        self.assertEqual(len(_contents), 3)
+        HIT.objects.all().delete()
+        
+        _statistics = bulk_import_hits(parse_hits_xml_file(self.hits_xml),
+          chunk_size=2)
+        self.assertEqual((_statistics.hits, _statistics.tasks), (3, 9))
+        self.assertEqual(self._get_contents(), _contents)
+    
+    def test_dry_run(self):
+        """
+        HITs created from records are not saved until save() is called.
+        """
+        for _record in parse_hits_xml_file(self.hits_xml):
+            _hit = HIT.from_record(_record, 'deu2eng')
+            self.assertEqual(_hit.hit_attributes, _record.attributes)
+        
+        self.assertEqual(HIT.objects.count(), 0)
+        self.assertEqual(RankingTask.objects.count(), 0)
+
+
+class DuplicateDetectionTests(TestCase):
+    """
+    Checks content hashes and the detection of duplicate HITs.
+    """
+    def setUp(self):
+        """
+        Creates three synthetic HIT records.
+        """
+        self.records = list(iter_synthetic_hit_records('deu2eng', 3,
+          seed=1))
+    
+    def test_content_hash(self):
+        """
+        Neither XML formatting nor attribute order change content hashes.
+        """
+        _xml = self.records[0].hit_xml
+        _reformatted = _xml.replace('<hit block-id="1" source-language="deu"'
+          ' target-language="eng">', '<hit target-language="eng" '
+          'source-language="deu"  block-id="1">\n').replace('<seg ',
+          '\n  <seg ')
+        self.assertNotEqual(_reformatted, _xml)
+        
+        _record = parse_hits_xml_file(u'<hits>{0}</hits>'.format(
+          _reformatted))[0]
+        self.assertEqual(_record.content_hash, self.records[0].content_hash)
+    
+    def test_saved_content_hash(self):
+        """
+        HITs saved from XML get the same content hashes as their records.
+        """
+        _hit = HIT(block_id=1, hit_xml=self.records[0].hit_xml,
+          language_pair='deu2eng')
+        _hit.save()
+        self.assertEqual(_hit.content_hash, self.records[0].content_hash)
+        self.assertEqual([x.content_hash for x in _hit.rankingtask_set.all()],
+          [x.content_hash for x in self.records[0].segments])
+    
+    def test_report_duplicates(self):
+        """
+        Duplicates of imported and earlier HITs are counted, not skipped.
+        """
+        bulk_import_hits(self.records[:1])
+        
+        statistics = ImportStatistics()
+        _records = list(check_duplicates(self.records + self.records[1:2],
+          statistics, chunk_size=2))
+        self.assertEqual(len(_records), 4)
+        self.assertEqual(statistics.duplicates, 2)
+        self.assertEqual(statistics.duplicate_segments, 6)
+    
+    def test_skip_duplicates(self):
+        """
+        Duplicates of imported and earlier HITs are skipped.
+        """
+        bulk_import_hits(self.records[:1])
+        
+        statistics = ImportStatistics()
+        _records = list(check_duplicates(self.records + self.records[1:2],
+          statistics, skip=True, chunk_size=2))
+        self.assertEqual([x.content_hash for x in _records],
+          [x.content_hash for x in self.records[1:]])
+        self.assertEqual(statistics.duplicates, 2)
+
+
+class CorpusIngestTests(TestCase):
+    """
+    Checks HITs built from parallel source, reference and system files.
+    """
+    def setUp(self):
+        """
+        Creates seven-line source, reference and six system files.
+        """
+        self.corpus_dir = mkdtemp()
+        self.paths = []
+        for name in ['source', 'reference'] + ['system{0}'.format(x) for x
+          in range(6)]:
+            _path = join(self.corpus_dir, name)
+            with open(_path, 'w') as outfile:
+                for line in range(7):
+                    outfile.write('{0} {1}\n'.format(name, line))
+            self.paths.append(_path)
+    
+    def tearDown(self):
+        """
+        Removes the corpus files.
+        """
+        rmtree(self.corpus_dir)
+    
+    def test_records(self):
+        """
+        Three lines make a HIT, translations are taken from their systems.
+        """
+        _records = list(iter_corpus_records(self.paths[0], self.paths[1],
+          self.paths[2:], 'deu', 'eng', sampler=BalancedSystemSampler(
+          range(6), seed=1)))
+        self.assertEqual([x.block_id for x in _records], [1, 2])
+        
+        for index, segment in enumerate(_records[1].segments):
+            self.assertEqual(segment.source[0], u'source {0}'.format(
+              index + 3))
+            self.assertEqual(len(segment.translations), 5)
+            for text, attributes in segment.translations:
+                self.assertEqual(text, u'{0} {1}'.format(
+                  attributes['system'], index + 3))
+        
+        bulk_import_hits(_records)
+        self.assertEqual(RankingTask.objects.count(), 6)
+        self.assertEqual(System.objects.count(), 6)
+    
+    def test_invalid_files(self):
+        """
+        Files of different length and empty lines are rejected.
+        """
+        with open(self.paths[-1], 'a') as outfile:
+            outfile.write('system5 7\n')
+        
+        self.assertRaises(ValidationError, list, iter_corpus_records(
+          self.paths[0], self.paths[1], self.paths[2:], 'deu', 'eng'))
+        
+        with open(self.paths[-1], 'w') as outfile:
+            outfile.write('\n' * 7)
+        
+        self.assertRaises(ValidationError, list, iter_corpus_records(
+          self.paths[0], self.paths[1], self.paths[2:], 'deu', 'eng'))
+
+
+class SaturationTests(TestCase):
+    """
+    Checks that saturated language pairs are only handed out as fallback.
+    """
+    def setUp(self):
+        """
+        Creates an annotator knowing deu2eng and fra2eng;  deu2eng is
+        saturated.
+        """
+        _users = create_campaign(['deu2eng', 'fra2eng'], 1, 1, seed=1)
+        self.user = _users['deu2eng'][0]
+        self.user.groups.add(Group.objects.get(name='fra2eng'))
+        self.status = LanguagePairStatus.objects.create(
+          language_pair='deu2eng', saturated=True)
+    
+    def test_saturated_language_pair(self):
+        """
+        Saturated language pairs are skipped, also when given as Group.
+        """
+        for language_pair in ('deu2eng', Group.objects.get(name='deu2eng')):
+            self.assertEqual(_compute_next_task_for_user(self.user,
+              language_pair), None)
+        
+        _hit = _compute_next_task_for_user(self.user,
+          Group.objects.get(name='fra2eng'))
+        self.assertEqual(_hit.language_pair, 'fra2eng')
+    
+    def test_no_other_open_language_pair(self):
+        """
+        Saturated language pairs are used if no other HITs are left.
+        """
+        HIT.objects.filter(language_pair='fra2eng').update(active=False)
+        
+        _hit = _compute_next_task_for_user(self.user,
+          Group.objects.get(name='deu2eng'))
+        self.assertEqual(_hit.language_pair, 'deu2eng')
+    
+    def test_override(self):
+        """
+        The manual override takes precedence over the convergence monitor.
+        """
+        self.status.override = False
+        self.status.save()
+        LanguagePairStatus.objects.create(language_pair='fra2eng',
+          override=True)
+        
+        _hit = _compute_next_task_for_user(self.user,
+          Group.objects.get(name='deu2eng'))
+        self.assertEqual(_hit.language_pair, 'deu2eng')
+        self.assertEqual(_compute_next_task_for_user(self.user,
+          Group.objects.get(name='fra2eng')), None)
+    
+    def test_convergence_stats(self):
+        """
+        The status page shows the stored status without checking again.
+        """
+        with self.assertNumQueries(1):
+            _stats = dict([(x[0], x[1:]) for x in
+              _compute_convergence_stats()])
+        
+        self.assertEqual(LanguagePairStatus.objects.count(), 1)
+        self.assertEqual(_stats[u'German → English'][0], True)
+        self.assertEqual(_stats[u'French → English'][:4],
+          (False, False, 0, 0))
+
+
+class AllocationTests(TestCase):
+    """
+    Checks the uncertainty-driven HIT allocation.
+    """
+    def setUp(self):
+        """
+        Creates three synthetic HITs and clears the allocation cache.
+        """
+        create_campaign(['deu2eng'], 3, 1, seed=1)
+        ALLOCATION_CACHE.clear()
+    
+    def tearDown(self):
+        """
+        Clears the allocation cache.
+        """
+        ALLOCATION_CACHE.clear()
+    
+    def test_cache_keys(self):
+        """
+        Language pairs given as codes or groups share one cache entry.
+        """
+        _expected = prioritize_block_ids('deu2eng', [1, 2, 3])
+        self.assertEqual(prioritize_block_ids(Group.objects.get(
+          name='deu2eng'), [1, 2, 3]), _expected)
+        self.assertEqual(ALLOCATION_CACHE.keys(), [u'deu2eng'])
+    
+    def test_hit_scores(self):
+        """
+        Without judgments, all system pairs of all segments are unresolved.
+        """
+        self.assertEqual(compute_hit_scores('deu2eng'), {1: 30, 2: 30,
+          3: 30})
+    
+    def test_prioritize_block_ids(self):
+        """
+        Block-ids are sorted by score, block-ids without score come last.
+        """
+        get_hit_scores('deu2eng')[2] = 40
+        self.assertEqual(prioritize_block_ids('deu2eng', [4, 1, 2, 3]),
+          [2, 1, 3, 4])
+    
+    def test_resolved_pairs(self):
+        """
+        Only pairs of systems with overlapping rank ranges are scored.
+        """
+        _wins = np.array([[0, 90, 90, 90], [10, 0, 90, 90],
+          [10, 10, 0, 50], [10, 10, 50, 0]])
+        _lower, _upper = bootstrap_rank_ranges(_wins, seed=1)
+        self.assertEqual(_lower.tolist(), [1, 2, 3, 3])
+        self.assertEqual(_upper.tolist(), [1, 2, 4, 4])
+        
+        _pairs = compute_overlapping_pairs(_lower, _upper)
+        self.assertEqual(np.argwhere(_pairs).tolist(), [[2, 3], [3, 2]])
+        self.assertEqual(score_system_sets([[0, 1, 2, 3, 0],
+          [0, 1, 2, 0, 1]], _pairs).tolist(), [1, 0])
+
+
+class AgreementScoreTests(TestCase):
+    """
+    Checks the per-segment counts and bootstrap intervals for kappa.
+    """
+    def test_inter_annotator_scores(self):
+        """
+        Counts labels of all coders per item, as in the WMT scripts.
+        """
+        _scores = compute_segment_scores(np.array([0, 0, 0, 1, 1]),
+          np.array([0, 0, 0, 1, 1]), np.array([0, 1, 2, 0, 1]),
+          np.array([LABEL_BETTER, LABEL_BETTER, LABEL_TIE, LABEL_WORSE,
+          LABEL_WORSE]))
+        self.assertEqual(_scores.tolist(), [[1, 3, 1, 3], [1, 1, 0, 2]])
+    
+    def test_intra_annotator_scores(self):
+        """
+        Only repeated annotations of the same coder are counted.
+        """
+        _scores = compute_segment_scores(np.array([0, 0, 0]),
+          np.array([0, 0, 0]), np.array([0, 0, 1]),
+          np.array([LABEL_BETTER, LABEL_BETTER, LABEL_TIE]), intra=True)
+        self.assertEqual(_scores.tolist(), [[1, 1, 0, 2]])
+    
+    def test_bootstrap_kappa(self):
+        """
+        Intervals are reproducible for a seed and contain the estimate.
+        """
+        _random = np.random.RandomState(1)
+        _scores = _random.randint(0, 10, size=(50, 4))
+        _scores[:, 1] = _scores[:, 0] + _random.randint(1, 10, size=50)
+        _scores[:, 3] = _scores[:, 2] + _random.randint(1, 10, size=50)
+        
+        _kappa = compute_kappa(_scores.sum(axis=0))[2]
+        _lower, _upper = bootstrap_kappa(_scores, 200, 0.95, seed=1)
+        self.assertTrue(_lower < _kappa < _upper)
+        self.assertEqual(bootstrap_kappa(_scores, 200, 0.95, seed=1),
+          (_lower, _upper))
+        
+        _scores[:] = _scores[0]
+        _lower, _upper = bootstrap_kappa(_scores, 200, 0.95, seed=1)
+        self.assertAlmostEqual(_lower, compute_kappa(_scores[0])[2])
+        self.assertAlmostEqual(_upper, _lower)
+
+
+class AgreementCacheTests(TestCase):
+    """
+    Checks the agreement scores cached with HIT instances.
+    """
+    def setUp(self):
+        """
+        Creates two synthetic HITs, the first one annotated by two users.
+        """
+        self.users = create_campaign(['deu2eng'], 2, 2, seed=1)['deu2eng']
+        self.hit = HIT.objects.get(block_id=1)
+        self.items = list(RankingTask.objects.filter(hit=self.hit))
+        for user, rankings in zip(self.users, (('1,2,3,4,5', '1,1,2,2,3',
+          '5,4,3,2,1'), ('1,2,3,4,5', '2,1,2,3,3', '5,4,3,2,1'))):
+            for item, raw_result in zip(self.items, rankings):
+                _save_results(item, user, time(0, 1), raw_result)
+    
+    def _get_hit(self):
+        """
+        Returns the annotated HIT, reloaded from the database.
+        """
+        return HIT.objects.get(id=self.hit.id)
+    
+    def test_stale_scores(self):
+        """
+        Saving or deleting results marks the scores of their HIT as stale.
+        """
+        HIT.update_stale_agreement_scores()
+        self.assertFalse(self._get_hit().agreement_stale)
+        
+        _save_results(self.items[0], self.users[1], time(0, 2), '5,4,3,2,1')
+        self.assertTrue(self._get_hit().agreement_stale)
+        
+        HIT.update_stale_agreement_scores()
+        RankingResult.objects.filter(user=self.users[1]).delete()
+        self.assertTrue(self._get_hit().agreement_stale)
+    
+    def test_update_stale_scores(self):
+        """
+        Stale scores are re-computed, HITs without results are only marked.
+        """
+        self.assertEqual(HIT.update_stale_agreement_scores(), (1, 1))
+        self.assertEqual(HIT.update_stale_agreement_scores(), (0, 0))
+        
+        _hit = self._get_hit()
+        self.assertFalse(_hit.agreement_stale)
+        self.assertNotEqual(_hit.agreement_kappa, None)
+        with self.assertNumQueries(0):
+            _cached = _hit.get_agreement_scores()
+        self.assertEqual(_cached, _hit.compute_agreement_scores())
+    
+    def test_get_stale_scores(self):
+        """
+        Stale scores of a single HIT are re-computed on read.
+        """
+        _scores = self._get_hit().get_agreement_scores()
+        self.assertNotEqual(_scores, None)
+        self.assertFalse(self._get_hit().agreement_stale)
+        
+        RankingResult.objects.filter(user=self.users[1]).delete()
+        self.assertEqual(self._get_hit().get_agreement_scores(), None)
+    
+    def test_average_scores(self):
+        """
+        Averages only use cached scores.
+        """
+        with self.assertNumQueries(1):
+            self.assertEqual(HIT.compute_average_agreement_scores(),
+              (0, 0, 0, 0))
+        
+        HIT.update_stale_agreement_scores()
+        self.assertEqual(HIT.compute_average_agreement_scores(),
+          self._get_hit().get_agreement_scores())
+    
+    def test_export(self):
+        """
+        The admin export reports stale scores instead of re-computing them.
+        """
+        class _ModelAdmin(object):
+            """Keeps the messages for the user."""
+            messages = []
+            def message_user(self, request, message):
+                """Keeps the given message."""
+                self.messages.append(message)
+        
+        _admin = _ModelAdmin()
+        _response = export_hit_results_agreements(_admin, None,
+          HIT.objects.all())
+        self.assertEqual(_response.content, '0,0,0,0')
+        self.assertTrue(self._get_hit().agreement_stale)
+        self.assertEqual(len(_admin.messages), 1)
+
+
+class SamplerTests(TestCase):
+    """
+    Checks the balance guarantees of the system samplers.
+    """
+    def setUp(self):
+        """
+        Creates twelve system names.
+        """
+        self.systems = ['system{0}'.format(x) for x in range(12)]
+    
+    def _get_pair_counts(self, sampler):
+        """
+        Returns the counts of all pairs of different systems.
+        """
+        return sampler.pair_counts[~np.eye(len(self.systems), dtype=bool)]
+    
+    def test_balanced_system_sampler(self):
+        """
+        System counts differ by at most one.
+        """
+        sampler = BalancedSystemSampler(self.systems, seed=1)
+        for _ in range(31):
+            self.assertEqual(len(set(sampler.sample())), 5)
+            self.assertTrue(max(sampler.counts) - min(sampler.counts) <= 1)
+    
+    def test_consumed_segments(self):
+        """
+        Only segments which have been returned are counted.
+        """
+        sampler = PairBalancedSampler(self.systems, seed=1)
+        for _ in range(31):
+            self.assertEqual(len(set(sampler.sample())), 5)
+        
+        self.assertEqual(sampler.counts.sum(), 31 * 5)
+        self.assertEqual(sampler.pair_counts.sum(), 31 * 5 * 4)
+        self.assertEqual(np.diag(sampler.pair_counts).sum(), 0)
+    
+    def test_balanced_pairs(self):
+        """
+        All system pairs are compared about equally often.
+        """
+        for batch_size in (7, 1000):
+            sampler = PairBalancedSampler(self.systems, seed=1,
+              batch_size=batch_size)
+            for _ in range(5000):
+                sampler.sample()
+            
+            _counts = self._get_pair_counts(sampler)
+            self.assertTrue(_counts.max() < 1.1 * _counts.mean())
+            self.assertTrue(_counts.min() > 0.9 * _counts.mean())
+    
+    def test_weighted_pairs(self):
+        """
+        System pairs with larger weights are compared more often.
+        """
+        weights = np.ones((12, 12))
+        weights[0, 1] = weights[1, 0] = 4
+        sampler = PairBalancedSampler(self.systems, weights=weights, seed=1)
+        sampler.sample_batch(5000)
+        
+        _counts = self._get_pair_counts(sampler)
+        self.assertTrue(sampler.pair_counts[0, 1] > 1.5 * _counts.mean())
+
+
+class AnalyticsLoaderTests(TestCase):
+    """
+    Checks that CSV exports and the database load the same judgements.
+    """
+    def setUp(self):
+        """
+        Creates results for all tasks of a synthetic HIT, one is skipped.
+        """
+        _users = create_campaign(['deu2eng'], 1, 1, seed=1)
+        _user = _users['deu2eng'][0]
+        for item, raw_result in zip(RankingTask.objects.all(),
+          ('1,2,3,4,5', '2,2,1,5,3', 'SKIPPED')):
+            _save_results(item, _user, time(0, 1), raw_result)
+        
+        self.cache_dir = mkdtemp()
+    
+    def tearDown(self):
+        """
+        Removes the cache directory.
+        """
+        rmtree(self.cache_dir)
+    
+    def _decode(self, dataset):
+        """
+        Returns the set of decoded rows of the given dataset.
+        """
+        _codebook = dataset.codebook
+        return set([(_codebook.language_pairs[dataset.language_pair[x]],
+          dataset.segment[x], _codebook.judges[dataset.judge[x]],
+          _codebook.systems[dataset.system_a[x]],
+          _codebook.systems[dataset.system_b[x]], dataset.outcome[x])
+          for x in range(len(dataset))])
+    
+    def test_csv_export(self):
+        """
+        Exported database results load as the same judgements.
+        """
+        _path = join(self.cache_dir, 'results.csv')
+        with open(_path, 'w') as csv_file:
+            write_csv(iter_database_rankings(), csv_file)
+        
+        _rows = self._decode(load_database())
+        self.assertEqual(len(_rows), 20)
+        for _ in range(2):
+            with open(_path) as csv_file:
+                _dataset = load_csv(csv_file, cache_dir=self.cache_dir)
+                self.assertEqual(self._decode(_dataset), _rows)
+        
+        self.assertTrue(isinstance(_dataset.outcome, np.memmap))
+
+
+class CampaignSimulationTests(TestCase):
+    """
+    Checks the simulated annotators of simulate_wmt13_campaign.py.
+    """
+    def setUp(self):
+        """
+        Creates a synthetic campaign with two HITs and one annotator.
+        """
+        _users = create_campaign(['deu2eng'], 2, 1, seed=1)
+        self.user = _users['deu2eng'][0]
+        self.statistics = CampaignStatistics()
+        self.use_debug_cursor = connection.use_debug_cursor
+    
+    def tearDown(self):
+        """
+        Restores the debug cursor setting changed by annotate().
+        """
+        connection.use_debug_cursor = self.use_debug_cursor
+    
+    def test_annotate(self):
+        """
+        An annotator ranks all items of all HITs, each operation is measured.
+        """
+        _args = Namespace(max_hits=None, median_seconds=60, sigma=0.5,
+          time_scale=0)
+        annotate(self.user, 'deu2eng', _args, self.statistics, 1)
+        
+        self.assertEqual((self.statistics.hits, self.statistics.items),
+          (2, 6))
+        self.assertEqual(RankingResult.objects.count(), 6)
+        self.assertEqual(len(self.statistics.latencies['save']), 6)
+        self.assertEqual(len(self.statistics.queries['assign']), 3)
+        self.assertEqual(self.statistics.lock_errors, 0)
+    
+    def test_locked_database(self):
+        """
+        Operations are retried while the database is locked.
+        """
+        _errors = []
+        def _operation():
+            """Fails for the first two calls."""
+            if len(_errors) < 2:
+                _errors.append(1)
+                raise DatabaseError('database is locked')
+            return 'done'
+        
+        self.assertEqual(measure(self.statistics, 'save', _operation),
+          'done')
+        self.assertEqual(self.statistics.lock_errors, 2)
+        self.assertTrue(self.statistics.lock_wait > 0)
+        
+        def _failing_operation():
+            """Fails with another database error."""
+            raise DatabaseError('no such table')
+        
+        self.assertRaises(DatabaseError, measure, self.statistics, 'save',
+          _failing_operation)
+
+
+class DatabaseCacheTests(TestCase):
+    """
+    Checks the on-disk cache of datasets loaded from the database.
+    """
+    def setUp(self):
+        """
+        Creates a synthetic HIT with one result and a cache directory.
+        """
+        _users = create_campaign(['deu2eng'], 1, 1, seed=1)
+        self.user = _users['deu2eng'][0]
+        self.item = RankingTask.objects.all()[0]
+        _save_results(self.item, self.user, time(0, 1), '1,2,3,4,5')
+        self.cache_dir = mkdtemp()
+    
+    def tearDown(self):
+        """
+        Removes the cache directory.
+        """
+        rmtree(self.cache_dir)
+    
+    def test_unchanged_results(self):
+        """
+        Cached datasets are used while results do not change.
+        """
+        _dataset = load_database(cache_dir=self.cache_dir)
+        self.assertFalse(isinstance(_dataset.outcome, np.memmap))
+        
+        _dataset = load_database(cache_dir=self.cache_dir)
+        self.assertTrue(isinstance(_dataset.outcome, np.memmap))
+        self.assertEqual(_dataset.outcome.sum(), 10)
+    
+    def test_updated_result(self):
+        """
+        Results updated in place invalidate the cached dataset.
+        """
+        load_database(cache_dir=self.cache_dir)
+        _save_results(self.item, self.user, time(0, 2), '5,4,3,2,1')
+        
+        _dataset = load_database(cache_dir=self.cache_dir)
+        self.assertEqual(len(_dataset), 10)
+        self.assertEqual(_dataset.outcome.sum(), -10)
+    
+    def test_materialized(self):
+        """
+        Materialized and expanded datasets are cached separately.
+        """
+        PairwiseJudgment.objects.all().delete()
+        self.assertEqual(len(load_database(cache_dir=self.cache_dir)), 10)
+        self.assertEqual(len(load_database(cache_dir=self.cache_dir,
+          materialized=True)), 0)
+        self.assertEqual(sorted(listdir(self.cache_dir)), ['database',
+          'database-materialized'])
+
+
+class StreamValidationTests(TestCase):
+    """
+    Checks that invalid HITs only stop the import of their own file.
+    """
+    def setUp(self):
+        """
+        Creates a file with an invalid third HIT and a valid file.
+        """
+        _records = list(iter_synthetic_hit_records('deu2eng', 7, seed=1))
+        _hits = [x.hit_xml for x in _records]
+        _hits[2] = _hits[2].replace('source-language="deu"',
+          'source-language="xyz"')
+        
+        self.paths = []
+        for _xml in (u''.join(_hits[:4]), u''.join(_hits[4:])):
+            _handle, _path = mkstemp(suffix='.xml')
+            write(_handle, u'<hits>{0}</hits>'.format(_xml).encode('utf-8'))
+            close(_handle)
+            self.paths.append(_path)
+    
+    def tearDown(self):
+        """
+        Removes the XML files.
+        """
+        for path in self.paths:
+            remove(path)
+    
+    def _consume(self, records):
+        """
+        Returns the number of records before the first ValidationError.
+        """
+        count = 0
+        try:
+            for _record in records:
+                count += 1
+        
+        except ValidationError:
+            return (count, True)
+        
+        return (count, False)
+    
+    def test_stream(self):
+        """
+        Streamed files yield all HITs before the invalid HIT.
+        """
+        self.assertEqual(self._consume(iter_hits_xml_file(self.paths[0])),
+          (2, True))
+        self.assertEqual(self._consume(iter_hits_xml_file(self.paths[1])),
+          (3, False))
+    
+    def test_parallel(self):
+        """
+        HITs after the invalid HIT are skipped, the next file is validated.
+        """
+        validator = ParallelValidator(self.paths, 2, fragment_size=1)
+        try:
+            self.assertEqual(self._consume(validator.iter_records(0)),
+              (2, True))
+            self.assertEqual(self._consume(validator.iter_records(1)),
+              (3, False))
+        
+        finally:
+            validator.close()
+
+
+class SnapshotTests(TestCase):
+    """
+    Checks cache snapshots shared by all processes.
+    """
+    def setUp(self):
+        """
+        Uses a temporary snapshot directory.
+        """
+        self.snapshot_root = snapshots.SNAPSHOT_ROOT
+        snapshots.SNAPSHOT_ROOT = mkdtemp()
+    
+    def tearDown(self):
+        """
+        Restores the snapshot directory and clears the status cache.
+        """
+        rmtree(snapshots.SNAPSHOT_ROOT)
+        snapshots.SNAPSHOT_ROOT = self.snapshot_root
+        views.STATUS_CACHE.clear()
+        views.STATUS_CREATED.clear()
+    
+    def test_snapshots(self):
+        """
+        Snapshots are returned with their creation time until they expire.
+        """
+        self.assertEqual(get_snapshot('wmt13.test'), None)
+        _created = set_snapshot('wmt13.test', {'deu2eng': [1, 2]})
+        self.assertEqual(get_snapshot('wmt13.test'), (_created,
+          {'deu2eng': [1, 2]}))
+        self.assertEqual(get_snapshot('wmt13.test', max_age=-1), None)
+    
+    def test_locks(self):
+        """
+        Locks are exclusive until released or abandoned.
+        """
+        self.assertTrue(acquire_lock('wmt13.test'))
+        self.assertFalse(acquire_lock('wmt13.test'))
+        self.assertTrue(acquire_lock('wmt13.test', timeout=-1))
+        
+        release_lock('wmt13.test')
+        self.assertTrue(acquire_lock('wmt13.test'))
+    
+    def test_warm_up(self):
+        """
+        Status data computed by warm_up() is loaded by other processes.
+        """
+        create_campaign(['deu2eng'], 2, 1, seed=1)
+        self.assertEqual(warm_up(rankings=False, tasks=False),
+          {'status': 5, 'rankings': 0, 'tasks': 0})
+        
+        _status = dict(views.STATUS_CACHE)
+        views.STATUS_CACHE.clear()
+        views.STATUS_CREATED.clear()
+        for status_key in _status:
+            self.assertTrue(views._load_status_snapshot(status_key, None))
+        self.assertEqual(views.STATUS_CACHE, _status)
+
+
+class StatusCacheTests(TestCase):
+    """
+    Checks that stale status data is served while it is refreshed.
+    """
+    def setUp(self):
+        """
+        Uses a temporary snapshot directory and a blocking global_stats.
+        """
+        self.snapshot_root = snapshots.SNAPSHOT_ROOT
+        snapshots.SNAPSHOT_ROOT = mkdtemp()
+        
+        self.computed = Event()
+        self.calls = []
+        self.compute_global_stats = views._compute_global_stats
+        views._compute_global_stats = self._compute_global_stats
+        
+        views.STATUS_CACHE['global_stats'] = 'stale'
+        views.STATUS_CREATED['global_stats'] = 0
+    
+    def tearDown(self):
+        """
+        Restores the snapshot directory, global_stats and the status cache.
+        """
+        rmtree(snapshots.SNAPSHOT_ROOT)
+        snapshots.SNAPSHOT_ROOT = self.snapshot_root
+        views._compute_global_stats = self.compute_global_stats
+        views.STATUS_CACHE.clear()
+        views.STATUS_CREATED.clear()
+    
+    def _compute_global_stats(self):
+        """
+        Returns fresh global stats once self.computed is set.
+        """
+        self.calls.append(current_thread())
+        self.computed.wait(10)
+        return 'fresh'
+    
+    def test_stale_while_revalidate(self):
+        """
+        Stale data is kept until the single refresh thread has finished.
+        """
+        _thread = views._start_status_refresh('global_stats')
+        self.assertTrue(views._start_status_refresh('global_stats') is
+          _thread)
+        self.assertEqual(views.STATUS_CACHE['global_stats'], 'stale')
+        
+        self.computed.set()
+        _thread.join(10)
+        self.assertEqual(self.calls, [_thread])
+        self.assertEqual(views.STATUS_CACHE['global_stats'], 'fresh')
+        self.assertEqual(views.STATUS_REFRESHES, {})
+        self.assertEqual(get_snapshot('wmt13.status.global_stats'),
+          (views.STATUS_CREATED['global_stats'], 'fresh'))
+    
+    def test_snapshot_of_other_process(self):
+        """
+        A refresh running in another process is waited for, not repeated.
+        """
+        self.assertTrue(acquire_lock('wmt13.status.global_stats'))
+        _thread = views._start_status_refresh('global_stats')
+        set_snapshot('wmt13.status.global_stats', 'other')
+        release_lock('wmt13.status.global_stats')
+        
+        _thread.join(10)
+        self.assertEqual(self.calls, [])
+        self.assertEqual(views.STATUS_CACHE['global_stats'], 'other')
+    
+    def test_older_snapshot(self):
+        """
+        Snapshots older than the cached data are not loaded.
+        """
+        _created = set_snapshot('wmt13.status.global_stats', 'older')
+        views.STATUS_CREATED['global_stats'] = _created + 1
+        self.assertFalse(views._load_status_snapshot('global_stats', None))
+        self.assertEqual(views.STATUS_CACHE['global_stats'], 'stale')
+
+
+class ViewBenchmarkTests(TestCase):
+    """
+    Checks the regression report and child processes of benchmark_views.py.
+    """
+    def setUp(self):
+        """
+        Creates baseline measurements for two views.
+        """
+        self.baseline = {'100': {
+          'wmt13.status': {'status': 200, 'queries': 20, 'seconds': 0.1,
+            'memory_kb': 2048},
+          'wmt13.overview': {'status': 200, 'queries': 10, 'seconds': 0.05,
+            'memory_kb': 0},
+        }}
+    
+    def test_no_regressions(self):
+        """
+        Changes below the tolerances or minimum differences are ignored.
+        """
+        _current = {'100': {
+          'wmt13.status': {'status': 200, 'queries': 22, 'seconds': 0.11,
+            'memory_kb': 2200},
+          'wmt13.overview': {'status': 200, 'queries': 10, 'seconds': 0.054,
+            'memory_kb': 1000},
+        }, '1000': {}}
+        self.assertEqual(compare_results(self.baseline, _current, 0.2), [])
+    
+    def test_regressions(self):
+        """
+        Increased queries, time and errors are reported per view and size.
+        """
+        _current = {'100': {
+          'wmt13.status': {'status': 200, 'queries': 23, 'seconds': 0.2,
+            'memory_kb': 2048},
+          'wmt13.overview': {'error': 'OperationalError: locked'},
+        }}
+        self.assertEqual(compare_results(self.baseline, _current, 0.2), [
+          u'wmt13.overview at size 100: OperationalError: locked',
+          u'wmt13.status at size 100: queries increased from 20 to 23',
+          u'wmt13.status at size 100: seconds increased from 0.1 to 0.2'])
+        self.assertEqual(compare_results(self.baseline, _current, 0.2,
+          views=['wmt13.status'])[0], u'wmt13.status at size 100: queries ' \
+          'increased from 20 to 23')
+    
+    def test_measure_in_child(self):
+        """
+        Results and errors of child processes are returned as dicts.
+        """
+        self.assertEqual(measure_in_child(dict, [('queries', 1)]),
+          {'queries': 1})
+        self.assertEqual(measure_in_child(int, 'x'), {'error':
+          u"ValueError: invalid literal for int() with base 10: 'x'"})
+
+
+class WorkerStartupTests(TestCase):
+    """
+    Checks that workers boot without loading NumPy or NLTK.
+    """
+    def test_worker_boot(self):
+        """
+        Middleware, URLconf and views are loaded without slow imports.
+        """
+        _output = check_output([sys.executable, 'benchmark_startup.py',
+          '--boot-worker'], cwd=dirname(dirname(abspath(__file__))))
+        _modules = [x[0] for x in json.loads(_output.strip().split('\n')[-1])]
+        
+        self.assertTrue('appraise.wmt13.views' in _modules)
+        for module in ('numpy', 'nltk'):
+            self.assertFalse(module in _modules, module)
+
+
+class _RecordingHandler(logging.Handler):
+    """
+    Keeps the messages of all emitted log records.
+    """
+    def __init__(self):
+        """
+        Creates an empty list of messages.
+        """
+        logging.Handler.__init__(self)
+        self.messages = []
+    
+    def emit(self, record):
+        """
+        Keeps the message of the given record.
+        """
+        self.messages.append(record.getMessage())
+
+
+class UniqueIdAllocatorTests(TestCase):
+    """
+    Checks the ids, reserve and collision counts of UniqueIdAllocator.
+    """
+    def setUp(self):
+        """
+        Creates 15 HITs using all one-digit HIT ids but 'f'.
+        """
+        bulk_import_hits(iter_synthetic_hit_records('deu2eng', 15, seed=1))
+        for hit_id, hit in zip('0123456789abcde', HIT.objects.all()):
+            HIT.objects.filter(pk=hit.pk).update(hit_id=hit_id)
+        
+        self.handler = _RecordingHandler()
+        UTILS_LOGGER.addHandler(self.handler)
+    
+    def tearDown(self):
+        """
+        Stops capturing the log.
+        """
+        UTILS_LOGGER.removeHandler(self.handler)
+    
+    def test_collisions(self):
+        """
+        Used ids are never allocated, collisions are counted and reported.
+        """
+        allocator = UniqueIdAllocator(HIT, 'hit_id', 1)
+        for _ in range(5):
+            self.assertEqual(allocator.allocate(1), ['f'])
+        
+        self.assertEqual(allocator.candidates - allocator.collisions, 5)
+        self.assertEqual(allocator.collision_rate(),
+          allocator.collisions / float(allocator.candidates))
+        self.assertEqual(bool(self.handler.messages),
+          allocator.collisions > 0)
+    
+    def test_reserve(self):
+        """
+        Single ids are taken from a reserve refilled with one query.
+        """
+        allocator = UniqueIdAllocator(HIT, 'hit_id', 8, batch_size=5)
+        with self.assertNumQueries(1):
+            _ids = [allocator.next_id() for _ in range(5)]
+        
+        with self.assertNumQueries(1):
+            _ids.append(allocator.next_id())
+        
+        self.assertEqual(len(set(_ids)), 6)
+        self.assertEqual(HIT.objects.filter(hit_id__in=_ids).count(), 0)
+        self.assertEqual(allocator.candidates, 10)
+
+
+class MetricsTests(TestCase):
+    """
+    Checks that metrics of all processes are summed and rendered.
+    """
+    def setUp(self):
+        """
+        Uses a temporary metrics directory and new values for this process.
+        """
+        self.metrics_root = metrics.METRICS_ROOT
+        self.state = dict(metrics._STATE)
+        metrics.METRICS_ROOT = mkdtemp()
+        metrics._STATE['pid'] = None
+    
+    def tearDown(self):
+        """
+        Restores the metrics directory and values of this process.
+        """
+        if metrics._STATE['timer'] is not None:
+            metrics._STATE['timer'].cancel()
+        
+        rmtree(metrics.METRICS_ROOT)
+        metrics.METRICS_ROOT = self.metrics_root
+        metrics._STATE.update(self.state)
+    
+    def test_render_metrics(self):
+        """
+        Counters and histograms include the files of other processes.
+        """
+        with open(join(metrics.METRICS_ROOT, 'metrics-1-0.json'), 'w') \
+          as metrics_file:
+            json.dump([['appraise_results_saved_total', [], 5]],
+              metrics_file)
+        
+        metrics.increment('appraise_results_saved_total')
+        metrics.increment('appraise_results_saved_total')
+        metrics.increment('appraise_cache_requests_total', cache='status',
+          result='hit')
+        metrics.observe('appraise_status_refresh_seconds', 0.02,
+          key='global_stats')
+        metrics.observe('appraise_status_refresh_seconds', 3.0,
+          key='global_stats')
+        
+        _lines = metrics.render_metrics().split(u'\n')
+        for line in (u'appraise_results_saved_total 7',
+          u'appraise_cache_requests_total{cache="status",result="hit"} 1',
+          u'appraise_status_refresh_seconds_bucket{key="global_stats",'
+          u'le="0.01"} 0',
+          u'appraise_status_refresh_seconds_bucket{key="global_stats",'
+          u'le="0.025"} 1',
+          u'appraise_status_refresh_seconds_bucket{key="global_stats",'
+          u'le="+Inf"} 2',
+          u'appraise_status_refresh_seconds_sum{key="global_stats"} 3.02',
+          u'appraise_status_refresh_seconds_count{key="global_stats"} 2'):
+            self.assertTrue(line in _lines, line)
+    
+    def test_timed(self):
+        """
+        Decorated functions keep their name and observe each call.
+        """
+        @metrics.timed('appraise_result_submission_seconds')
+        def _save():
+            """Returns a result."""
+            return 'saved'
+        
+        self.assertEqual((_save(), _save.__name__), ('saved', '_save'))
+        _value = metrics.collect()[('appraise_result_submission_seconds',
+          ())]
+        self.assertEqual(sum(_value[:-1]), 1)
+
+
+class _BlockingHandler(_RecordingHandler):
+    """
+    Keeps messages, blocking on the first one until it is released.
+    """
+    def __init__(self):
+        """
+        Creates events signalling and releasing the first message.
+        """
+        _RecordingHandler.__init__(self)
+        self.blocked = Event()
+        self.released = Event()
+    
+    def emit(self, record):
+        """
+        Keeps the message, waits for release if it is the first one.
+        """
+        _RecordingHandler.emit(self, record)
+        if len(self.messages) == 1:
+            self.blocked.set()
+            self.released.wait(10)
+
+
+class LogQueueTests(TestCase):
+    """
+    Checks logging through the background writer thread.
+    """
+    def setUp(self):
+        """
+        Creates a logger writing to a recording handler through the queue.
+        """
+        logqueue.stop()
+        self.queue_size = logqueue.LOG_QUEUE_SIZE
+        self.target = _BlockingHandler()
+        self.target.released.set()
+        self.logger = logging.getLogger('appraise.tests.logqueue')
+        self.logger.propagate = False
+        self.handler = logqueue.QueueHandler(self.target)
+        self.logger.addHandler(self.handler)
+    
+    def tearDown(self):
+        """
+        Stops the writer thread and removes the handler.
+        """
+        self.target.released.set()
+        logqueue.stop()
+        logqueue.LOG_QUEUE_SIZE = self.queue_size
+        self.logger.removeHandler(self.handler)
+    
+    def test_lazy_messages(self):
+        """
+        Messages are formatted when written, also after a restart.
+        """
+        _rows = [(u'deu2eng', 3)]
+        self.logger.warning(logqueue.LazyMessage(u'{0} {1}', u'Ranked',
+          logqueue.LazyLines(_rows)))
+        _rows.append((u'fra2eng', 4))
+        logqueue.stop()
+        
+        self.logger.warning(logqueue.LazyMessage(u'{0}', 'Restarted'))
+        logqueue.stop()
+        self.assertEqual(self.target.messages, [u'Ranked deu2eng: 3',
+          u'Restarted'])
+    
+    def test_full_queue(self):
+        """
+        Records are dropped instead of blocking if the queue is full.
+        """
+        logqueue.LOG_QUEUE_SIZE = 1
+        self.target.released.clear()
+        self.logger.warning('first')
+        self.assertTrue(self.target.blocked.wait(10))
+        
+        self.logger.warning('second')
+        self.logger.warning('third')
+        self.target.released.set()
+        logqueue.stop()
+        self.assertEqual(self.target.messages, ['first',
+          'Dropped 1 log records, the queue was full.', 'second'])
+    
+    def test_sampling_filter(self):
+        """
+        Records below WARNING are sampled by the closest logger's rate.
+        """
+        _filter = logqueue.SamplingFilter({'appraise.wmt13': 0.0,
+          'appraise.wmt13.views': 1.0})
+        for name, level, expected in (
+          ('appraise.wmt13.models', logging.INFO, False),
+          ('appraise.wmt13.models', logging.WARNING, True),
+          ('appraise.wmt13.views.status', logging.DEBUG, True),
+          ('appraise.metrics', logging.DEBUG, True)):
+            _record = logging.LogRecord(name, level, __file__, 0, 'message',
+              None, None)
+            self.assertEqual(_filter.filter(_record), expected)
+
+
+class RequestProfilingTests(TestCase):
+    """
+    Checks the query statistics of RequestProfilingMiddleware.
+    """
+    def setUp(self):
+        """
+        Captures the request log.
+        """
+        self.handler = _RecordingHandler()
+        REQUEST_LOGGER.addHandler(self.handler)
+        self.middleware = RequestProfilingMiddleware()
+    
+    def tearDown(self):
+        """
+        Stops capturing the request log.
+        """
+        REQUEST_LOGGER.removeHandler(self.handler)
+    
+    def _process(self, request):
+        """
+        Processes the given request running two queries in its view.
+        
+        Returns the request record and the number of recorded queries.
+        
+        """
+        def _view(request):
+            """Runs two queries."""
+            list(User.objects.all())
+            list(Group.objects.all())
+        
+        self.middleware.process_request(request)
+        _queries = len(connection.queries)
+        self.middleware.process_view(request, _view, (), {})
+        _view(request)
+        self.middleware.process_response(request, HttpResponse())
+        return (json.loads(self.handler.messages[-1]),
+          len(connection.queries) - _queries)
+    
+    def test_counted_queries(self):
+        """
+        Queries of requests which are not profiled are only counted.
+        """
+        _request = RequestFactory().get('/appraise/')
+        _record, _recorded = self._process(_request)
+        self.assertEqual(_record['queries'], 2)
+        self.assertEqual(_recorded, 0)
+        self.assertFalse('profile' in _record)
+    
+    def test_profiled_queries(self):
+        """
+        Queries of profiled requests are recorded and stored.
+        """
+        _request = RequestFactory().get('/appraise/',
+          **{PROFILING_HEADER: '1'})
+        _request.user = User(username='staff', is_staff=True)
+        _record, _recorded = self._process(_request)
+        self.assertEqual(_record['queries'], 2)
+        self.assertEqual(_recorded, 2)
+        
+        _path = get_profile_path(_record['profile'], 'json')
+        with open(_path) as json_file:
+            self.assertEqual(len(json.load(json_file)['queries']), 2)
+        
+        remove(_path)
+        remove(get_profile_path(_record['profile'], 'prof'))
@@ -5,7 +5,11 @@ Project: Appraise evaluation system
 """
 import logging
 
-from xml.etree.ElementTree import Element, fromstring, ParseError
+from collections import namedtuple
+from hashlib import sha1
+from json import dumps
+from xml.etree.ElementTree import Element, fromstring, iterparse, \
+  ParseError, tostring
 
 from django.core.exceptions import ValidationError
 
@@ -21,6 +25,44 @@ HIT_REQUIRED_ATTRIBUTES = (
   'block-id', 'source-language', 'target-language'
 )
 
+# Hotfix potentially wrong ISO codes;  we are using ISO-639-3.
+ISO_639_2_TO_3_MAPPING = {'cze': 'ces', 'fre': 'fra', 'ger': 'deu'}
+
+# Pre-extracted data for a validated <hit> element;  index is the position
+# of the <hit> in its file, if set by appraise.wmt13.importer.number_records.
+HITRecord = namedtuple('HITRecord',
+  'block_id attributes hit_xml segments content_hash index')
+
+# Pre-extracted data for a validated <seg> element;  source and reference
+# are (text, attrib) tuples, translations is a list of such tuples.
+SegmentRecord = namedtuple('SegmentRecord',
+  'item_xml attributes source reference translations systems content_hash')
+
+
+def compute_content_hash(*values):
+    """
+    Returns the SHA-1 hex digest of the canonical JSON form of values.
+    
+    Values are extracted texts and attribute dicts;  as dict keys are sorted,
+    neither XML formatting nor attribute order change the hash.
+    
+    """
+    return sha1(dumps(values, sort_keys=True, separators=(',', ':'))) \
+      .hexdigest()
+
+
+def get_language_pair(attrib):
+    """
+    Returns the language pair code for the given <hit> attributes.
+    """
+    language_pair = '{0}2{1}'.format(attrib["source-language"],
+      attrib["target-language"])
+    
+    for part2_code, part3_code in ISO_639_2_TO_3_MAPPING.items():
+        language_pair = language_pair.replace(part2_code, part3_code)
+    
+    return language_pair
+
 
 def validate_hits_xml_file(value):
     """
@@ -65,41 +107,124 @@ def validate_hit_xml(value):
         else:
             _tree = fromstring(value.encode("utf-8"))
         
-        # Then, we check that the top-level tag name is <hits>.
-        assert(_tree.tag == 'hit'), 'expected <hit> on top-level'
-        
-        # Check if there exists a "systems" XML attribute on <hit> level.
-        systems_available = 'systems' in _tree.attrib.keys()
-        
-        # And that required XML attributes are available.
-        for _attr in HIT_REQUIRED_ATTRIBUTES:
-            assert(_attr in _tree.attrib.keys()), \
-              'missing required <hit> attribute {0}'.format(_attr)
-        
-        # Make sure that block-id is an integer value!
-        try:
-            _block_id = _tree.attrib['block-id']
-            _block_id = int(_block_id)
-        
-        except ValueError, msg:
-            raise ValidationError('Invalid block-id: "{0}", {1}.'.format(
-              _block_id, msg))
+        _check_hit_element(_tree)
+    
+    except (AssertionError, ParseError), msg:
+        raise ValidationError('Invalid XML: "{0}".'.format(msg))
+    
+    return value
+
+
+def _check_hit_element(_tree):
+    """
+    Checks the given <hit> element and all its <seg> children.
+    
+    Returns the integer block-id.  Raises AssertionError or ValidationError.
+    
+    """
+    # First, we check that the top-level tag name is <hit>.
+    assert(_tree.tag == 'hit'), 'expected <hit> on top-level'
+    
+    # Check if there exists a "systems" XML attribute on <hit> level.
+    systems_available = 'systems' in _tree.attrib.keys()
+    
+    # And that required XML attributes are available.
+    for _attr in HIT_REQUIRED_ATTRIBUTES:
+        assert(_attr in _tree.attrib.keys()), \
+          'missing required <hit> attribute {0}'.format(_attr)
+    
+    # Bulk imports bypass HIT.full_clean(), so we check the language pair
+    # here.  Imported locally as appraise.wmt13.models imports this module.
+    from appraise.wmt13.models import LANGUAGE_PAIR_CHOICES
+    _language_pair = get_language_pair(_tree.attrib)
+    if _language_pair not in [x[0] for x in LANGUAGE_PAIR_CHOICES]:
+        raise ValidationError('Invalid language pair: "{0}".'.format(
+          _language_pair))
+    
+    # Make sure that block-id is an integer value!
+    try:
+        _block_id = _tree.attrib['block-id']
+        _block_id = int(_block_id)
+    
+    except ValueError, msg:
+        raise ValidationError('Invalid block-id: "{0}", {1}.'.format(
+          _block_id, msg))
+    
+    # Finally, we check that each <hit> contains exactly 3 children
+    # which are <seg> containers with <source>, <reference> and a
+    # total of 5 <translation> elements. The <reference> is mandatory.
+    # The <translation> elements require some text value to be valid.
+    _no_of_children = 0
+    for _seg in _tree:
+        validate_segment_xml(_seg, require_systems=not systems_available)
+        _no_of_children += 1
+    
+    assert(_no_of_children == 3), 'expected 3 <seg> children'
+    
+    return _block_id
+
+
+def extract_hit_record(element):
+    """
+    Validates the given <hit> element and returns its HITRecord.
+    
+    All data needed to create HIT and RankingTask objects is extracted from
+    the element tree, hence it does not need to be parsed or validated again.
+    
+    """
+    try:
+        _block_id = _check_hit_element(element)
+    
+    except AssertionError, msg:
+        raise ValidationError('Invalid XML: "{0}".'.format(msg))
+    
+    _hit_systems = element.attrib.get('systems')
+    if _hit_systems:
+        _hit_systems = _hit_systems.split(',')
+    
+    segments = []
+    for _seg in element:
+        _source = _seg.find('source')
+        _reference = _seg.find('reference')
+        translations = [(x.text, x.attrib) for x in
+          _seg.iterfind('translation')]
+        systems = _hit_systems or [x[1]['system'] for x in translations]
+        source = (_source.text, _source.attrib)
+        reference = (_reference.text, _reference.attrib)
+        segments.append(SegmentRecord(tostring(_seg), _seg.attrib, source,
+          reference, translations, systems, compute_content_hash(
+          _seg.attrib, source, reference, translations)))
+    
+    content_hash = compute_content_hash(element.attrib,
+      [x.content_hash for x in segments])
+    return HITRecord(_block_id, dict(element.attrib),
+      tostring(element, encoding="utf-8").decode('utf-8'), segments,
+      content_hash, None)
+
+
+def parse_hits_xml_file(value):
+    """
+    Parses and validates the given HITs XML source in a single pass.
+    
+    Returns a list of HITRecord instances.  The given value can either be an
+    XML string or an ElementTree.  Raises ValidationError if any HIT is
+    invalid, hence nothing is returned for partially valid files.
+    
+    """
+    try:
+        if isinstance(value, Element):
+            _tree = value
         
-        # Finally, we check that each <hit> contains exactly 3 children
-        # which are <seg> containers with <source>, <reference> and a
-        # total of 5 <translation> elements. The <reference> is mandatory.
-        # The <translation> elements require some text value to be valid.
-        _no_of_children = 0
-        for _seg in _tree:
-            validate_segment_xml(_seg, require_systems=not systems_available)
-            _no_of_children += 1
+        else:
+            _tree = fromstring(value.encode("utf-8"))
         
-        assert(_no_of_children == 3), 'expected 3 <seg> children'
+        # Then, we check that the top-level tag name is <hits>.
+        assert(_tree.tag == 'hits'), 'expected <hits> on top-level'
     
     except (AssertionError, ParseError), msg:
         raise ValidationError('Invalid XML: "{0}".'.format(msg))
     
-    return value
+    return [extract_hit_record(_child) for _child in _tree]
 
 
 def validate_segment_xml(value, require_systems=False):
@@ -149,3 +274,128 @@ def validate_segment_xml(value, require_systems=False):
     
     except (AssertionError, ParseError), msg:
         raise ValidationError('Invalid XML: "{0}".'.format(msg))
+
+
+def iter_hits_xml_file(source):
+    """
+    Incrementally parses and validates the HITs XML file at source.
+    
+    Yields one HITRecord per <hit> element.  Each element is freed once its
+    record has been extracted, hence memory use does not depend on the file
+    size.  Raises ValidationError for the first invalid HIT, after all
+    previous HITs have been yielded.
+    
+    """
+    try:
+        _root = None
+        _depth = 0
+        _pending = None
+        for _event, _element in iterparse(source, events=('start', 'end')):
+            if _event == 'start':
+                if _root is None:
+                    _root = _element
+                    assert(_root.tag == 'hits'), \
+                      'expected <hits> on top-level'
+                
+                # A <hit> element, including its tail, is complete once the
+                # next one starts;  it is then removed from the tree.
+                elif _depth == 1 and _pending is not None:
+                    yield extract_hit_record(_pending)
+                    _root.remove(_pending)
+                    _pending = None
+                
+                _depth += 1
+                continue
+            
+            _depth -= 1
+            if _depth == 1:
+                _pending = _element
+            
+            elif _depth == 0 and _pending is not None:
+                yield extract_hit_record(_pending)
+    
+    except (AssertionError, ParseError), msg:
+        raise ValidationError('Invalid XML: "{0}".'.format(msg))
+
+
+def iter_hits_xml_fragments(path, fragment_size=1 << 20):
+    """
+    Splits the HITs XML file at path into fragments of complete <hit>s.
+    
+    Each fragment is a byte string of roughly fragment_size bytes containing
+    consecutive <hit> elements, including their trailing whitespace, so that
+    fragments can be validated independently and in parallel.  Splitting is
+    done on the raw text without parsing;  hence, <hit> tags must not occur
+    inside comments or CDATA sections.
+    
+    """
+    with open(path, 'rb') as infile:
+        _buffer = ''
+        _start = -1
+        while _start < 0:
+            _data = infile.read(fragment_size)
+            if not _data:
+                raise ValidationError('Invalid XML: "expected <hits> on ' \
+                  'top-level".')
+            _buffer += _data
+            _start = _buffer.find('<hits')
+        
+        # Skip the XML declaration and the <hits> start tag.
+        _end = _buffer.find('>', _start)
+        while _end < 0:
+            _data = infile.read(fragment_size)
+            if not _data:
+                raise ValidationError('Invalid XML: "unclosed <hits> tag".')
+            _buffer += _data
+            _end = _buffer.find('>', _start)
+        _buffer = _buffer[_end + 1:]
+        
+        while True:
+            _data = infile.read(fragment_size)
+            _buffer += _data
+            
+            if not _data:
+                _end = _buffer.rfind('</hits>')
+                if _end < 0:
+                    raise ValidationError('Invalid XML: "missing </hits> ' \
+                      'end tag".')
+                if _buffer[:_end].strip():
+                    yield _buffer[:_end]
+                return
+            
+            # Cut after the last complete <hit> and its trailing whitespace.
+            _cut = _buffer.rfind('</hit>')
+            if _cut < 0:
+                continue
+            _cut += len('</hit>')
+            while _cut < len(_buffer) and _buffer[_cut].isspace():
+                _cut += 1
+            
+            if _cut < len(_buffer):
+                yield _buffer[:_cut]
+                _buffer = _buffer[_cut:]
+
+
+def extract_hits_xml_fragment(fragment):
+    """
+    Validates the <hit> elements in the given fragment.
+    
+    Returns a tuple (records, error) where error is None or the message of
+    the first ValidationError, in which case records contains the HITRecord
+    instances of all previous HITs.  Errors are returned instead of raised
+    s.t. this can be used as a multiprocessing worker.
+    
+    """
+    records = []
+    try:
+        _tree = fromstring('<hits>{0}</hits>'.format(fragment))
+        for _child in _tree:
+            records.append(extract_hit_record(_child))
+    
+    except ParseError, msg:
+        return (records, u'Invalid XML: "{0}".'.format(msg))
+    
+    except ValidationError, msg:
+        return (records, u'; '.join(msg.messages))
+    
+    return (records, None)
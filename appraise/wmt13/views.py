@@ -10,17 +10,26 @@ from os.path import join
 from random import seed, shuffle
 from subprocess import check_output
 from tempfile import gettempdir
+from threading import Lock, Thread
+from time import sleep, time
 from urllib import unquote
 
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.models import Group
 from django.core.exceptions import ObjectDoesNotExist, MultipleObjectsReturned
+from django.db import connection
 from django.http import HttpResponse, HttpResponseForbidden
 from django.shortcuts import get_object_or_404, redirect, render
 
+from appraise.logqueue import LazyLines, LazyMessage
+from appraise.metrics import increment, timed
+from appraise.snapshots import acquire_lock, get_snapshot, release_lock, \
+  set_snapshot
 from appraise.wmt13.models import LANGUAGE_PAIR_CHOICES, UserHITMapping, \
-  HIT, RankingTask, RankingResult, UserHITMapping
-from appraise.settings import LOG_LEVEL, LOG_HANDLER, COMMIT_TAG, ROOT_PATH
+  HIT, LanguagePairStatus, RankingTask, RankingResult, UserHITMapping
+from appraise.settings import LOG_LEVEL, LOG_HANDLER, COMMIT_TAG, \
+  ROOT_PATH, SNAPSHOT_LOCK_TIMEOUT, SNAPSHOT_MAX_AGE, STATUS_MAX_AGE, \
+  STATUS_TIME_BUDGET, WMT13_HIT_ALLOCATION_POLICY
 from appraise.utils import datetime_to_seconds, seconds_to_timedelta
 
 # Setup logging support.
@@ -28,11 +37,25 @@ logging.basicConfig(level=LOG_LEVEL)
 LOGGER = logging.getLogger('appraise.wmt13.views')
 LOGGER.addHandler(LOG_HANDLER)
 
+# Modules using NumPy are imported by the functions which need them, hence
+# workers only load NumPy once statistics are actually computed.
+
 # We keep status and ranking information available in memory to speed up
-# access and avoid lengthy delays caused by computation of this data.
+# access and avoid lengthy delays caused by computation of this data.  Both
+# caches are shared with other processes using appraise.snapshots.
 STATUS_CACHE = {}
 RANKINGS_CACHE = {}
 
+# Creation times of the STATUS_CACHE values, in seconds since the epoch, and
+# the background threads refreshing them.  There is at most one refresh per
+# status key and process;  lock files coordinate refreshes across processes.
+STATUS_CREATED = {}
+STATUS_REFRESHES = {}
+STATUS_LOCK = Lock()
+
+# Seconds between two checks for a status snapshot of another process.
+STATUS_POLL_SECONDS = 0.5
+
 
 def _compute_next_task_for_user(user, language_pair):
     """
@@ -45,6 +68,18 @@ def _compute_next_task_for_user(user, language_pair):
     xxx and yyy are ISO-639-3 language codes.
 
     """
+    with timed('appraise_hit_assignment_seconds',
+      language_pair=language_pair):
+        return _find_next_task_for_user(user, language_pair)
+
+
+def _find_next_task_for_user(user, language_pair):
+    """
+    Implements _compute_next_task_for_user(), without timing.
+    """
+    # Group instances are compared with language pair codes below.
+    language_pair = unicode(language_pair)
+    
     # Check if language_pair is valid for the given user.
     if not user.groups.filter(name=language_pair):
         LOGGER.debug('User {0} does not know language pair {1}.'.format(
@@ -62,6 +97,15 @@ def _compute_next_task_for_user(user, language_pair):
         LOGGER.debug('No current HIT for user {0}, fetching HIT.'.format(
           user))
         
+        # Saturated language pairs are only used if the user cannot work on
+        # any other language pair which still has HITs left.
+        saturated = LanguagePairStatus.get_saturated_language_pairs()
+        if language_pair in saturated \
+          and _has_open_language_pair(user, saturated):
+            LOGGER.debug('Language pair {0} is saturated, skipping.'.format(
+              language_pair))
+            return None
+        
         # Compatible HIT instances need to match the given language pair!
         # Furthermore, they need to be active and not reserved for MTurk.
         hits = HIT.objects.filter(language_pair=language_pair, active=True,
@@ -71,6 +115,11 @@ def _compute_next_task_for_user(user, language_pair):
         block_ids = list(hits.values_list('block_id', flat=True))
         shuffle(block_ids)
         
+        # Optionally, try HITs comparing unresolved system pairs first.
+        if WMT13_HIT_ALLOCATION_POLICY == 'uncertainty':
+            from appraise.wmt13.allocation import prioritize_block_ids
+            block_ids = prioritize_block_ids(language_pair, block_ids)
+        
         # Find the next HIT for the current user.  Keep track of compatible
         # HITs with one or two rankings in case there is no pristine HIT left.
         hit_with_one_ranking = None
@@ -115,6 +164,8 @@ def _compute_next_task_for_user(user, language_pair):
         # Update User/HIT mappings s.t. the system knows about the next HIT.
         current_hitmap = UserHITMapping.objects.create(user=user,
           hit=random_hit)
+        increment('appraise_hits_assigned_total',
+          language_pair=language_pair)
     
     # Otherwise, select first match from QuerySet.
     else:
@@ -129,7 +180,7 @@ def _compute_next_task_for_user(user, language_pair):
             LOGGER.debug('Detected stale User/HIT mapping {0}->{1}'.format(
               user, current_hitmap.hit))
             current_hitmap.delete()
-            return _compute_next_task_for_user(user, language_pair)
+            return _find_next_task_for_user(user, language_pair)
     
     LOGGER.debug('User {0} currently working on HIT {1}'.format(user,
       current_hitmap.hit))
@@ -137,13 +188,23 @@ def _compute_next_task_for_user(user, language_pair):
     return current_hitmap.hit
 
 
+def _has_open_language_pair(user, saturated):
+    """
+    Checks if the given user knows a language pair which is not saturated
+    and still has HITs without any annotator left.
+    """
+    language_pairs = set([x[0] for x in LANGUAGE_PAIR_CHOICES])
+    _open = user.groups.filter(name__in=language_pairs.difference(
+      saturated)).values_list('name', flat=True)
+    return HIT.objects.filter(language_pair__in=list(_open), active=True,
+      mturk_only=False, users__isnull=True).exists()
+
+
+@timed('appraise_result_submission_seconds', app='wmt13')
 def _save_results(item, user, duration, raw_result):
     """
     Creates or updates the RankingResult for the given item and user.
     """
-    LOGGER.debug('item: {}, user: {}, duration: {}, raw_result: {}'.format(
-      item, user, duration, raw_result.encode('utf-8')))
-    
     _existing_result = RankingResult.objects.filter(item=item, user=user)
     
     if _existing_result:
@@ -152,14 +213,15 @@ def _save_results(item, user, duration, raw_result):
     else:
         _result = RankingResult(item=item, user=user)
     
-    LOGGER.debug(u'\n\nResults data for user "{0}":\n\n{1}\n'.format(
-      user.username or "Anonymous",
-      u'\n'.join([str(x) for x in [_result, duration, raw_result]])))
+    LOGGER.debug(LazyMessage(u'Results data for user "{0}": item: {1}, ' \
+      'result: {2}, duration: {3}, raw_result: {4}', user.username or
+      "Anonymous", item.id, _result.id, duration, raw_result))
     
     _result.duration = str(duration)
     _result.raw_result = raw_result
     
     _result.save()
+    increment('appraise_results_saved_total', app='wmt13')
 
 
 def _find_next_item_to_process(items, user, random_order=False):
@@ -276,13 +338,6 @@ def _handle_ranking(request, task, items):
             _raw_result = range(len(current_item.translations))
             _raw_result = ','.join([str(ranks[x]) for x in _raw_result])
         
-        _results_data = [current_item, type(current_item), request.user,
-          type(request.user), duration, type(duration), _raw_result,
-          type(_raw_result)]
-        LOGGER.debug(u'\n\nResults data for user "{0}":\n\n{1}\n'.format(
-          request.user.username or "Anonymous",
-          u'\n'.join([str(x) for x in _results_data])))
-        
         # Save results for this item to the Django database.
         _save_results(current_item, request.user, duration, _raw_result)
     
@@ -483,12 +538,11 @@ def mturk_handler(request):
       'srcIndex_3': srcIndex_3,
     }
     
-    LOGGER.debug(u'\n\nMTurk data for HIT "{0}":\n\n{1}\n'.format(
-      hit.hit_id,
-      u'\n'.join([u'{0}\t->\t{1}'.format(*x) for x in dictionary.items()])))
+    LOGGER.debug(LazyMessage(u'\n\nMTurk data for HIT "{0}":\n\n{1}\n',
+      hit.hit_id, LazyLines(dictionary.items(), u'{0}\t->\t{1}')))
     
-    LOGGER.debug(u'\n\nMETA request data:\n\n{0}\n'.format(
-      u'\n'.join([u'{0}: {1}'.format(*x) for x in request.META.items()])))
+    LOGGER.debug(LazyMessage(u'\n\nMETA request data:\n\n{0}\n',
+      LazyLines(request.META.items())))
     
     return render(request, 'wmt13/mturk_ranking.html', dictionary)
 
@@ -506,7 +560,10 @@ def overview(request):
     
     # Collect available language pairs for the current user.
     language_codes = set([x[0] for x in LANGUAGE_PAIR_CHOICES])
-    language_pairs = request.user.groups.filter(name__in=language_codes)
+    language_pairs = request.user.groups.filter(name__in=language_codes) \
+      .values_list('name', flat=True)
+    
+    saturated = LanguagePairStatus.get_saturated_language_pairs()
     
     hit_data = []
     total = [0, 0, 0]
@@ -523,7 +580,7 @@ def overview(request):
             
             hit_data.append(
               (hit.get_language_pair_display(), hit.get_absolute_url(),
-               hit.block_id, user_status)
+               hit.block_id, user_status, hit.language_pair in saturated)
             )
     
     # Convert total seconds back into datetime.timedelta instances.
@@ -554,9 +611,9 @@ def overview(request):
         group_status = None
         group_name = None
     
-    LOGGER.debug(u'\n\nHIT data for user "{0}":\n\n{1}\n'.format(
+    LOGGER.debug(LazyMessage(u'\n\nHIT data for user "{0}":\n\n{1}\n',
       request.user.username or "Anonymous",
-      u'\n'.join([u'{0}\t{1}\t{2}\t{3}'.format(*x) for x in hit_data])))
+      LazyLines(hit_data, u'{0}\t{1}\t{2}\t{3}')))
     
     dictionary = {
       'active_page': "OVERVIEW",
@@ -571,33 +628,138 @@ def overview(request):
     return render(request, 'wmt13/overview.html', dictionary)
 
 
+def _load_status_snapshot(status_key, max_age):
+    """
+    Fills STATUS_CACHE from a newer snapshot, returns True on success.
+    """
+    _snapshot = get_snapshot('wmt13.status.{0}'.format(status_key),
+      max_age=max_age)
+    if _snapshot is None or \
+      _snapshot[0] <= STATUS_CREATED.get(status_key, 0):
+        return False
+    
+    STATUS_CREATED[status_key], STATUS_CACHE[status_key] = _snapshot
+    return True
+
+
+def _refresh_status(status_key):
+    """
+    Refreshes the given status key, unless another process already does.
+    
+    In that case, we wait for the snapshot written by the other process or
+    take over if its lock is released without a fresh snapshot.
+    
+    """
+    _lock_key = 'wmt13.status.{0}'.format(status_key)
+    _deadline = time() + SNAPSHOT_LOCK_TIMEOUT
+    try:
+        while time() < _deadline:
+            if _load_status_snapshot(status_key, STATUS_MAX_AGE):
+                break
+            
+            if acquire_lock(_lock_key):
+                try:
+                    update_status(key=status_key)
+                
+                finally:
+                    release_lock(_lock_key)
+                break
+            
+            sleep(STATUS_POLL_SECONDS)
+    
+    # Errors would otherwise only be printed to stderr by the thread.
+    # pylint: disable-msg=W0703
+    except Exception:
+        LOGGER.exception('Could not refresh status {0}.'.format(status_key))
+    
+    finally:
+        # Background threads use database connections of their own.
+        connection.close()
+        with STATUS_LOCK:
+            STATUS_REFRESHES.pop(status_key, None)
+
+
+def _start_status_refresh(status_key):
+    """
+    Returns the thread refreshing the given status key, starting it if needed.
+    """
+    with STATUS_LOCK:
+        _thread = STATUS_REFRESHES.get(status_key)
+        if _thread is None or not _thread.is_alive():
+            _thread = Thread(target=_refresh_status, args=(status_key,),
+              name='appraise-status-{0}'.format(status_key))
+            _thread.daemon = True
+            STATUS_REFRESHES[status_key] = _thread
+            _thread.start()
+    
+    return _thread
+
+
 @login_required
 def status(request):
     """
     Renders the status overview.
+    
+    Outdated status data is served while it is refreshed in the background.
+    Missing data is waited for at most STATUS_TIME_BUDGET seconds;  after
+    that, the page shows which data is still being computed.
+    
     """
     LOGGER.info('Rendering WMT13 HIT status for user "{0}".'.format(
       request.user.username or "Anonymous"))
     
-    if not STATUS_CACHE.has_key('global_stats'):
-        update_status(key='global_stats')
-    
-    if not STATUS_CACHE.has_key('language_pair_stats'):
-        update_status(key='language_pair_stats')
-    
-    if not STATUS_CACHE.has_key('group_stats'):
-        update_status(key='group_stats')
-    
-    if not STATUS_CACHE.has_key('user_stats'):
-        update_status(key='user_stats')
+    refreshes = []
+    for status_key in ('global_stats', 'language_pair_stats', 'group_stats',
+      'user_stats', 'convergence_stats'):
+        if STATUS_CACHE.has_key(status_key) and \
+          time() - STATUS_CREATED.get(status_key, 0) <= STATUS_MAX_AGE:
+            increment('appraise_cache_requests_total', cache='status',
+              result='hit')
+            continue
+        
+        # Use a newer snapshot computed by another process, if available.
+        _loaded = _load_status_snapshot(status_key, None if
+          STATUS_CACHE.has_key(status_key) else SNAPSHOT_MAX_AGE)
+        if _loaded and \
+          time() - STATUS_CREATED[status_key] <= STATUS_MAX_AGE:
+            increment('appraise_cache_requests_total', cache='status',
+              result='snapshot')
+        
+        elif STATUS_CACHE.has_key(status_key):
+            increment('appraise_cache_requests_total', cache='status',
+              result='stale')
+            _start_status_refresh(status_key)
+        
+        else:
+            increment('appraise_cache_requests_total', cache='status',
+              result='miss')
+            refreshes.append((status_key, _start_status_refresh(status_key)))
+    
+    _deadline = time() + STATUS_TIME_BUDGET
+    computing = []
+    for status_key, thread in refreshes:
+        thread.join(max(0, _deadline - time()))
+        if not STATUS_CACHE.has_key(status_key):
+            computing.append(status_key)
+    
+    if computing:
+        LOGGER.info('Status {0} still being computed.'.format(
+          ', '.join(computing)))
+    
+    if not RANKINGS_CACHE.has_key('clusters'):
+        _snapshot = get_snapshot('wmt13.rankings.clusters')
+        if _snapshot is not None:
+            RANKINGS_CACHE['clusters'] = _snapshot[1]
     
     dictionary = {
       'active_page': "STATUS",
-      'global_stats': STATUS_CACHE['global_stats'],
-      'language_pair_stats': STATUS_CACHE['language_pair_stats'],
-      'group_stats': STATUS_CACHE['group_stats'],
-      'user_stats': STATUS_CACHE['user_stats'],
+      'global_stats': STATUS_CACHE.get('global_stats'),
+      'language_pair_stats': STATUS_CACHE.get('language_pair_stats'),
+      'group_stats': STATUS_CACHE.get('group_stats'),
+      'user_stats': STATUS_CACHE.get('user_stats'),
+      'convergence_stats': STATUS_CACHE.get('convergence_stats'),
       'clusters': RANKINGS_CACHE.get('clusters', []),
+      'computing': computing,
       'commit_tag': COMMIT_TAG,
       'title': 'WMT13 Status',
     }
@@ -605,7 +767,7 @@ def status(request):
     return render(request, 'wmt13/status.html', dictionary)
 
 
-def update_ranking(request=None):
+def update_ranking(request=None, load_file=False):
     """
     Updates the in-memory RANKINGS_CACHE dictionary.
     
@@ -614,13 +776,21 @@ def update_ranking(request=None):
     evaluation has ended, we will re-work this into a fully integrated, Python
     based solution...
     
+    When called as a view or with load_file=True, the output of the last
+    run of the Perl script is loaded instead.
+    
     """
-    if request is not None:
+    if request is not None or load_file:
         RANKINGS_CACHE['clusters'] = _compute_ranking_clusters(load_file=True)
-        return HttpResponse('Ranking updated successfully')
     
     else:
-        RANKINGS_CACHE['clusters'] = _compute_ranking_clusters()
+        with timed('appraise_ranking_recomputation_seconds', method='perl'):
+            RANKINGS_CACHE['clusters'] = _compute_ranking_clusters()
+    
+    set_snapshot('wmt13.rankings.clusters', RANKINGS_CACHE['clusters'])
+    
+    if request is not None:
+        return HttpResponse('Ranking updated successfully')
 
 
 def update_status(request=None, key=None):
@@ -628,24 +798,29 @@ def update_status(request=None, key=None):
     Updates the in-memory STATUS_CACHE dictionary.
     """
     status_keys = ('global_stats', 'language_pair_stats', 'group_stats',
-      'user_stats', 'clusters')
+      'user_stats', 'convergence_stats', 'clusters')
     
     # If a key is given, we only update the requested sub status.
     if key:
         status_keys = (key,)
     
+    compute_functions = {
+      'global_stats': _compute_global_stats,
+      'language_pair_stats': _compute_language_pair_stats,
+      'group_stats': _compute_group_stats,
+      'user_stats': _compute_user_stats,
+      'convergence_stats': _compute_convergence_stats,
+    }
+    
     for status_key in status_keys:
-        if status_key == 'global_stats':
-            STATUS_CACHE[status_key] = _compute_global_stats()
-        
-        elif status_key == 'language_pair_stats':
-            STATUS_CACHE[status_key] = _compute_language_pair_stats()
+        if not compute_functions.has_key(status_key):
+            continue
         
-        elif status_key == 'group_stats':
-            STATUS_CACHE[status_key] = _compute_group_stats()
+        with timed('appraise_status_refresh_seconds', key=status_key):
+            STATUS_CACHE[status_key] = compute_functions[status_key]()
         
-        elif status_key == 'user_stats':
-            STATUS_CACHE[status_key] = _compute_user_stats()
+        STATUS_CREATED[status_key] = set_snapshot(
+          'wmt13.status.{0}'.format(status_key), STATUS_CACHE[status_key])
     
     if request is not None:
         return HttpResponse('Status updated successfully')
@@ -741,6 +916,30 @@ def _compute_language_pair_stats():
     return language_pair_stats
 
 
+def _compute_convergence_stats():
+    """
+    Returns the convergence status per language pair.
+    
+    The status is only read here;  checks are run and stored by
+    monitor_wmt13_convergence.py, hence viewing the status page does not
+    change which language pairs are saturated.
+    
+    """
+    convergence_stats = []
+    
+    _statuses = dict([(x.language_pair, x)
+      for x in LanguagePairStatus.objects.all()])
+    for choice in LANGUAGE_PAIR_CHOICES:
+        status = _statuses.get(choice[0],
+          LanguagePairStatus(language_pair=choice[0]))
+        convergence_stats.append((status.get_language_pair_display(),
+          status.is_saturated(), status.override is not None,
+          status.stable_checks, status.judgments, status.checked,
+          status.clusters))
+    
+    return convergence_stats
+
+
 def _compute_group_stats():
     """
     Computes group statistics for the WMT13 evaluation campaign.
@@ -830,25 +1029,13 @@ def _compute_ranking_clusters(load_file=False):
     
     # If not loading cluster data from file, re-compute everything.
     if not load_file:
-        results = [u'srclang,trglang,srcIndex,documentId,segmentId,judgeId,' \
-          'system1Number,system1Id,system2Number,system2Id,system3Number,' \
-          'system3Id,system4Number,system4Id,system5Number,system5Id,' \
-          'system1rank,system2rank,system3rank,system4rank,system5rank']
+        from appraise.wmt13.analytics import iter_database_rankings, \
+          write_csv
         
         # Compute current dump of WMT13 results in CSV format. We ignore any
         # results which are incomplete, i.e. have been SKIPPED.
-        for result in RankingResult.objects.filter(item__hit__active=True,
-          item__hit__mturk_only=False):
-            _csv_output = result.export_to_csv()
-            if not _csv_output.endswith('-1,-1,-1,-1,-1'):
-                results.append(_csv_output)
-        
-        results.append('')
-        export_csv = u"\n".join(results)
-        
-        # Write current dump of results to file.
         with open(_wmt13, 'w') as outfile:
-            outfile.write(export_csv)
+            write_csv(iter_database_rankings(), outfile)
         
         # Run Philipp's Perl script to compute ranking clusters.
         PERL_OUTPUT = check_output(['perl', _script, _wmt13, _mturk], shell=True)